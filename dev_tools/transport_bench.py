@@ -0,0 +1,116 @@
+# Transport Benchmark -- latency and throughput of every transport profile over loopback (or a socket file)
+# python transport_bench.py [--unix] [--rounds N] [--megabytes N]
+import os
+import sys
+import socket
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # run from any folder
+from simple_server import *
+
+ROUNDS = 2000 # chat messages echoed per profile
+BURST = 4 # messages sent back to back before waiting for their echoes (Nagle holds all but the first)
+MEGABYTES = 64 # size of the file sent per profile
+MESSAGE = bytes(announce('BENCH','how is everyone doing today?'),ENCODING)
+
+# apply a profile (None = leave the system defaults, for comparison)
+def tune(sock,profile,channel):
+	if profile:
+		tune_socket(sock,profile,channel)
+
+# connected (client, server) sockets -- tuned the same way the server and client tune theirs
+def make_pair(profile,channel,unix):
+	if unix:
+		path = os.path.join(tempfile.mkdtemp(),'bench.sock')
+		listener = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+		listener.bind(path)
+	else:
+		listener = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+		listener.bind(('127.0.0.1',0))
+	tune(listener,profile,channel)
+	listener.listen(1)
+	client = socket.socket(listener.family,socket.SOCK_STREAM)
+	tune(client,profile,channel)
+	client.connect(listener.getsockname())
+	server, address = listener.accept()
+	tune(server,profile,channel)
+	listener.close()
+	if unix:
+		os.remove(path)
+	for sock in [client, server]:
+		set_protocol(sock,PROTOCOL_VERSION,['fragments'])
+	return client, server
+
+# average microseconds until a burst of chat messages is echoed back
+def measure_latency(profile,unix):
+	client, server = make_pair(profile,CHANNEL_CHAT,unix)
+	echo = threading.Thread(target=receive_data,args=(server,lambda data: send_data(server,data)),daemon=True)
+	echo.start()
+	start = time.perf_counter()
+	for i in range(ROUNDS // BURST):
+		for j in range(BURST):
+			send_data(client,MESSAGE)
+		for j in range(BURST):
+			receive_data(client)
+	elapsed = time.perf_counter() - start
+	client.close()
+	server.close()
+	return elapsed / (ROUNDS // BURST) * 1e6
+
+# megabytes per second for a file sent on the command channel
+def measure_throughput(profile,unix,path):
+	client, server = make_pair(profile,CHANNEL_COMMAND,unix)
+	result = []
+	receiver = threading.Thread(target=lambda: result.append(download_file(server,os.devnull,False)),daemon=True)
+	start = time.perf_counter()
+	receiver.start()
+	upload_file(client,path,False)
+	receiver.join()
+	elapsed = time.perf_counter() - start
+	client.close()
+	server.close()
+	if result != [SUCCESS]:
+		return 0
+	return MEGABYTES / elapsed
+
+def main():
+	global ROUNDS, MEGABYTES
+	unix = False
+	options = sys.argv[1:]
+	while options:
+		flag = options.pop(0)
+		if flag == '--unix':
+			unix = True
+		elif flag == '--rounds' and options:
+			ROUNDS = int(options.pop(0))
+		elif flag == '--megabytes' and options:
+			MEGABYTES = int(options.pop(0))
+
+	# file to send -- random bytes so nothing along the way can shrink it
+	with tempfile.NamedTemporaryFile(delete=False) as file:
+		for i in range(MEGABYTES):
+			file.write(os.urandom(1 << 20))
+	transport = 'unix socket' if unix else 'tcp loopback'
+	screen.add(f'Transport Benchmark - {transport} | {ROUNDS} messages in bursts of {BURST} | {MEGABYTES} MB file', screen.ATR_HIGHLIGHT)
+	screen.add()
+	results = [f'{"profile":<14}{"burst latency":>16}{"throughput":>16}']
+	screen.add(results[0])
+	screen.display()
+	try:
+		for profile in [None] + list(TRANSPORT_PROFILES):
+			latency = measure_latency(profile,unix)
+			throughput = measure_throughput(profile,unix,file.name)
+			results.append(f'{profile or "(untuned)":<14}{latency:>13.0f} us{throughput:>11.0f} MB/s')
+			screen.add(results[-1])
+			screen.display()
+	finally:
+		os.remove(file.name)
+	screen.add()
+	screen.pause()
+	screen.close()
+	print('\n'.join(results)) # keep the table once the screen is gone
+
+if __name__ == '__main__':
+	main()
@@ -5,20 +5,26 @@ import pickle
 import os
 import sys
 import time
+import secrets
 
 from simple_server import *
 
 class User():
 	def __init__(self):
 		# necessary items
-		self.sock = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
-		self.cmd_sock = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+		self.sock = new_socket()
+		self.cmd_sock = new_socket(CHANNEL_COMMAND)
 		self.username = '' # blank until authenticated
 		self.admin = False # determines privileges
 		self.responding = False # indicates an answer protocol is in progress
+		self.answered = threading.Event() # set when the response is in output
 		self.processing = False # indicates an external cmd is in progress
+		self.uploading = False # a single-request send is streaming a file to the server
 		self.disconnecting = False # user is in the process of leaving the server
 		self.auto_reconnect = True # attempt to reconnect on error
+		self.reconnect_delay = 0 # seconds the server asked to wait before reconnecting (it is shutting down)
+		self.mux = None # set when chat and commands share one connection
+		self.pinging = False # a heartbeat is still being written (the server is not reading)
 
 	def connect(self,addr,port):
 		if screen.show_box: # hide box
@@ -27,13 +33,13 @@ class User():
 		screen.display()
 		try:
 			socket.setdefaulttimeout(6) #$ max wait time
-			self.sock.connect((addr, port))
+			self.sock.connect(server_endpoint(addr,port))
 			socket.setdefaulttimeout(None) # can wait indefinitely
-			screen.add(f'successfully connected to {addr}:{port}', screen.ATR_SUCCESS)
+			screen.add(f'successfully connected to {show_endpoint(addr,port)}', screen.ATR_SUCCESS)
 			screen.display(1)
 			return SUCCESS
 		except socket.error as e:
-			screen.add(f'Err.3 - could not connect to {addr}:{port}', screen.ATR_ALERT)
+			screen.add(f'Err.3 - could not connect to {show_endpoint(addr,port)}', screen.ATR_ALERT)
 			if DEBUG:
 				screen.add(str(e))
 			screen.pause(1)
@@ -43,8 +49,14 @@ class User():
 
 	def reconnect(self,addr,port,max_attempts=3,wait_time=3):
 		# create new socket objects
-		self.sock = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
-		self.cmd_sock = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+		self.sock = new_socket()
+		self.cmd_sock = new_socket(CHANNEL_COMMAND)
+		self.mux = None
+		if self.reconnect_delay: # give the server time to come back
+			screen.add(f'waiting {self.reconnect_delay}s for the server to restart...', screen.ATR_NOTICE)
+			screen.display(1)
+			self.wait(self.reconnect_delay,'Restarting')
+			self.reconnect_delay = 0
 		test = 0 # track attempts made to reconnect
 		while test < max_attempts:
 			screen.add('attempting to reconnect...', screen.ATR_NOTICE)
@@ -52,23 +64,36 @@ class User():
 			screen.display(1)
 			try:
 				socket.setdefaulttimeout(6) # max wait time
-				self.sock.connect((addr, port))
+				self.sock.connect(server_endpoint(addr,port))
 				socket.setdefaulttimeout(None) # can wait indefinitely
-				screen.add(f'successfully reconnected to {addr}:{port}', screen.ATR_SUCCESS)
+				screen.add(f'successfully reconnected to {show_endpoint(addr,port)}', screen.ATR_SUCCESS)
 				screen.display(1)
 				return SUCCESS
 			except socket.error as e:
 				# could not reconnect
-				screen.add(f'Err.3 - could not reconnect to {addr}:{port}', screen.ATR_ALERT)
+				screen.add(f'Err.3 - could not reconnect to {show_endpoint(addr,port)}', screen.ATR_ALERT)
 				if DEBUG:
 					screen.add(str(e))
-				time.sleep(wait_time) # wait 3 seconds before re-trying
+				self.wait(wait_time,'Retrying') # wait 3 seconds before re-trying
 				test += 1
 				screen.add() # skip line
 		screen.pause(1)
 		return FAILURE
 
-	def create_username(self,show_rules=True):
+	# let the timer wheel say when seconds have passed -- the prompt counts them down meanwhile
+	def wait(self,seconds,prompt):
+		deadline = time.monotonic() + seconds
+		over = threading.Event()
+		def count():
+			left = deadline - time.monotonic()
+			if left <= 0:
+				over.set()
+				return
+			screen.typebox.new_prompt(f'{prompt} [{left:.0f}s] . . . ')
+			screen.display(1)
+			timers.schedule(left - int(left) or 1,count) # (on the next whole second left)
+		count()
+		over.wait()
 		max_chars = 12
 		min_chars = 3
 
@@ -151,12 +176,39 @@ class User():
 		# prevents data from being misplaced
 
 		# STAGE 1) welcome msg
+		proposal = None # name sent ahead of the list of taken names
+		pipelined = False # name + cmd connection are sent without waiting for each step to be acknowledged
+		opened = False # cmd connection opened (or replaced by a channel) during stage 1
 		try:
 			welcome_msg, attr = receive_data(self.sock,None,True)
+			reason = check_rejection(welcome_msg)
+			if reason is not None: # server is full (or busy)
+				screen.add(f'The server turned this connection away - {reason}', screen.ATR_ALERT)
+				screen.display(1)
+				return FAILURE
 			screen.add(welcome_msg.decode(ENCODING),attr)
 			screen.add()
 			screen.display(1)
-			send_pass(self.sock) # success token
+			if get_reader(self.sock).offered: # server can speak the binary protocol
+				# open the cmd connection while the name is being checked -- closed again if the server lets it share this one
+				connecting = threading.Thread(target=self.cmd_sock.connect,args=(server_endpoint(SERVER_IP,CPORT),),daemon=True)
+				connecting.start()
+				proposal = self.username or self.create_username().upper() # keep the old name when reconnecting
+				token = secrets.token_hex(8) # identifies the cmd connection before the name is approved
+				features = accept_protocol(self.sock,[f'user={proposal}',f'pair={token}']) # success token + switch versions
+				pipelined = 'pipeline' in features
+				connecting.join()
+				if 'mux' in features: # chat and commands become channels of the main connection
+					self.cmd_sock.close() # not needed -- the server drops it without a name
+					self.mux = Multiplexer(self.sock)
+					self.sock = self.mux.channel(CHANNEL_CHAT)
+					self.cmd_sock = self.mux.channel(CHANNEL_COMMAND)
+					set_protocol(self.sock, *get_protocol(self.mux.sock))
+				opened = True
+				if pipelined and not self.mux:
+					send_msg(self.cmd_sock,f'PAIR {token}') # the server holds it until the name is approved
+			else:
+				send_pass(self.sock) # success token
 		except Exception as e:
 			screen.add('Authentication Error - Stage 1 <welcome msg>', screen.ATR_ALERT)
 			screen.add(str(e))
@@ -165,21 +217,28 @@ class User():
 
 		# STAGE 2) choose a username
 		valid_name = False
+		sent = pipelined # proposal went out with the protocol reply
 		while not valid_name:
-			try:
-				data = receive_data(self.sock,None,False) # receive a list of unavailable usernames
-				restricted_names = pickle.loads(data,encoding=ENCODING)
-			except Exception as e:
-				screen.add('Authentication Error - Stage 2 <reserved names>', screen.ATR_ALERT)
-				screen.add(e)
-				return FAILURE
-			msg = 'Unavailable Names: [' + ', '.join(restricted_names) + ']\n'
-			screen.add(msg, screen.ATR_CRITICAL) #$
-			username = self.create_username() # choose a formal name
-			username = username.upper() # only use uppercases (each name is unique)
+			if not sent: # pipelined servers only send the list if the proposed name is taken
+				try:
+					data = receive_data(self.sock,None,False) # receive a list of unavailable usernames
+					restricted_names = pickle.loads(data,encoding=ENCODING)
+				except Exception as e:
+					screen.add('Authentication Error - Stage 2 <reserved names>', screen.ATR_ALERT)
+					screen.add(e)
+					return FAILURE
+				msg = 'Unavailable Names: [' + ', '.join(restricted_names) + ']\n'
+				screen.add(msg, screen.ATR_CRITICAL) #$
+			if proposal:
+				username = proposal # already entered
+				proposal = None
+			else:
+				username = self.create_username() # choose a formal name
+				username = username.upper() # only use uppercases (each name is unique)
 			# send name to sever
 			try:
-				send_msg(self.sock,username)
+				if not sent:
+					send_msg(self.sock,username)
 				# wait for approval
 				screen.add('Waiting for approval...', screen.ATR_HIGHLIGHT)
 				screen.display(1)
@@ -195,6 +254,9 @@ class User():
 					screen.display(1)
 					screen.pause()
 					screen.clear() # start again with a clear screen
+					if sent: # the list follows on its own -- continue as usual
+						sent = False
+						continue
 					send_pass(self.sock) # request another attempt
 			except Exception as e:
 				screen.add('Authentication Error - Stage 2 <username>', screen.ATR_ALERT)
@@ -207,16 +269,23 @@ class User():
 		screen.add('Setting up command connection...', screen.ATR_HIGHLIGHT)
 		screen.display(1)
 		try:
-			self.cmd_sock.connect((SERVER_IP,CPORT))
-			screen.add(f'Successfully connected to CPort - {SERVER_IP}:{CPORT}\n', screen.ATR_SUCCESS)
+			if not opened: # not opened during stage 1
+				self.cmd_sock.connect(server_endpoint(SERVER_IP,CPORT))
+			if self.mux:
+				screen.add(f'Commands share the connection to {show_endpoint(SERVER_IP,PORT)}\n', screen.ATR_SUCCESS)
+			else:
+				screen.add(f'Successfully connected to CPort - {show_endpoint(SERVER_IP,CPORT)}\n', screen.ATR_SUCCESS)
 			screen.display(1)
 			# success
-			send_msg(self.cmd_sock,self.username) # let the cport know which user connected
+			if not pipelined and not self.mux: # paired by token / same connection instead
+				send_msg(self.cmd_sock,self.username) # let the cport know which user connected
 			approval = receive_data(self.cmd_sock) # wait until the cport creates a remote socket for this connection...
 			if check_pass(approval) == SUCCESS:
+				set_protocol(self.cmd_sock, *get_protocol(self.sock)) # same frame format as the main connection from here on
 				screen.pause() # wait for user to continue (read info)
 				screen.clear() # start with a fresh screen
-				send_pass(self.sock) # tell server the cmd socket has been connected
+				if not pipelined: # the server did not wait for this
+					send_pass(self.sock) # tell server the cmd socket has been connected
 			else:
 				raise Exception('PASS failed!')
 		except Exception as e:
@@ -231,7 +300,8 @@ class User():
 			msg = data.decode(ENCODING)
 			screen.add(msg,attr)
 			screen.display(1)
-			send_pass(self.sock) # tell server this process is finished (make server wait until last msg is fully received, so the next receive starts fresh)
+			if not pipelined: # the server did not wait for this
+				send_pass(self.sock) # tell server this process is finished (make server wait until last msg is fully received, so the next receive starts fresh)
 		except Exception as e:
 			screen.add('Authentication Error - stage 4 <server status>', screen.ATR_ALERT)
 			screen.add(str(e))
@@ -242,14 +312,34 @@ class User():
 		return SUCCESS
 
 # FUNCTIONS
+# socket for the transport in use -- a socket file when running on the server machine (--unix)
+# tuned for its channel before connecting (buffer sizes must be set before the handshake)
+def new_socket(channel=CHANNEL_CHAT):
+	if UNIX_PATH:
+		sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+	else:
+		sock = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+	tune_socket(sock,PROFILE,channel)
+	return sock
+
+# address to connect to for the main port or the command port
+def server_endpoint(addr,port):
+	if UNIX_PATH:
+		return UNIX_PATH if port == PORT else UNIX_PATH + COMMAND_SUFFIX
+	return (addr,port)
+
+def show_endpoint(addr,port):
+	if UNIX_PATH:
+		return server_endpoint(addr,port)
+	return f'{addr}:{port}'
+
 def get_response(prompt='',period=0.5,timeout=30,alert_time=10,timer=False,color=screen.c_highlight):
-	# poll until a response is output.
+	# wait until a response is output.
 	# timeout - abort after x seconds
-	# period - sample every y seconds
+	# period - update the prompt every y seconds (on the timer wheel)
 	# alert_time - signal when z seconds are left (0 = OFF)
 	# timer - show seconds until timeout
 	# color - highlight up prompt
-	elapsed_time = 0
 	reply = ''
 	# set default prompt
 	if not prompt:
@@ -260,36 +350,44 @@ def get_response(prompt='',period=0.5,timeout=30,alert_time=10,timer=False,color
 	if color:
 		screen.typebox.set_color(color)
 	screen.display()
-	# start the answer protocol (ends after next screen output)
-	this_user.responding = True
-	while this_user.responding:
-		# check timeout
-		if elapsed_time >= timeout:
-			this_user.responding = False # end the answer protocol -- restore normal output function
-		else:
-			time.sleep(period) # wait for next sample...
-			elapsed_time += period
+	deadline = time.monotonic() + timeout
+	update_lock = threading.Lock() # the prompt is never updated once it was restored
+	def update_prompt():
+		nonlocal timer, alert_time, countdown
+		with update_lock:
+			if not this_user.responding:
+				return
+			time_left = deadline - time.monotonic()
 			# warning, time running out:
-			if (timeout - elapsed_time) <= alert_time: # under z seconds left
+			if time_left <= alert_time: # under z seconds left
 				if color:
 					screen.typebox.set_color(screen.c_alert)
 				timer = True # start timer
 				alert_time = 0 # turn off alert (signal was sent)
 			# update remaining time
 			if timer:
-				timed_prompt = f'[{timeout-elapsed_time:.1f}s] ' + prompt #$
+				timed_prompt = f'[{max(0,time_left):.1f}s] ' + prompt #$
 				screen.typebox.new_prompt(timed_prompt)
 				screen.display()
+			countdown = timers.schedule(period,update_prompt)
+	# start the answer protocol (ends after next screen output)
+	this_user.answered.clear()
+	this_user.responding = True
+	countdown = timers.schedule(period,update_prompt)
+	this_user.answered.wait(timeout)
+	with update_lock:
+		this_user.responding = False # end the answer protocol -- restore normal output function
+		countdown.cancel()
 	# restore interface
 	screen.typebox.new_prompt(old_prompt) # restore old prompt
 	screen.typebox.set_color(screen.c_standard)
 	screen.display()
-	# force a default reply
-	if elapsed_time >= timeout:
-		reply = '' # indicate timeout
 	# get reply from output
-	else:
+	if this_user.answered.is_set():
 		reply = screen.typebox.output
+	# force a default reply
+	else:
+		reply = '' # indicate timeout
 	return reply
 
 # make the user respond to a YES/NO question -- default to NO if invalid response or timed out
@@ -312,6 +410,79 @@ def get_binary_response(prompt='Answer [Y/N]: ', period=0.5, timeout=10, alert_t
 	# return binary result
 	return outcome
 
+# zip the items if there is more than one or it is a directory -- returns (path to send, zipped), blank path on zip error
+def package_files(path_list):
+	path = ''
+	# decide if the contents need to be automatically zipped
+	if len(path_list) > 1: # multiple files / dirs
+		zipped = True
+	else:
+		# only 1 item (command would not execute with <1 item)
+		path = path_list[0]
+		if os.path.isdir(path): # directory
+			zipped = True
+		else: # single file
+			zipped = False
+
+	# create zip file if attempting to send a directory or multiple items
+	if zipped:
+		location = os.path.dirname(path) # create zip in the same dir as the first element
+		path = create_zip(path_list,location) # compress and zip elements, path to zip file is returned (blank on error)
+	return path, zipped
+
+# wait while the server offers an uploaded file to the target -- ask whether to keep waiting if they are busy
+def await_offer(target_user):
+	waiting = True
+	while waiting:
+		screen.add(f'Sending file request...', screen.ATR_SCAFFOLDING)
+		screen.display(1)
+		confirmation = receive_data(this_user.cmd_sock) # wait...
+		try:
+			# request sent
+			if check_pass(confirmation) == SUCCESS:
+				screen.add(f'{target_user} has received your offer.', screen.ATR_SUCCESS)
+				screen.show_recent()
+				screen.scrap() #$ remove sending...
+				waiting = False
+			else: # target still busy
+				screen.add(f'{target_user} is busy and cannot receive your file request.', screen.ATR_CRITICAL)
+				screen.show_recent()
+				screen.scrap()
+				p = 'Continue Waiting? [Yes/No]: '
+				waiting = get_binary_response(p, timeout=10)
+				if waiting:
+					send_pass(this_user.cmd_sock) # tell server to send another request
+				else:
+					screen.add('Send cancelled.', screen.ATR_ALERT)
+					send_fail(this_user.cmd_sock) # cancel operation
+		except Exception as e: # confirmation error
+			screen.add(str(e),screen.ATR_ALERT)
+			break
+
+# single-request send -- the command carries name and size, the file follows right behind it ['fastsend']
+# runs beside the command thread, which receives the server's status
+def fast_send(args):
+	try:
+		path_list = [k.strip('"') for k in args[2:]] # 2nd argument onwards (handled for spaces; remove quotes)
+		path, zipped = package_files(path_list)
+		filename = os.path.basename(path)
+		if not filename: # zip error
+			return
+		screen.add('Uploading file to server...', screen.ATR_SCAFFOLDING)
+		screen.display(1)
+		if send_command(this_user.cmd_sock, [cmd_upload.name, args[1], filename, str(os.path.getsize(path))]) == SUCCESS:
+			upload_file(this_user.cmd_sock,path)
+		# remove zip file (if created automatically)
+		if zipped:
+			try:
+				os.remove(path)
+			except Exception as e:
+				if DEBUG:
+					screen.add(f'Send File Error - removing temporary zip: \'{path}\'', screen.ATR_CRITICAL)
+					screen.add(str(e))
+	finally:
+		this_user.uploading = False
+
 # handle the execution of commands with the Server
 def process_commands():
 	global this_user
@@ -320,8 +491,8 @@ def process_commands():
 		screen.display(1) # all previous errors should be shown
 
 		this_user.processing = False
-		data = receive_data(this_user.cmd_sock) # receive a new command...
-		if data == FAILURE: # disconnection
+		args = receive_command(this_user.cmd_sock) # receive a new command (text or opcode)...
+		if args == FAILURE: # disconnection
 			if not this_user.disconnecting: # not already in the process of shutting down
 				if DEBUG: #! ensure messages come after errors
 					time.sleep(MICRO_SLEEP)
@@ -329,8 +500,7 @@ def process_commands():
 				screen.quit(1)
 			return
 		this_user.processing = True # prevent other external commands from initiating until this one completes -- avoids multiple sends
-		cmd = data.decode(ENCODING)
-		args = get_args(cmd) # parse command -- assume valid syntax here, should contain all required args
+		# assume valid syntax here, should contain all required args
 		name = args[0].upper() # every command will have at least a name parameter -- command names are stored in caps
 
 		# Internal Commands:
@@ -350,10 +520,13 @@ def process_commands():
 		# this was just sent by the user (the server is aware of it)
 		if name not in PASSIVE_COMMANDS:
 			send_pass(this_user.cmd_sock) # tell the server it can begin the command process
+		# status of our own upload -- the server is already in the process
+		elif name == cmd_upload.name:
+			pass
 		 # this was received by an alternate process (the server is NOT aware of it yet)
 		else:
 			# initiate the corresponding server-side protocol. If none exists, this msg will be disregarded
-			send_data(this_user.cmd_sock,data) # echo cmd to server
+			send_command(this_user.cmd_sock,args) # echo cmd to server
 
 		# Evaluate Commands (uppercase names):
 
@@ -389,7 +562,7 @@ def process_commands():
 			this_user.auto_reconnect = False
 			# show kick msg
 			if len(args) > 1:
-				report = cmd[cmd.index(args[1]):]
+				report = args[1] # rest of the line
 				screen.add(report,screen.ATR_HIGHLIGHT)
 			# close connections
 			this_user.sock.close()
@@ -408,28 +581,10 @@ def process_commands():
 				continue
 			# valid user targeted
 
-			path = '' # path to the file that will be uploaded
-
 			# already proven to be valid
 			path_list = [k.strip('"') for k in args[2:]] # 2nd argument onwards (handled for spaces; remove quotes)
-
-			# decide if the contents need to be automatically zipped
-			if len(path_list) > 1: # multiple files / dirs
-				zipped = True
-			else:
-				# only 1 item (command would not execute with <1 item)
-				path = path_list[0]
-				if os.path.isdir(path): # directory
-					zipped = True
-				else: # single file
-					zipped = False
-			
-			# create zip file if attempting to send a directory or multiple items
-			if zipped:
-				location = os.path.dirname(path) # create zip in the same dir as the first element
-				zip_path = create_zip(path_list,location) # compress and zip elements, path to zip file is returned (blank on error)
-				# update path to point to zip file
-				path = zip_path
+			path, zipped = package_files(path_list) # path to the file that will be uploaded
+			zip_path = path
 
 			# name of file being sent (zipped or not)
 			filename = os.path.basename(path)
@@ -490,33 +645,19 @@ def process_commands():
 			send_pass(this_user.cmd_sock)
 
 			# confirm user received proposal
-			target_user = args[1].upper()
-			waiting = True
-			while waiting:
-				screen.add(f'Sending file request...', screen.ATR_SCAFFOLDING)
-				screen.display(1)
-				confirmation = receive_data(this_user.cmd_sock) # wait...
-				try:
-					# request sent
-					if check_pass(confirmation) == SUCCESS:
-						screen.add(f'{target_user} has received your offer.', screen.ATR_SUCCESS)
-						screen.show_recent()
-						screen.scrap() #$ remove sending...
-						waiting = False
-					else: # target still busy
-						screen.add(f'{target_user} is busy and cannot receive your file request.', screen.ATR_CRITICAL)
-						screen.show_recent()
-						screen.scrap()
-						p = 'Continue Waiting? [Yes/No]: '
-						waiting = get_binary_response(p, timeout=10)
-						if waiting:
-							send_pass(this_user.cmd_sock) # tell server to send another request
-						else:
-							screen.add('Send cancelled.', screen.ATR_ALERT)
-							send_fail(this_user.cmd_sock) # cancel operation
-				except Exception as e: # confirmation error
-					screen.add(str(e),screen.ATR_ALERT)
-					break
+			await_offer(args[1].upper())
+			# finished -- the server will continue this process with the target user
+
+		# Upload status (passive) -- the one reply to a single-request send
+		elif name == cmd_upload.name:
+			if args[3] != 'PASS':
+				screen.add(args[4] if len(args) > 4 else 'Upload failed!', screen.ATR_ALERT)
+				screen.scrap() #$ remove uploading...
+				continue
+			screen.add(f'Successfully uploaded {args[2]} to the server!', screen.ATR_SUCCESS)
+			screen.scrap()
+			# confirm user received proposal
+			await_offer(args[1].upper())
 			# finished -- the server will continue this process with the target user
 
 		# Receive File (passive)
@@ -604,6 +745,43 @@ def process_commands():
 
 		# --- Evaluate Commands ---
 
+# tell the server this client is still here, and notice when the server is not -- every HEARTBEAT_INTERVAL on the timer wheel ['heartbeat']
+def heartbeat(sock):
+	if sock is not this_user.sock or this_user.disconnecting: # (a new connection has its own)
+		return
+	if peer_silent(sock):
+		screen.add('The server stopped responding...', screen.ATR_ALERT)
+		screen.display(1)
+		for connection in [this_user.sock, this_user.cmd_sock]: # wakes up the threads reading them -- the client reconnects
+			try:
+				connection.shutdown(socket.SHUT_RDWR)
+			except (AttributeError, OSError): # (channel)
+				connection.close()
+		return
+	try:
+		if not this_user.pinging: # the wheel never waits on the connection -- a full send buffer only holds up this thread
+			this_user.pinging = True
+			threading.Thread(target=ping,args=(sock,),daemon=True).start()
+	except RuntimeError: # (no thread to spare -- try again next time)
+		this_user.pinging = False
+	finally: # (a ping that could not go out does not end the heartbeat)
+		timers.schedule(HEARTBEAT_INTERVAL,heartbeat,sock)
+
+# send one heartbeat -- off the timer wheel, since it can block while the server is not reading
+def ping(sock):
+	try:
+		send_data(sock,bytes(str(HEARTBEAT_INTERVAL),ENCODING),kind=MSG_PING)
+	finally:
+		this_user.pinging = False
+
+# chat from the server -- the last frame before a shutdown says how long to wait before reconnecting
+def read_chat(data,attr):
+	shutdown = check_shutdown(this_user.sock,data)
+	if shutdown:
+		this_user.reconnect_delay, notice = shutdown
+		data = bytes(notice,ENCODING)
+	read_msg(data,attr)
+
 def deliver_msg(msg): # send (press enter) -- screen refreshes immediately after execution
 	if not msg: # empty
 		return
@@ -613,6 +791,7 @@ def deliver_msg(msg): # send (press enter) -- screen refreshes immediately after
 	# answer protocol
 	if this_user.responding:
 		this_user.responding = False # response is now in output
+		this_user.answered.set()
 		screen.add('> ' + msg)
 		return
 		
@@ -624,7 +803,7 @@ def deliver_msg(msg): # send (press enter) -- screen refreshes immediately after
 	elif msg[0] == '/':
 		# inspect command before sending:
 		screen.add('> ' + msg) # show command
-		args = get_args(msg[1:]) # name + arguments
+		args = parse_command(msg[1:]) # name + arguments
 		if not args: # empty cmd
 			screen.add('No command entered.')
 			return
@@ -651,7 +830,7 @@ def deliver_msg(msg): # send (press enter) -- screen refreshes immediately after
 
 			# External Commands -- cannot initiate another cmd while processing
 			else: # must contect server
-				if this_user.processing: # already using the command socket
+				if this_user.processing or this_user.uploading: # already using the command socket
 					screen.add('You are already processing an external command!', screen.ATR_CRITICAL)
 					return
 
@@ -661,7 +840,7 @@ def deliver_msg(msg): # send (press enter) -- screen refreshes immediately after
 				# List
 				if name == cmd_list.name:
 					# echo command to server (no slash)
-					send_msg(this_user.cmd_sock,msg[1:])
+					send_command(this_user.cmd_sock,args)
 
 				# D/C
 				elif name == cmd_dc.name:
@@ -691,7 +870,7 @@ def deliver_msg(msg): # send (press enter) -- screen refreshes immediately after
 							screen.add('Message not entered!')
 							return
 					# echo command to server (no slash)
-					send_msg(this_user.cmd_sock,msg[1:])
+					send_command(this_user.cmd_sock,args)
 					# ... sever is processing command
 
 				# Specific
@@ -714,7 +893,7 @@ def deliver_msg(msg): # send (press enter) -- screen refreshes immediately after
 					# respond to state
 					if valid_state:
 						# format command and send to server -- use value for state
-						send_msg(this_user.cmd_sock, f'{cmd_visible.name} {value}')
+						send_command(this_user.cmd_sock, [cmd_visible.name, str(value)])
 					else:
 						screen.add(f'\'{state}\' is not a valid state!')
 						return
@@ -743,7 +922,11 @@ def deliver_msg(msg): # send (press enter) -- screen refreshes immediately after
 							screen.add(f'Could not find the specified file: \'{path}\'', screen.ATR_ALERT)
 							return
 					# contact server
-					send_msg(this_user.cmd_sock,msg[1:]) # send full command (no slash)
+					if 'fastsend' in get_protocol(this_user.cmd_sock)[1]: # one request -- the file follows the command
+						this_user.uploading = True
+						threading.Thread(target=fast_send,args=(args,),daemon=True).start()
+					else:
+						send_command(this_user.cmd_sock,args) # send full command (no slash)
 					# ... server is now processing command
 
 				# Unknown -- cmd exists but has not been configured
@@ -761,14 +944,31 @@ def deliver_msg(msg): # send (press enter) -- screen refreshes immediately after
 # The IP of the server we are connecting to
 SERVER_IP = socket.gethostbyname(socket.gethostname()) # LAN
 
-# Command-line argument to specify the remote IP address
-if len(sys.argv) > 1:
-	if sys.argv[1] == '--remote':
-		if len(sys.argv) > 2:
-			SERVER_IP = sys.argv[2] # update IP to WAN connection
+UNIX_PATH = None # socket file of a server on this machine
+PROFILE = DEFAULT_PROFILE # transport profile for both connections
+
+# Command-line arguments to specify the remote IP address or the socket file of a local server, and the transport profile
+options = sys.argv[1:]
+while options:
+	flag = options.pop(0)
+	if flag == '--remote':
+		if options:
+			SERVER_IP = options.pop(0) # update IP to WAN connection
 		else:
 			print('Please provide an IP address for remote connection.')
 			sys.exit(1)
+	elif flag == '--unix':
+		if options and hasattr(socket,'AF_UNIX'):
+			UNIX_PATH = options.pop(0)
+		else:
+			print('Please provide the socket file of the server (unix domain sockets must be supported).')
+			sys.exit(1)
+	elif flag == '--profile':
+		if options and options[0] in TRANSPORT_PROFILES:
+			PROFILE = options.pop(0)
+		else:
+			print(f'Please provide a transport profile: {", ".join(TRANSPORT_PROFILES)}')
+			sys.exit(1)
 
 # Setup connection to the server:
 this_user = User() # create a new user
@@ -799,13 +999,17 @@ while True:
 
 	# Use the server:
 	# Receive -- listen to calls from the server
-	receive_thread = threading.Thread(target=receive_data,args=(this_user.sock,read_msg,True,),daemon=True) # run as a background process
+	receive_thread = threading.Thread(target=receive_data,args=(this_user.sock,read_chat,True,),daemon=True) # run as a background process
 	receive_thread.start() # start receiving data from the server...
 
 	# Commands -- handle incoming commands, also checks if user is still connected
 	command_thread = threading.Thread(target=process_commands,daemon=True)
 	command_thread.start() # start listening for commands...
 
+	# Heartbeat -- both sides find out when the other one is gone without a word
+	if 'heartbeat' in get_writer(this_user.sock).features:
+		timers.schedule(HEARTBEAT_INTERVAL,heartbeat,this_user.sock)
+
 	# Send -- control the interface / send messages or commands to the server
 	if not screen.run():
 		this_user.disconnecting = True # closed manually
@@ -5,17 +5,36 @@ import pickle
 import mycurses
 import poem_extractor
 import os
+import sys
+import stat
+import shutil
 import time
+import struct
+import weakref
+import zlib
+import asyncio
+import queue
+import collections
+import heapq
+import itertools
+import math
+import selectors
+import signal
 from zipfile import ZipFile
 
 # Specify public data [importable] -- constants, classes / objects, functions
-__all__ = ['screen','SERVER_NAME','ENCODING','HEADERSIZE','FILE_HEADERSIZE','BUFFERSIZE','FILE_BUFFERSIZE', \
-	'MICRO_SLEEP','SUCCESS','FAILURE','DEBUG','PORT','CPORT', \
-	'COMMAND_LIST','PASSIVE_COMMANDS', \
+__all__ = ['screen','SERVER_NAME','ENCODING','HEADERSIZE','HEADER_V2','FILE_HEADERSIZE','BUFFERSIZE','FILE_BUFFERSIZE','MAX_FRAME', \
+	'MICRO_SLEEP','TIMER_TICK','TIMER_SLOTS','SUCCESS','FAILURE','DEBUG','PORT','CPORT','COMMAND_SUFFIX','TRANSPORT_PROFILES','DEFAULT_PROFILE', \
+	'PROTOCOL_VERSION','PROTOCOL_FEATURES','PROTOCOL_OFFER','PROTOCOL_REJECT','MSG_DATA','MSG_HELLO','MSG_FRAGMENT','MSG_PING','MSG_BYE','FLAG_FINAL','FLAG_COMPRESSED','FLAG_STREAM', \
+	'COMPRESS_MIN','COMPRESS_LEVEL','CHAT_DICTIONARY','HEARTBEAT_INTERVAL','HEARTBEAT_MISSES', \
+	'FRAGMENT_SIZE','FRAGMENT_HEADER','MAX_STREAMS','MUX_HEADER','MUX_INBOX','CHANNEL_CHAT','CHANNEL_COMMAND', \
+	'COMMAND_LIST','OPCODE_TABLE','COMMAND_NAMES','PASSIVE_COMMANDS','MSG_COMMAND','COMMAND_ARG', \
 	'Command','cmd_help','cmd_cls','cmd_dc','cmd_list','cmd_find','cmd_tell','cmd_check','cmd_visible','cmd_admin','cmd_become_admin', \
-	'cmd_demote','cmd_get_demoted','cmd_kick','cmd_get_kicked','cmd_send','cmd_receive', \
-	'announce','get_args','create_file','create_dir','create_zip','extract_files','send_data','upload_file','send_msg','send_pass','send_fail', \
-	'check_pass','read_msg','receive_data','download_file']
+	'cmd_demote','cmd_get_demoted','cmd_kick','cmd_get_kicked','cmd_send','cmd_receive','cmd_upload', \
+	'announce','get_args','parse_command','encode_command','decode_command','create_file','create_dir','create_zip','extract_files', \
+	'TimerWheel','ScheduledTask','timers','TokenBucket','send_data','send_frame','send_frames','upload_file','send_msg','send_pass','send_fail','send_rejection','send_command', \
+	'check_pass','check_rejection','check_shutdown','read_msg','FrameReader','FrameWriter','SharedFrame','FramePiece','Channel','Multiplexer','get_reader','get_writer','set_protocol','get_protocol','tune_socket', \
+	'peer_silent','offer_protocol','accept_protocol','confirm_protocol','receive_data','frame_command','receive_command','download_file']
 
 # Setup Terminal
 screen = mycurses.Screen()
@@ -23,19 +42,88 @@ screen = mycurses.Screen()
 SERVER_NAME = 'SYSTEM'
 ENCODING = 'utf-8'
 HEADERSIZE = 8 # number of bytes prepended to a message for the header
+HEADER_V2 = struct.Struct('!BBBBI') # binary header (v2) -- property, color, type, flags, size -- same length as the v1 header
 FILE_HEADERSIZE = 10 # bytes prepended to a file msg for the header (used to specify the size of a file)
-BUFFERSIZE = 64 # bytes per packet
+BUFFERSIZE = 4096 # bytes requested per recv -- starting size of a connection's read buffer
+MAX_FRAME = 1 << 20 # largest payload a frame may announce (and largest message once fragments are put together) -- bigger ones are refused as corrupt
 FILE_BUFFERSIZE = 1024
 MICRO_SLEEP = 0.5
+TIMER_TICK = 0.05 # seconds between turns of the timer wheel -- how late a scheduled task may run
+TIMER_SLOTS = 512 # slots of the timer wheel -- tasks further than one turn away wait for their round
 SUCCESS = 0
 FAILURE = 1
 DEBUG = 0
 
+# Protocol
+PROTOCOL_VERSION = 2 # newest frame format this build speaks (1 = ASCII header)
+PROTOCOL_FEATURES = ['fragments','opcodes','fastsend','pipeline','mux','compress','zstream','bye','heartbeat'] # optional extensions that can be agreed on top of v2 ('fastsend' needs 'opcodes')
+PROTOCOL_OFFER = ord('+') # marks the size field of a v1 header -- the sender can switch to v2
+PROTOCOL_REJECT = 'FULL' # first word of the frame sent in place of the welcome msg when a connection is turned away
+# frame types (v2)
+MSG_DATA = 0 # message for the screen / command text
+MSG_HELLO = 1 # features accepted by the server
+MSG_FRAGMENT = 2 # piece of a larger message ['fragments']
+MSG_COMMAND = 3 # binary command ['opcodes']
+MSG_PING = 4 # heartbeat on the main connection -- payload is the sender's interval in seconds, never handed to the receiver ['heartbeat']
+MSG_BYE = 5 # last chat frame before the server closes -- payload is the seconds to wait before reconnecting, then the notice ['bye']
+# frame flags (v2)
+FLAG_FINAL = 0x01 # last fragment of a message
+FLAG_COMPRESSED = 0x02 # payload is deflated on its own (preset dictionary) ['compress']
+FLAG_STREAM = 0x04 # payload continues the connection's deflate stream ['zstream']
+# fragments -- large messages are sent in pieces so smaller frames can be sent in between
+FRAGMENT_SIZE = 8192 # bytes of the message carried by each fragment
+FRAGMENT_HEADER = struct.Struct('!IB') # stream id, type of the whole message -- starts every fragment payload
+MAX_STREAMS = 16 # fragmented messages a peer may have open at once -- each is reassembled up to MAX_FRAME bytes
+COMMAND_ARG = struct.Struct('!H') # length of each argument of a binary command
+# multiplexing -- chat and commands share the main connection ['mux']
+MUX_HEADER = struct.Struct('!BI') # channel, size -- starts every chunk sent on a multiplexed connection
+MUX_INBOX = 1 << 20 # bytes a channel may have waiting to be read -- the connection is not read further until it catches up
+CHANNEL_CHAT = 0
+CHANNEL_COMMAND = 1
+# compression -- chat messages are raw deflate primed with the strings every chat repeats ['compress']
+COMPRESS_MIN = 48 # smaller messages are sent as they are
+COMPRESS_LEVEL = 6
+COMPRESS_TRAILER = b'\x00\x00\xff\xff' # ends every flushed stream message -- not sent, added back by the reader
+CHAT_DICTIONARY = bytes(' '.join([ # most common last (closest to the data)
+	'Unavailable Names: Use / to enter commands, // to create notes, /help for more info.',
+	'+++ Screen Clear +++ Delivered to There are currently users online: Server Status: active users',
+	'has left the server! has joined the server! From [', f'[{SERVER_NAME}]: ',
+]), ENCODING)
+# heartbeats -- each side pings the main connection and drops a peer it has not heard from in a while ['heartbeat']
+HEARTBEAT_INTERVAL = 15 # seconds between pings (the peer is told, and waits for it)
+HEARTBEAT_MISSES = 3 # intervals without a byte from the peer before it counts as gone (vanished without closing the connection)
+
 # Address Information -- static
 HOST = socket.gethostname()
 IP = socket.gethostbyname(HOST) # LAN
 PORT = 50150 # main port for text interaction
 CPORT = 50151 # commands
+COMMAND_SUFFIX = '.cmd' # added to the socket file of a local (unix domain) server for its command endpoint
+
+# Transport profiles -- socket options for each channel (the chat connection also carries commands when multiplexed)
+# nodelay: send small frames at once (no Nagle) | sndbuf/rcvbuf: kernel buffer bytes (None = system default)
+# keepalive: (idle seconds, seconds between probes, probes) before a silent peer is dropped, None = off | backlog: connects queued by listen()
+TRANSPORT_PROFILES = {
+	# chat first -- every frame goes out immediately, dead peers are found within ~2 minutes
+	'interactive': {
+		'backlog': 64,
+		CHANNEL_CHAT: {'nodelay': True, 'sndbuf': None, 'rcvbuf': None, 'keepalive': (60,10,6)},
+		CHANNEL_COMMAND: {'nodelay': True, 'sndbuf': None, 'rcvbuf': None, 'keepalive': (60,10,6)},
+	},
+	# file transfers first -- large buffers on the command connection, which is allowed to batch
+	'bulk': {
+		'backlog': 64,
+		CHANNEL_CHAT: {'nodelay': True, 'sndbuf': None, 'rcvbuf': None, 'keepalive': (300,30,5)},
+		CHANNEL_COMMAND: {'nodelay': False, 'sndbuf': 4 << 20, 'rcvbuf': 4 << 20, 'keepalive': (300,30,5)},
+	},
+	# fast, reliable local network -- medium buffers, no probes, room for bursts of connects
+	'lan': {
+		'backlog': 256,
+		CHANNEL_CHAT: {'nodelay': True, 'sndbuf': 256 << 10, 'rcvbuf': 256 << 10, 'keepalive': None},
+		CHANNEL_COMMAND: {'nodelay': True, 'sndbuf': 1 << 20, 'rcvbuf': 1 << 20, 'keepalive': None},
+	},
+}
+DEFAULT_PROFILE = 'interactive'
 
 # |--- Port Ranges ---|
 # Well-known: 0-1023
@@ -54,6 +142,8 @@ class Command():
 		self.internal = False # can function without contacting server -- UI effects
 		self.passive = False # can only be used by other functions -- cannot be called directly (makes 'restricted' obsolete)
 		self.restricted = False # requires admin rights to use
+		self.opcode = None # number sent in place of the name (binary commands)
+		self.tail = 0 # position of the free-text argument that runs to the end of the line (0 = none)
 	def show_help(self): # assist the user with this command
 		screen.add(self.description)
 		parameters = f' {self.usage}' if self.usage else ''
@@ -137,6 +227,7 @@ cmd_tell = Command('tell')
 cmd_tell.description = 'Send an exclusive message to the chosen user.'
 cmd_tell.usage = '[username] [message]'
 cmd_tell.restricted = True
+cmd_tell.tail = 2
 
 cmd_check = Command('check')
 cmd_check.description = 'Tests whether a user is free to receive commands.'
@@ -169,10 +260,12 @@ cmd_kick = Command('kick')
 cmd_kick.description = 'Forcibly removes a user from the Server.'
 cmd_kick.usage = '[username] [comment]\n    comment (optional) - explain why user was kicked.'
 cmd_kick.restricted = True
+cmd_kick.tail = 2
 
 cmd_get_kicked = Command('get_kicked')
 cmd_get_kicked.description = '[Passive] Prevents user from reconnecting.'
 cmd_get_kicked.passive = True # result of kick -- called automatically
+cmd_get_kicked.tail = 1
 
 cmd_send = Command('send')
 cmd_send.description = 'Send any file to another user on the Server.'
@@ -185,21 +278,32 @@ cmd_receive.description = '[Passive] Receive an incoming file request from an ac
 cmd_receive.usage = '[username] [filename] [server-side filepath]' # not for clients
 cmd_receive.passive = True # result of send -- called automatically
 
+cmd_upload = Command('upload')
+cmd_upload.description = '[Passive] Single-request file send -- the file follows the command, the server replies with one status.'
+cmd_upload.usage = '[username] [filename] [size] | reply: [username] [filename] [PASS/FAIL] [reason]' # not for clients
+cmd_upload.passive = True # made by send when the server agreed to 'fastsend'
+cmd_upload.tail = 4 # reason for a failed upload
+
 def get_cmd_name(cmd):
 	return cmd.name
 COMMAND_LIST = [cmd_help,cmd_cls,cmd_dc,cmd_list,cmd_find,cmd_tell,cmd_check,cmd_visible,cmd_admin,cmd_become_admin,\
-				cmd_demote,cmd_get_demoted,cmd_kick,cmd_get_kicked,cmd_send,cmd_receive]
+				cmd_demote,cmd_get_demoted,cmd_kick,cmd_get_kicked,cmd_send,cmd_receive,cmd_upload]
+OPCODE_TABLE = COMMAND_LIST.copy() # opcode = position in this list -- new commands must be appended to the end
+for z in OPCODE_TABLE:
+	z.opcode = OPCODE_TABLE.index(z)
 COMMAND_LIST.sort(key=get_cmd_name) # sort alphabetically
+COMMAND_NAMES = {z.name: z for z in COMMAND_LIST} # name -> command
 PASSIVE_COMMANDS = [z.name for z in COMMAND_LIST if z.passive] # names of passive commands (in lowercases)
 
 # Public Functions:
 def announce(name,msg=''):
 	return f'[{name}]: {msg}'
 
-def get_args(cmd,clear_symbols=False):
+def get_args(cmd,clear_symbols=False,offsets=None):
 	# parse a command string and separate it into readable components
 	# delimit by whitespace, preserve substrings within double-quotes
 	# clear_symbols - determines if the final args will keep their outer quotes
+	# offsets - list that gets the index in cmd where each arg starts
 	args = []
 	tokens = cmd.split() # all substrings isolated by whitespace
 	composite_arg = '' # argument made of multiple tokens (enclosed in double-quotes)
@@ -238,10 +342,14 @@ def get_args(cmd,clear_symbols=False):
 				if clear_symbols:
 					composite_arg = composite_arg.strip('"')
 				args.append(composite_arg) # add composite
+				if offsets is not None:
+					offsets.append(start)
 
 		else: # same state
 			if not str_linking: # arg = token
 				args.append(x) # add arg
+				if offsets is not None:
+					offsets.append(current_pos)
 			else: # keep linking until finished
 				pass
 
@@ -253,12 +361,53 @@ def get_args(cmd,clear_symbols=False):
 		if clear_symbols:
 			composite_arg = composite_arg.strip('"')
 		args.append(composite_arg)
+		if offsets is not None:
+			offsets.append(start)
 
 	#! show args
 	if DEBUG > 1:
 		screen.add('Args: ' + str(args), screen.ATR_DEBUG)
 	return args
 
+# split a command line into args, keeping the free-text argument of the command (if any) in one piece
+def parse_command(cmd):
+	offsets = []
+	args = get_args(cmd,offsets=offsets)
+	if not args:
+		return args
+	command = COMMAND_NAMES.get(args[0].upper())
+	if command and command.tail and len(args) > command.tail:
+		args = args[:command.tail] + [cmd[offsets[command.tail]:]] # everything after and including the tail arg
+	return args
+
+# Binary commands -- opcode [1 byte] + each arg as length [2 bytes] + text
+def encode_command(args):
+	parts = [bytes([COMMAND_NAMES[args[0].upper()].opcode])]
+	for arg in args[1:]:
+		arg = bytes(arg,ENCODING)
+		parts.append(COMMAND_ARG.pack(len(arg)))
+		parts.append(arg)
+	return b''.join(parts)
+
+# raises ValueError for an unknown opcode or a cut off argument
+def decode_command(data):
+	if not data:
+		raise ValueError('empty command')
+	if data[0] >= len(OPCODE_TABLE):
+		raise ValueError(f'unknown command opcode {data[0]}')
+	args = [OPCODE_TABLE[data[0]].name] # straight from the opcode -- no parsing
+	i = 1
+	while i < len(data):
+		if i + COMMAND_ARG.size > len(data):
+			raise ValueError('command argument length cut off')
+		x, = COMMAND_ARG.unpack_from(data,i)
+		i += COMMAND_ARG.size
+		if i + x > len(data):
+			raise ValueError(f'command argument cut off - {len(data)-i} of {x} bytes')
+		args.append(str(data[i:i+x],ENCODING)) # (UnicodeDecodeError is a ValueError)
+		i += x
+	return args
+
 def create_file(name,destination=''):
 	# attempt to create the file at the target destination
 	# if a file with the same name exists, increment the filename until it is unique
@@ -412,37 +561,740 @@ def extract_files(new_zip,destination='',remove_zip=True):
 	# successful extraction, return location of extracted contents
 	return destination
 
-def send_data(sock,data,attr=screen.ATR_DYNAMIC): # input is bytes
-	# Add header to data -- property [2 bytes] + color [2 bytes] + size of message [4 bytes] (remaining bytes)
-	# size:
-	size = len(data)
-	msg_len = str(size)
-	if len(msg_len) > (HEADERSIZE-4): # header not large enough to specify msg length
-		screen.add(f'Send Error -  HEADERSIZE not large enough to specify msg length - must be less than 10^{HEADERSIZE-4} bytes!', screen.ATR_ALERT)
-		return FAILURE
-	# property and color:
-	try:
+# Hashed timer wheel -- one thread runs every delayed task (kicks, login deadlines, prompts...) instead of a sleeping thread each.
+# Tasks are filed under the tick they are due, so scheduling and cancelling cost the same however many are pending.
+# They run on the wheel thread and must be short (start a thread for anything that blocks).
+class TimerWheel():
+	def __init__(self,tick=TIMER_TICK,size=TIMER_SLOTS):
+		self.tick = tick
+		self.slots = [set() for i in range(size)]
+		self.lock = threading.Condition() # signalled when a task is scheduled
+		self.pending = 0 # tasks waiting in the slots
+		self.wakeups = [] # heap of the ticks tasks are due on -- the wheel sleeps until the first (cancelled tasks leave theirs behind)
+		self.origin = time.monotonic() # time of tick 0
+		self.current = 0 # last tick that was run
+		self.thread = None # started by the first task
+
+	def ticks(self,moment):
+		return math.floor((moment - self.origin) / self.tick)
+
+	# run task(*args) after delay seconds -- returns a ScheduledTask that can cancel it
+	def schedule(self,delay,task,*args):
+		return self.at(time.monotonic() + delay,task,*args)
+
+	# run task(*args) at deadline (time.monotonic() clock)
+	def at(self,deadline,task,*args):
+		scheduled = ScheduledTask(self,deadline,task,args)
+		with self.lock:
+			if not self.pending: # the wheel stood still -- skip the ticks nobody waited for
+				self.current = self.ticks(time.monotonic())
+			scheduled.due = max(self.current + 1, math.ceil((deadline - self.origin) / self.tick))
+			self.slots[scheduled.due % len(self.slots)].add(scheduled)
+			self.pending += 1
+			heapq.heappush(self.wakeups,scheduled.due)
+			if not self.thread:
+				self.thread = threading.Thread(target=self.run,daemon=True)
+				self.thread.start()
+			self.lock.notify()
+		return scheduled
+
+	# True if the task was still waiting (it will not run)
+	def cancel(self,scheduled):
+		with self.lock:
+			slot = self.slots[scheduled.due % len(self.slots)]
+			if scheduled not in slot:
+				return False
+			slot.remove(scheduled)
+			self.pending -= 1
+			return True
+
+	def run(self):
+		while True:
+			with self.lock:
+				while not self.pending:
+					self.lock.wait()
+				now = self.ticks(time.monotonic())
+				while self.wakeups and self.wakeups[0] <= self.current: # (already run, or cancelled)
+					heapq.heappop(self.wakeups)
+				if not self.wakeups or now < self.wakeups[0]: # sleep until the first tick a task is due on
+					self.lock.wait(self.origin + self.wakeups[0] * self.tick - time.monotonic() if self.wakeups else None)
+					continue
+				due = []
+				for tick in range(max(self.current + 1, now - len(self.slots) + 1), now + 1): # (a full turn at most)
+					slot = self.slots[tick % len(self.slots)]
+					ready = [scheduled for scheduled in slot if scheduled.due <= now]
+					slot.difference_update(ready)
+					due += ready
+				self.pending -= len(due)
+				self.current = now
+			for scheduled in sorted(due, key=lambda scheduled: scheduled.deadline):
+				try:
+					scheduled.task(*scheduled.args)
+				except Exception as e:
+					screen.add('Timer Error', screen.ATR_ALERT)
+					screen.add(str(e))
+
+# task waiting on a TimerWheel
+class ScheduledTask():
+	def __init__(self,wheel,deadline,task,args):
+		self.wheel = wheel
+		self.deadline = deadline
+		self.task = task
+		self.args = args
+		self.due = 0 # tick it runs on
+
+	def cancel(self):
+		return self.wheel.cancel(self)
+
+	def remaining(self): # seconds until it is due
+		return max(0, self.deadline - time.monotonic())
+
+timers = TimerWheel() # shared by everything in this process
+
+# Token bucket -- lets rate units per second through on average, and up to burst of them at once
+class TokenBucket():
+	def __init__(self,rate,burst):
+		self.rate = rate # tokens added per second
+		self.burst = burst # most tokens held (more than burst are never asked for -- a bigger request waits for a full bucket)
+		self.tokens = burst
+		self.stamp = time.monotonic()
+
+	def refill(self):
+		now = time.monotonic()
+		self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+		self.stamp = now
+
+	# seconds until n tokens are there (0 = right now)
+	def wait(self,n):
+		self.refill()
+		return max(0, min(n,self.burst) - self.tokens) / self.rate
+
+	# spend n tokens -- the bucket may go into debt, paid back before wait() is 0 again
+	def take(self,n):
+		self.refill()
+		self.tokens -= min(n,self.burst)
+
+# put the prompt back once a message shown in its place had its moment (unless something else took over the prompt)
+def restore_prompt(shown,old_prompt):
+	if screen.typebox.prompt == shown:
+		screen.typebox.new_prompt(old_prompt)
+		screen.display()
+
+# Buffered reader for one connection -- pulls as many bytes as the socket has ready into a reusable buffer,
+# then parses every complete frame from it before asking the socket for more
+class FrameReader():
+	def __init__(self,sock,size=BUFFERSIZE):
+		self.sock = weakref.proxy(sock) # the reader is stored against its socket (see get_reader), do not keep it alive
+		self.version = 1 # frame format in use -- switched by set_protocol once both sides agree
+		self.features = []
+		self.offered = False # the peer marked a v1 header with PROTOCOL_OFFER (it can speak v2)
+		self.streams = {} # stream id -> fragments received so far
+		self.wire = None # (version, type, flags, header + payload) of the last message when it arrived in one frame -- forwarded as it is
+		self.kind = None # type of the last message
+		self.last = 0 # where the header of the last frame parsed starts
+		self.inflater = None # deflate stream of this connection, started by the first FLAG_STREAM message
+		self.heard = time.monotonic() # when bytes last arrived
+		self.peer_interval = 0 # seconds between the peer's heartbeats, once it sent one ['heartbeat']
+		self.buffer = bytearray(size) # grows to fit the largest frame received so far
+		self.start = 0 # first byte that has not been parsed yet
+		self.end = 0 # one past the last byte received
+		self.needed = HEADERSIZE # bytes required before the next frame can be parsed
+
+	# make room for x more bytes after the end of the received data
+	def reserve(self,x):
+		if self.end + x <= len(self.buffer): # already fits
+			return
+		waiting = self.end - self.start # unparsed bytes to keep
+		if waiting + x <= len(self.buffer): # fits once the parsed bytes are dropped -- slide the rest to the front
+			with memoryview(self.buffer) as view:
+				view[:waiting] = view[self.start:self.end]
+		else: # frame is larger than the buffer -- replace it (never resize in place, views may still be held)
+			new_buffer = bytearray(max(len(self.buffer)*2, waiting+x))
+			new_buffer[:waiting] = memoryview(self.buffer)[self.start:self.end]
+			self.buffer = new_buffer
+		self.start = 0
+		self.end = waiting
+
+	# receive whatever the socket has ready (at least 1 byte, at most the free space) -- returns 0 when the peer closed
+	def fill(self):
+		self.reserve(max(self.needed - (self.end-self.start), BUFFERSIZE))
+		with memoryview(self.buffer)[self.end:] as view:
+			received = self.sock.recv_into(view)
+		self.end += received
+		self.heard = time.monotonic()
+		return received
+
+	# parse the next complete frame from the buffer -- None if it has not fully arrived yet
+	def next_frame(self):
+		available = self.end - self.start
+		if available < HEADERSIZE:
+			self.needed = HEADERSIZE
+			return None
+		header = self.last = self.start
+		# v2 -- binary header, unpacked in place
+		if self.version >= 2:
+			p, c, kind, flags, size = HEADER_V2.unpack_from(self.buffer,header)
+		# v1 -- property [2 bytes] + color [2 bytes] + size [remaining bytes], int() reads the digits straight from the buffer
+		else:
+			p = int(self.buffer[header:header+2]) # raises ValueError on a corrupt header
+			c = int(self.buffer[header+2:header+4])
+			size = int(self.buffer[header+4:header+HEADERSIZE])
+			kind = MSG_DATA
+			flags = 0
+			if self.buffer[header+4] == PROTOCOL_OFFER:
+				self.offered = True
+		if size > MAX_FRAME: # (the buffer would have to grow to fit it)
+			raise ValueError(f'frame of {size} bytes is larger than MAX_FRAME')
+		self.needed = HEADERSIZE + size
+		if available < self.needed: # rest of the message is still in transit
+			return None
+		# Payload -- handed out as a view into the buffer, valid until the next read on this connection
+		self.start += self.needed
+		self.needed = HEADERSIZE
+		return (memoryview(self.buffer)[header+HEADERSIZE:self.start], (p,c), kind, flags)
+
+	# add a fragment to its message -- returns the whole message once the final fragment arrives
+	def assemble(self,data,attr,kind,flags):
+		if len(data) < FRAGMENT_HEADER.size:
+			raise ValueError('fragment without its header')
+		stream, kind = FRAGMENT_HEADER.unpack_from(data)
+		message = self.streams.get(stream)
+		if message is None: # first fragment
+			if len(self.streams) >= MAX_STREAMS:
+				raise ValueError(f'more than {MAX_STREAMS} fragmented messages at once')
+			message = self.streams[stream] = bytearray()
+		if len(message) + len(data) - FRAGMENT_HEADER.size > MAX_FRAME:
+			raise ValueError('fragmented message is larger than MAX_FRAME')
+		message += data[FRAGMENT_HEADER.size:]
+		if not flags & FLAG_FINAL:
+			return None
+		del self.streams[stream]
+		return (memoryview(message), attr, kind, flags & ~FLAG_FINAL)
+
+	# undo the compression of a full message
+	def inflate(self,data,attr,kind,flags):
+		try:
+			if flags & FLAG_STREAM:
+				if self.inflater is None:
+					self.inflater = zlib.decompressobj(-zlib.MAX_WBITS, zdict=CHAT_DICTIONARY)
+				inflater = self.inflater
+				data = inflater.decompress(bytes(data) + COMPRESS_TRAILER, MAX_FRAME + 1)
+			else:
+				inflater = zlib.decompressobj(-zlib.MAX_WBITS, zdict=CHAT_DICTIONARY)
+				data = inflater.decompress(data, MAX_FRAME + 1)
+		except zlib.error as e:
+			raise ValueError(f'could not decompress message - {e}')
+		if len(data) > MAX_FRAME or inflater.unconsumed_tail: # (a few bytes of deflate can stand for a lot more)
+			raise ValueError('decompressed message is larger than MAX_FRAME')
+		return (memoryview(data), attr, kind, flags & ~(FLAG_COMPRESSED|FLAG_STREAM))
+
+	# add bytes that were received elsewhere (an event loop) -- instead of fill
+	def feed(self,data):
+		self.reserve(len(data))
+		self.buffer[self.end:self.end+len(data)] = data
+		self.end += len(data)
+		self.heard = time.monotonic()
+
+	# next full message from the bytes already received, never waits -- returns (payload, attr, type, flags), or None
+	def poll(self):
+		while True:
+			frame = self.next_frame()
+			if not frame:
+				return None
+			self.wire = None
+			if frame[2] == MSG_PING: # (only proves the peer is there)
+				interval = bytes(frame[0])
+				self.peer_interval = int(interval) if interval.isdigit() else 0
+				continue
+			if frame[2] == MSG_FRAGMENT:
+				frame = self.assemble(*frame)
+				if not frame:
+					continue
+			elif not frame[3] & FLAG_STREAM: # the frame can be read on its own -- valid as long as the payload view
+				self.wire = (self.version, frame[2], frame[3], memoryview(self.buffer)[self.last:self.start])
+			if frame[3] & (FLAG_COMPRESSED|FLAG_STREAM):
+				frame = self.inflate(*frame)
+			self.kind = frame[2]
+			return frame
+
+	# block until a full message is available -- returns (payload, attr, type, flags)
+	def read_frame(self):
+		while True:
+			frame = self.poll()
+			if frame:
+				return frame
+			if not self.fill(): # wait for more data
+				raise ConnectionError('Connection closed by peer.')
+
+	# raw (unframed) bytes for file transfers -- bytes already buffered are handed out before the socket is read again
+	def read_raw(self,x):
+		available = self.end - self.start
+		if available:
+			x = min(x,available)
+			data = bytes(self.buffer[self.start:self.start+x])
+			self.start += x
+			return data
+		return self.sock.recv(x)
+
+# Outgoing side of a connection -- how frames sent on this socket are encoded
+class FrameWriter():
+	def __init__(self,sock):
+		self.version = 1 # frame format in use -- switched by set_protocol once both sides agree
+		self.features = []
+		self.lock = threading.Lock() # one frame on the wire at a time
+		self.next_stream = 0 # id for the next fragmented message
+		self.bytes_sent = 0 # bytes the socket accepted (frames + files)
+		self.deflater = None # deflate stream of this connection -- only used while holding the lock ['zstream']
+
+	# build the header for a payload of x bytes
+	def header(self,x,attr,kind=MSG_DATA,flags=0):
+		# v2 -- binary header
+		if self.version >= 2:
+			if x > MAX_FRAME: # the peer would refuse it -- larger messages are fragmented (or cannot be sent)
+				raise OverflowError(f'message of {x} bytes is larger than MAX_FRAME ({MAX_FRAME} bytes)')
+			try:
+				return HEADER_V2.pack(attr[0],attr[1],kind,flags,x)
+			except Exception as e:
+				raise ValueError(f'invalid header field - {e}')
+		# v1 -- property [2 bytes] + color [2 bytes] + size of message [4 bytes] (remaining bytes)
+		if kind != MSG_DATA or flags: # only plain messages exist in v1
+			raise ValueError('frame type not supported by v1 peers')
+		msg_len = str(x)
+		if len(msg_len) > (HEADERSIZE-4): # header not large enough to specify msg length
+			raise OverflowError(f'HEADERSIZE not large enough to specify msg length - must be less than 10^{HEADERSIZE-4} bytes!')
 		# only take last 2 digits of given, pad with 0s on the left if only 1 digit is found
 		p = f'{str(attr[0])[-2:]:0>2}'
 		c = f'{str(attr[1])[-2:]:0>2}'
+		header = p + c + msg_len
+		return bytes(f'{header:<{HEADERSIZE}}', ENCODING) # left-aligned
+
+	# compress a message -- returns (payload, flags), the message is kept as it is if deflating does not make it smaller
+	# stream=True continues the connection's context (hold the lock until the result is written, the reader must see the same order)
+	def compress(self,data,flags,stream=False):
+		if stream:
+			if self.deflater is None:
+				self.deflater = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=CHAT_DICTIONARY)
+			packed = self.deflater.compress(data) + self.deflater.flush(zlib.Z_SYNC_FLUSH)
+			return packed[:-len(COMPRESS_TRAILER)], flags | FLAG_STREAM # already part of the context -- always sent
+		deflater = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=CHAT_DICTIONARY)
+		packed = deflater.compress(data) + deflater.flush()
+		if len(packed) >= len(data):
+			return data, flags
+		return packed, flags | FLAG_COMPRESSED
+
+	# split a message into fragment packages -- every fragment carries the stream id, the last one is flagged FINAL
+	def fragments(self,data,attr,kind=MSG_DATA,flags=0):
+		with self.lock:
+			stream = self.next_stream
+			self.next_stream = (stream+1) % 2**32
+		packages = []
+		data = memoryview(data)
+		for i in range(0,len(data),FRAGMENT_SIZE):
+			piece = data[i:i+FRAGMENT_SIZE] # view -- the message is not copied
+			if i + FRAGMENT_SIZE >= len(data):
+				flags |= FLAG_FINAL
+			header = self.header(FRAGMENT_HEADER.size+len(piece),attr,MSG_FRAGMENT,flags)
+			packages.append([header + FRAGMENT_HEADER.pack(stream,kind), piece])
+		return packages
+
+	# write buffers back to back without joining them -- partial sends are resumed where they stopped
+	# call while holding the lock, returns the number of bytes written
+	def write(self,sock,buffers):
+		written = 0
+		# scatter/gather -- one call for the whole list (not available on every platform)
+		if hasattr(sock,'sendmsg'):
+			buffers = [memoryview(b) for b in buffers]
+			while buffers:
+				sent = sock.sendmsg(buffers)
+				written += sent
+				self.bytes_sent += sent
+				# drop every buffer that was fully sent, trim the one that was cut off
+				while buffers and sent >= len(buffers[0]):
+					sent -= len(buffers.pop(0))
+				if sent:
+					buffers[0] = buffers[0][sent:]
+		else:
+			for b in buffers:
+				sock.sendall(b)
+				written += len(b)
+				self.bytes_sent += len(b)
+		return written
+
+# One message for many connections -- the frame is built once for every format in use and the same bytes go to each
+# (deflated on its own, also for 'zstream' connections -- a connection that would fragment the message builds its own)
+class SharedFrame():
+	def __init__(self,data,attr=screen.ATR_DYNAMIC,kind=MSG_DATA,flags=0):
+		self.data = bytes(data)
+		self.attr = attr
+		self.kind = kind
+		self.flags = flags
+		self.packages = {} # (version, compressed) -> buffers of the whole frame
+		self.lock = threading.Lock()
+
+	# how this connection encodes the message -- None if it cannot be shared
+	def format(self,writer):
+		compress = self.kind == MSG_DATA and len(self.data) >= COMPRESS_MIN and 'compress' in writer.features
+		if len(self.data) > FRAGMENT_SIZE and 'fragments' in writer.features: # fragments are numbered per connection
+			return None
+		return writer.version, compress
+
+	# buffers of the frame for this connection (built by the first one that needs them) -- None if it builds its own
+	def package(self,writer):
+		key = self.format(writer)
+		if key is None:
+			return None
+		with self.lock:
+			package = self.packages.get(key)
+			if package is None:
+				data, flags = self.data, self.flags
+				if key[1]:
+					data, flags = writer.compress(data,flags)
+				package = self.packages[key] = [writer.header(len(data),self.attr,self.kind,flags), data]
+		return package
+
+	# the frame as it was received (FrameReader.wire) -- connections with the same format get these bytes as they are
+	def forward(self,version,kind,flags,wire):
+		if kind == self.kind == MSG_DATA and not flags & ~FLAG_COMPRESSED:
+			self.packages[(version, bool(flags & FLAG_COMPRESSED))] = [bytes(wire)]
+
+	# the fragment packages of the message for a connection that cannot share it (see format) -- deflated on its own first
+	def fragments(self,writer):
+		data, flags = self.data, self.flags
+		if self.kind == MSG_DATA and len(data) >= COMPRESS_MIN and 'compress' in writer.features:
+			data, flags = writer.compress(data,flags)
+		if len(data) > FRAGMENT_SIZE:
+			return writer.fragments(data,self.attr,self.kind,flags)
+		return [[writer.header(len(data),self.attr,self.kind,flags), data]]
+
+# One package of a message already built for a connection (a fragment) -- written by send_frames like a shared frame
+class FramePiece():
+	def __init__(self,buffers):
+		self.buffers = buffers
+
+	def package(self,writer):
+		return self.buffers
+
+readers = weakref.WeakKeyDictionary() # socket -> FrameReader
+writers = weakref.WeakKeyDictionary() # socket -> FrameWriter
+registry_lock = threading.Lock()
+
+# get the reader attached to this socket (created on first use)
+def get_reader(sock):
+	with registry_lock:
+		reader = readers.get(sock)
+		if reader is None:
+			reader = readers[sock] = FrameReader(sock)
+	return reader
+
+# get the writer attached to this socket (created on first use)
+def get_writer(sock):
+	with registry_lock:
+		writer = writers.get(sock)
+		if writer is None:
+			writer = writers[sock] = FrameWriter(sock)
+	return writer
+
+# switch both directions of a connection to the agreed frame format
+def set_protocol(sock,version,features=[]):
+	for side in [get_reader(sock), get_writer(sock)]:
+		side.version = version
+		side.features = list(features)
+
+# (version, features) in use on this connection
+def get_protocol(sock):
+	writer = get_writer(sock)
+	return writer.version, writer.features
+
+# apply a transport profile to a socket (before connect / listen, or right after accept)
+# options the platform or socket family does not have are skipped -- unix domain sockets only take the buffer sizes
+def tune_socket(sock,profile=DEFAULT_PROFILE,channel=CHANNEL_CHAT):
+	options = TRANSPORT_PROFILES[profile][channel]
+	for name, size in [(socket.SO_SNDBUF, options['sndbuf']), (socket.SO_RCVBUF, options['rcvbuf'])]:
+		if size:
+			sock.setsockopt(socket.SOL_SOCKET, name, size)
+	if sock.family not in [socket.AF_INET, getattr(socket,'AF_INET6',None)]:
+		return
+	sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(options['nodelay']))
+	keepalive = options['keepalive']
+	sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, int(bool(keepalive)))
+	if keepalive:
+		idle_option = getattr(socket,'TCP_KEEPIDLE',getattr(socket,'TCP_KEEPALIVE',None)) # TCP_KEEPALIVE on macOS
+		for option, value in zip([idle_option, getattr(socket,'TCP_KEEPINTVL',None), getattr(socket,'TCP_KEEPCNT',None)], keepalive):
+			if option is not None:
+				sock.setsockopt(socket.IPPROTO_TCP, option, value)
+
+# True once nothing arrived for HEARTBEAT_MISSES of the peer's heartbeat intervals ['heartbeat']
+def peer_silent(sock,misses=HEARTBEAT_MISSES):
+	reader = get_reader(sock)
+	interval = reader.peer_interval or HEARTBEAT_INTERVAL
+	return time.monotonic() - reader.heard > interval * misses
+
+# Several byte streams carried by one connection -- every chunk written is prefixed with its channel and size
+# no thread of its own: whichever channel needs data reads the next chunk for everyone (the others wait for it)
+class Multiplexer():
+	def __init__(self,sock):
+		self.sock = sock # the real connection
+		self.lock = threading.Lock() # one chunk on the wire at a time
+		self.ready = threading.Condition() # signalled whenever a chunk was sorted into an inbox (or one was read)
+		self.inboxes = {} # channel -> chunks received but not read yet
+		self.waiting = {} # channel -> bytes in its inbox
+		self.shut = set() # channels that were shut down -- their chunks are dropped
+		self.reading = False # a channel is currently reading from the connection
+		self.closed = False
+
+	# virtual socket for one channel
+	def channel(self,number):
+		with self.ready:
+			self.inboxes.setdefault(number, collections.deque())
+			self.waiting.setdefault(number, 0)
+		return Channel(self,number)
+
+	# write buffers to a channel as a single chunk -- returns the number of bytes carried
+	def send(self,number,buffers):
+		if number in self.shut:
+			raise ConnectionError('Channel shut down.')
+		size = sum(len(b) for b in buffers)
+		writer = get_writer(self.sock)
+		with self.lock:
+			writer.write(self.sock,[MUX_HEADER.pack(number,size)] + list(buffers))
+		return size
+
+	# exactly x bytes from the connection (bytes left in its reader from before the switch come first)
+	def read_exactly(self,x):
+		reader = get_reader(self.sock)
+		data = b''
+		while len(data) < x:
+			received = reader.read_raw(x - len(data))
+			if not received:
+				raise ConnectionError('Connection closed by peer.')
+			data += received
+		return data
+
+	# an inbox is full -- nothing more is read until its channel catches up (the peer is held back by TCP)
+	def full(self):
+		return any(size >= MUX_INBOX for size in self.waiting.values())
+
+	# copy up to len(view) bytes of a channel into view -- returns 0 once the connection (or the channel) is closed
+	def receive(self,number,view):
+		while True:
+			with self.ready:
+				while True:
+					if number in self.shut:
+						return 0
+					inbox = self.inboxes[number]
+					if inbox: # data is waiting
+						return self.take(number,view)
+					if self.closed:
+						return 0
+					if not self.reading and not self.full(): # take over reading
+						self.reading = True
+						break
+					self.ready.wait()
+			# read the next chunk without holding the inboxes
+			try:
+				number_in, size = MUX_HEADER.unpack(self.read_exactly(MUX_HEADER.size))
+				if size > MAX_FRAME + HEADERSIZE: # larger than any frame
+					raise ValueError(f'chunk of {size} bytes')
+				data = self.read_exactly(size)
+			except Exception:
+				number_in, data = None, None
+			with self.ready:
+				self.reading = False
+				if data is None:
+					self.closed = True
+				elif number_in in self.inboxes and number_in not in self.shut: # chunks for unknown channels are dropped
+					self.inboxes[number_in].append(memoryview(data))
+					self.waiting[number_in] += len(data)
+				self.ready.notify_all()
+
+	# move bytes from the front of a channel's inbox into view (holding ready)
+	def take(self,number,view):
+		inbox = self.inboxes[number]
+		x = 0
+		while inbox and x < len(view):
+			chunk = inbox[0]
+			n = min(len(view) - x, len(chunk))
+			view[x:x+n] = chunk[:n]
+			if n == len(chunk):
+				inbox.popleft()
+			else:
+				inbox[0] = chunk[n:] # (a view -- the rest is not copied)
+			x += n
+		was_full = self.full()
+		self.waiting[number] -= x
+		if was_full and not self.full(): # reading can go on
+			self.ready.notify_all()
+		return x
+
+	# end one channel -- its reads return 0 and its writes fail, the other channels go on
+	# (a thread blocked reading the connection for it wakes up with the next chunk that arrives -- or right away once every channel is shut)
+	def shutdown(self,number):
+		with self.ready:
+			self.shut.add(number)
+			self.inboxes[number].clear()
+			self.waiting[number] = 0
+			self.ready.notify_all()
+			everyone = self.shut >= set(self.inboxes)
+		if everyone:
+			try:
+				self.sock.shutdown(socket.SHUT_RDWR)
+			except OSError:
+				pass
+
+	def close(self):
+		with self.ready:
+			self.closed = True
+			self.ready.notify_all()
+		try:
+			self.sock.shutdown(socket.SHUT_RDWR) # wakes up a channel blocked on the connection
+		except OSError:
+			pass
+		self.sock.close()
+
+# One channel of a multiplexed connection -- used in place of a socket (frames, readers and writers work as usual)
+class Channel():
+	def __init__(self,mux,number):
+		self.mux = mux
+		self.number = number
+
+	def recv_into(self,view):
+		return self.mux.receive(self.number,view)
+
+	def recv(self,x):
+		data = bytearray(x)
+		received = self.mux.receive(self.number,memoryview(data))
+		return bytes(data[:received])
+
+	def sendmsg(self,buffers):
+		return self.mux.send(self.number,buffers)
+
+	def sendall(self,data):
+		self.mux.send(self.number,[data])
+
+	def shutdown(self,how=socket.SHUT_RDWR): # this channel only
+		self.mux.shutdown(self.number)
+
+	def close(self): # closes every channel
+		self.mux.close()
+
+# Version negotiation -- the server offers, the client picks, the server confirms:
+# 1) server sends the welcome msg with a v1 header whose size is marked with PROTOCOL_OFFER
+# 2) client replies 'PASS' (stay on v1) or 'PASS [version] [features]' and switches to that version
+# 3) server switches too and answers with a MSG_HELLO frame listing the features it accepted
+def offer_protocol(sock,msg,attr=screen.ATR_DYNAMIC):
+	data = bytes(msg,ENCODING)
+	header = f'{str(attr[0])[-2:]:0>2}{str(attr[1])[-2:]:0>2}+{len(data)}' # int() ignores the sign, so v1 clients read the size as usual
+	sock.sendall(bytes(f'{header:<{HEADERSIZE}}',ENCODING) + data)
+
+def accept_protocol(sock,extra=[]): # client -- after an offer was received, extra 'key=value' fields ride along with the reply
+	features = [f for f in PROTOCOL_FEATURES if f != 'pipeline' or extra] # pipelining needs the name + pairing token fields
+	send_msg(sock, ' '.join(['PASS', str(PROTOCOL_VERSION)] + features + extra))
+	set_protocol(sock,PROTOCOL_VERSION)
+	hello = receive_data(sock)
+	if hello == FAILURE:
+		raise Exception('Server did not confirm the protocol.')
+	features = str(hello,ENCODING).split()
+	set_protocol(sock,PROTOCOL_VERSION,features)
+	return features
+
+def confirm_protocol(sock,reply): # server -- reply to the offer, raises like check_pass
+	response = str(reply,ENCODING).split()
+	if len(response) < 2 or response[0] != 'PASS': # v1 client
+		if check_pass(reply) == FAILURE:
+			raise Exception('PASS failed!')
+		return 1
+	try:
+		version = min(int(response[1]), PROTOCOL_VERSION)
+	except ValueError:
+		raise Exception('Unexpected response received for protocol offer.')
+	if version < 2:
+		return 1
+	features = [f for f in response[2:] if f in PROTOCOL_FEATURES]
+	if 'opcodes' not in features and 'fastsend' in features: # a text command would split a file name with spaces in it
+		features.remove('fastsend')
+	set_protocol(sock,version,features)
+	send_data(sock,bytes(' '.join(features),ENCODING),kind=MSG_HELLO)
+	return version
+
+
+def send_data(sock,data,attr=screen.ATR_DYNAMIC,kind=MSG_DATA,flags=0): # input is bytes
+	writer = get_writer(sock)
+	packages = None # built while holding the connection instead (streaming compression)
+	# Add header to data -- format depends on the version agreed for this connection
+	try:
+		writer.header(len(data),attr,kind,flags) # check the fields before anything is sent
+		compress = kind == MSG_DATA and len(data) >= COMPRESS_MIN and 'compress' in writer.features
+		if compress and (len(data) > FRAGMENT_SIZE or 'zstream' not in writer.features):
+			data, flags = writer.compress(data,flags) # on its own -- pieces of other messages may be sent in between
+			compress = False
+		# large messages are split up so other frames can be sent between the pieces
+		if len(data) > FRAGMENT_SIZE and 'fragments' in writer.features:
+			packages = writer.fragments(data,attr,kind,flags)
+		elif not compress:
+			packages = [[writer.header(len(data),attr,kind,flags), data]] # header goes out right before the data (not joined)
+	except OverflowError as e:
+		screen.add(f'Send Error -  {e}', screen.ATR_ALERT)
+		return FAILURE
 	except Exception as e:
 		screen.add('Send Error -  invalid attribute argument!', screen.ATR_ALERT)
 		screen.add(str(e))
 		return FAILURE
-	header = p + c + msg_len
-	package = bytes(f'{header:<{HEADERSIZE}}', ENCODING) + data # prepend a left-aligned header to the data
-	# Send package [bytes]
+	# Send package(s) [bytes]
 	try:
-		sock.send(package)
+		if packages is None:
+			with writer.lock:
+				data, flags = writer.compress(data,flags,True)
+				writer.write(sock,[writer.header(len(data),attr,kind,flags), data])
+		for package in packages or []:
+			with writer.lock:
+				writer.write(sock,package)
+			if len(packages) > 1:
+				time.sleep(0) # hand the lock to any sender waiting between fragments
 	except Exception as e:
 		screen.add('Send Error -  connection aborted!', screen.ATR_ALERT)
 		screen.add(str(e))
 		return FAILURE
 	return SUCCESS
 
+# send a message built for many connections -- the shared bytes if this connection can take them, its own frame otherwise
+def send_frame(sock,frame):
+	return send_frames(sock,[frame])
+
+# send several messages back to back -- frames this connection can share go out in a single write (each one still whole)
+def send_frames(sock,frames):
+	writer = get_writer(sock)
+	buffers = [] # shared frames waiting to be written together
+	for frame in frames + [None]:
+		try:
+			package = frame and frame.package(writer)
+		except OverflowError as e:
+			screen.add(f'Send Error -  {e}', screen.ATR_ALERT)
+			return FAILURE
+		except Exception as e:
+			screen.add('Send Error -  invalid attribute argument!', screen.ATR_ALERT)
+			screen.add(str(e))
+			return FAILURE
+		if package:
+			buffers += package
+			continue
+		# write what was gathered so far -- before a frame that is built for this connection alone (or at the end)
+		if buffers:
+			try:
+				with writer.lock:
+					writer.write(sock,buffers)
+			except Exception as e:
+				screen.add('Send Error -  connection aborted!', screen.ATR_ALERT)
+				screen.add(str(e))
+				return FAILURE
+			buffers = []
+		if frame and send_data(sock,frame.data,frame.attr,frame.kind,frame.flags) == FAILURE:
+			return FAILURE
+	return SUCCESS
+
 def upload_file(sock,path,show_progress=True): # input is file path -- sends file while reading
 	# assumes valid path
-	with open(path,'rb') as file: # close file automatically
+	writer = get_writer(sock) # hold the connection for the whole file so no frames land inside it
+	with open(path,'rb') as file, writer.lock: # close file / release connection automatically
 		size = os.path.getsize(path)
 		msg_len = str(size) # size of file in words
 		bytes_sent = 0
@@ -452,17 +1304,21 @@ def upload_file(sock,path,show_progress=True): # input is file path -- sends fil
 		if len(msg_len) > FILE_HEADERSIZE: # header not large enough to hold length of file (each byte of msg_len represents another ^10 bytes of file size)
 			# send a header of 0 to indicate failure
 			header = f'{0:<{FILE_HEADERSIZE}}'
-			sock.send(bytes(header,ENCODING))
+			writer.write(sock,[bytes(header,ENCODING)])
 			screen.add(f'Upload File Error - FILE_HEADERSIZE not large enough to specify file length - must be less than 10^{FILE_HEADERSIZE} bytes!', screen.ATR_ALERT)
 			return FAILURE
 		try:
 		# send header
 			header = f'{size:<{FILE_HEADERSIZE}}'
-			sock.send(bytes(header,ENCODING))
+			writer.write(sock,[bytes(header,ENCODING)])
+		# no progress to show -- let the kernel copy the file straight to the socket
+			if not show_progress and hasattr(sock,'sendfile'):
+				writer.bytes_sent += sock.sendfile(file)
+				return SUCCESS
 		# start sending file:
 			data = file.read(FILE_BUFFERSIZE)
 			while data:
-				sock.send(data)
+				writer.write(sock,[data])
 				# show progress bar
 				if show_progress:
 					bytes_sent += len(data)
@@ -478,9 +1334,7 @@ def upload_file(sock,path,show_progress=True): # input is file path -- sends fil
 		if show_progress:
 			screen.typebox.new_prompt('Upload Complete! | ')
 			screen.display()
-			time.sleep(1) #$
-			screen.typebox.new_prompt(old_prompt)
-			screen.display()
+			timers.schedule(1,restore_prompt,'Upload Complete! | ',old_prompt) #$
 		return SUCCESS
 
 def send_msg(sock,msg,attr=screen.ATR_DYNAMIC): # input is a string -- encodes for you
@@ -492,6 +1346,27 @@ def send_pass(sock):
 def send_fail(sock):
 	send_msg(sock,'FAIL')
 
+def send_rejection(sock,reason): # server -- instead of the welcome msg (v1 frame, every client can read it)
+	send_msg(sock,f'{PROTOCOL_REJECT} {reason}',screen.ATR_ALERT)
+
+# send a command (args = name + arguments) -- as an opcode if the peer agreed to it, otherwise as a line of text
+def send_command(sock,args):
+	if 'opcodes' in get_writer(sock).features:
+		return send_data(sock,encode_command(args),kind=MSG_COMMAND)
+	return send_msg(sock,' '.join(args))
+
+def check_rejection(data): # client -- the reason the server turned this connection away, None for a welcome msg
+	words = str(data,ENCODING).split(' ',1)
+	if words[0] == PROTOCOL_REJECT:
+		return words[1] if len(words) > 1 else ''
+	return None
+
+def check_shutdown(sock,data): # client -- (seconds to wait before reconnecting, notice) if the msg just read is the server closing, None for a chat msg
+	if get_reader(sock).kind != MSG_BYE: # (chat text that looks like one is still chat)
+		return None
+	words = str(data,ENCODING).split(' ',1)
+	return int(words[0]) if words[0].isdigit() else 0, words[1] if len(words) > 1 else ''
+
 def check_pass(data): # must be used in a try/except block
 	read_data = False
 	try:
@@ -514,155 +1389,132 @@ def read_msg(data,attr):
 	move_screen = 0
 	if screen.is_latest(): # (if already on bottom) bring screen down to see new msg
 		move_screen = 1
-	screen.add(data.decode(ENCODING),attr)
+	screen.add(str(data,ENCODING),attr) # data may be a view into the read buffer
 	screen.display(show_latest=move_screen) # update screen without user input
 
 # continually receives data and performs an action on it -- if no action is given the first message read is returned
+# the action receives a memoryview of the payload that is only valid until it returns (copy it to keep it)
 def receive_data(sock,action=None,get_feature=False):
-	full_msg = b''
-	new_msg = True # can start to read a new msg (i.e. not in the middle of reading another msg)
-	header = '' # size of new message in bytes - string
-	size = 0
-	attr = screen.ATR_DYNAMIC
-	leftover_bytes = False
-	# Start receiving packets from the stream
+	reader = get_reader(sock)
+	# Start receiving frames from the stream
 	while True:
-		if not leftover_bytes:
-			try:
-				data = sock.recv(BUFFERSIZE) # receive data in packets of x bytes
-			except Exception as e:
-				if DEBUG:
-					screen.add('Err.4 - Connection terminated!', screen.ATR_ALERT)
-					screen.add(str(e))
-					screen.display(1)
-				return FAILURE
-		else:
-			leftover_bytes = False # use them up this iteration
-
-		# Read Header
-		if new_msg:
-			remaining_data = HEADERSIZE-len(header) # how many bytes remain until the header is fully received
-			if remaining_data > len(data): # not last packet for the header
-				header += data.decode(ENCODING)
-			else: # final packet
-				header += data[:remaining_data].decode(ENCODING)
-				# Header has been received
-				try:
-					p = int(header[:2]) # property
-					c = int(header[2:4]) # color
-					size = int(header[4:]) # get size of message
-					attr = (p,c)
-				except Exception as e:
-					if DEBUG:
-						screen.add(f'Receive Error -  could not interpret header.', screen.ATR_ALERT)
-						screen.add(str(e))
-						screen.display(1)
-					header = '' # erase faulty header
-					return FAILURE
-				if DEBUG > 1: # show size of msg
-					screen.add(f'*** Receiving New Message - [{size}] bytes ***', screen.ATR_DEBUG) #!
-					screen.display(1)
-				new_msg = False 
-				# Handle excess data (if any)
-				data = data[remaining_data:]
-
-		# Read Data
-		if not new_msg:
-			# Append data
-			remaining_data = size-len(full_msg)
-			if remaining_data > len(data): # not the last packet for the message
-				full_msg += data
-			else: # final packet
-				full_msg += data[:remaining_data] # add only as much data as the msg length specified
-				# Full message has been received:
-				if DEBUG > 1:
-					screen.add(f'*** Message Received! ***', screen.ATR_DEBUG) #!
-					screen.display(1)
-				if action:
-					if get_feature:
-						action(full_msg,attr) # perform task on the encoded package
-					else:
-						action(full_msg)
-				else: # no action (return data)
-					output = (full_msg,attr) if get_feature else full_msg # attach or omit attribute
-					return output # send package to caller
-				header = ''
-				size = 0
-				full_msg = b''
-				new_msg = True
-				# Handle excess data (if any)
-				data = data[remaining_data:]
-				leftover_bytes = True
+		try:
+			data, attr, kind, flags = reader.read_frame()
+		except ValueError as e:
+			if DEBUG:
+				screen.add(f'Receive Error -  could not interpret header.', screen.ATR_ALERT)
+				screen.add(str(e))
+				screen.display(1)
+			return FAILURE
+		except Exception as e:
+			if DEBUG:
+				screen.add('Err.4 - Connection terminated!', screen.ATR_ALERT)
+				screen.add(str(e))
+				screen.display(1)
+			return FAILURE
+		# Full message has been received:
+		if DEBUG > 1:
+			screen.add(f'*** Message Received - [{len(data)}] bytes ***', screen.ATR_DEBUG) #!
+			screen.display(1)
+		if action:
+			if get_feature:
+				action(data,attr) # perform task on the encoded package
+			else:
+				action(data)
+		else: # no action (return data)
+			data = bytes(data) # copy out of the read buffer
+			output = (data,attr) if get_feature else data # attach or omit attribute
+			return output # send package to caller
+
+# args of a received command frame (text or opcode)
+def frame_command(data,attr,kind,flags):
+	if kind == MSG_COMMAND:
+		return decode_command(data)
+	return parse_command(str(data,ENCODING))
+
+# receive the next command -- returns its args (name first) whether it was sent as text or as an opcode, FAILURE if disconnected
+# a command that cannot be decoded is reported and skipped -- the connection itself is fine
+def receive_command(sock):
+	while True:
+		try:
+			frame = get_reader(sock).read_frame()
+		except Exception as e:
+			if DEBUG:
+				screen.add('Err.4 - Connection terminated!', screen.ATR_ALERT)
+				screen.add(str(e))
+				screen.display(1)
+			return FAILURE
+		try:
+			return frame_command(*frame)
+		except ValueError as e:
+			screen.add('Receive Error -  invalid command!', screen.ATR_ALERT)
+			screen.add(str(e))
 
 # collect and assemble a file from the socket connection -- write to file as the data is read
 def download_file(sock,destination,show_progress=True): # assume valid download path is given (destination)
-	header = '' # full size of file
+	reader = get_reader(sock) # bytes that arrived with the last frame belong to the file
+	header = b'' # full size of file
 	size = 0
 	bytes_read = 0 # how much of the file has been received
 	if show_progress:
 		old_prompt = screen.typebox.prompt
 	# Open empty file -- close automatically on failure
 	with open(destination,'wb') as file:
+		# Read Header
+		try:
+			while len(header) < FILE_HEADERSIZE:
+				data = reader.read_raw(FILE_HEADERSIZE-len(header))
+				if not data:
+					raise Exception('Connection closed before the header was received.')
+				header += data
+		except Exception as e:
+			screen.add('Download File Error - connection aborted.', screen.ATR_ALERT)
+			screen.add(str(e))
+			screen.display(1)
+			return FAILURE
+		try:
+			size = int(header)
+			if size <= 0: # must be concrete message
+				raise Exception('Received file size of 0.')
+			if DEBUG > 1:
+				screen.add(f'*** Incoming File - [{size}] bytes ***', screen.ATR_DEBUG) #!
+				screen.display(1)
+		except Exception as e:
+			screen.add('Download File Error - could not interpret header.', screen.ATR_ALERT)
+			screen.add(str(e))
+			screen.display(1)
+			return FAILURE
+
 		# Start receiving chunks of data
-		while True:
+		while bytes_read < size:
 			try:
-				data = sock.recv(FILE_BUFFERSIZE) # receive data in packets of x bytes
+				# never read past the end of the file (data after it belongs to the next message)
+				data = reader.read_raw(min(FILE_BUFFERSIZE, size-bytes_read))
+				if not data:
+					raise Exception('Connection closed mid-file.')
 			except Exception as e:
 				screen.add('Download File Error - connection aborted.', screen.ATR_ALERT)
 				screen.add(str(e))
 				screen.display(1)
 				return FAILURE
-
-			# Read Header -- safely assume header is smaller than the file buffer size
-			if not header:
-				header = data[:FILE_HEADERSIZE].decode(ENCODING)
-				try:
-					size = int(header)
-					if size <= 0: # must be concrete message
-						raise Exception('Received file size of 0.')
-					if DEBUG > 1:
-						screen.add(f'*** Incoming File - [{size}] bytes ***', screen.ATR_DEBUG) #!
-						screen.display(1)
-				except Exception as e:
-					screen.add('Download File Error - could not interpret header.', screen.ATR_ALERT)
-					screen.add(str(e))
-					screen.display(1)
-					return FAILURE
-				# Remove header from packet so that excess data from this packet can be written immediately
-				data = data[FILE_HEADERSIZE:]
-
-			# Read File
-			if header:
-				# Build file
-				remaining_data = size - bytes_read # how many more bytes need to be delivered
-				# do not add excess data to the file (in case more data appears in the stream after the file is finished)
-				data = data[:remaining_data]
-				file.write(data) # save data to file
-				bytes_read += len(data)
-				# show progress bar
-				if show_progress:
-					screen.typebox.new_prompt(f'Downloading... [{int((bytes_read/size)*100)}%] | ')
-					screen.display()
-
-				 # Finished (read entire file)
-				if bytes_read == size:
-					if DEBUG > 1: # show bytes read
-						screen.add(f'*** File Received - [{(bytes_read)}/{size}] bytes read ***', screen.ATR_DEBUG) #!
-						screen.display(1)
-					# restore prompt
-					if show_progress:
-						screen.typebox.new_prompt('Download Complete! | ')
-						screen.display()
-						time.sleep(1) #$
-						screen.typebox.new_prompt(old_prompt)
-						screen.display()
-					# file is complete
-					file.close()
-					return SUCCESS
-				elif bytes_read > size: # wrote excess data to the file
-					screen.add('Download File Error - data overflow.', screen.ATR_ALERT)
-					screen.display()
-					return FAILURE
+			file.write(data) # save data to file
+			bytes_read += len(data)
+			# show progress bar
+			if show_progress:
+				screen.typebox.new_prompt(f'Downloading... [{int((bytes_read/size)*100)}%] | ')
+				screen.display()
+
+		# Finished (read entire file)
+		if DEBUG > 1: # show bytes read
+			screen.add(f'*** File Received - [{(bytes_read)}/{size}] bytes read ***', screen.ATR_DEBUG) #!
+			screen.display(1)
+		# restore prompt
+		if show_progress:
+			screen.typebox.new_prompt('Download Complete! | ')
+			screen.display()
+			timers.schedule(1,restore_prompt,'Download Complete! | ',old_prompt) #$
+		# file is complete
+		return SUCCESS
 
 
 # Run only if this is being used as the server, NOT imported by the client
@@ -671,9 +1523,55 @@ if __name__ == '__main__':
 	# create an endpoint for the server
 	SERVER_SOCKET = socket.socket(socket.AF_INET,socket.SOCK_STREAM) # for standard messages
 	COMMAND_SOCKET = socket.socket(socket.AF_INET,socket.SOCK_STREAM) # for command processing
+	UNIX_PATH = None # also listen on this socket file (and UNIX_PATH + COMMAND_SUFFIX) for clients on this machine
+	UNIX_SOCKETS = [] # [server, command] once bound
+	PROFILE = DEFAULT_PROFILE # transport profile applied to every connection (--profile)
+	ENGINES = ['threads','asyncio','selectors'] # how connections are served (--engine)
+	ENGINE = 'threads'
+	ASYNC_IDLE_TIME = 30 # seconds a handler thread of the asyncio engine waits for work before it exits
+	ASYNC_HIGH_WATER = 1 << 20 # bytes queued for a client before a handler waits for it to catch up
+	REACTOR_BATCH = 64 # buffers the reactor hands to one sendmsg call (the system takes only so many -- IOV_MAX)
+	async_loop = None # event loop of the asyncio engine, once running
+	async_servers = []
+	reactor = None # Reactor of the selectors engine
+	WORKERS = 1 # processes sharing the ports (--workers) -- more than 1 makes this process the hub
+	WORKER = 0 # number of this worker process, 0 in the hub (or when there is a single process)
+	bus = None # link to the hub (worker processes)
+	hub = None # links to the workers (hub process)
+	members = {} # every active user of every worker -- name -> (worker, address, hidden) [WORKERS > 1]
+	REMOTE_OPERATIONS = ['tell','busy','command','kick'] # Client methods other workers may call
+	BUS_TIMEOUT = 60 # seconds a worker waits for an answer from the hub (covers the longest wait for a busy user)
 	DOWNLOAD_FOLDER = 'downloads'
 	HIDDEN_CHARS = '*'
-	MAX_USERS = 10
+	MAX_USERS = 10 # connections beyond this are turned away (--max-users)
+	HANDSHAKE_WORKERS = 4 # threads that log new connections in (threads engine) (--handshake-workers)
+	HANDSHAKE_QUEUE = 16 # connections waiting for one of them -- more are turned away until some finish (--handshake-queue)
+	AUTH_TIMEOUT = 60 # seconds a new connection has to finish logging in -- not counting the time its user takes to pick a name (--auth-timeout)
+	NAME_TIMEOUT = 300 # seconds a user may take to pick a name (--name-timeout)
+	KICK_TIMEOUT = 30 # seconds a kicked user may stay busy before their connections are dropped
+	DRAIN_TIMEOUT = 15 # seconds /quit lets commands and file transfers in progress finish before cutting them off
+	RECONNECT_HINT = 5 # seconds clients are told to wait before reconnecting (in case the server is restarted)
+	draining = False # shutting down -- no new work is started
+	STACK_SIZE = 256 * 1024 # bytes of stack for every thread the server starts -- memory per connection stays predictable (--stack-size KB)
+	OUTBOX_SIZE = 256 # frames queued for a client that falls behind
+	OUTBOX_POLICIES = ['drop','disconnect','block'] # what happens to a broadcast once a client's outbox is full (--slow-clients)
+	OUTBOX_POLICY = 'drop'
+	OUTBOX_DROP_LIMIT = 512 # chat frames a client may miss before the 'disconnect' policy cuts it off
+	COALESCE_WINDOW = 0 # seconds chat waits for more messages to share one write per user (--coalesce MS) -- 0 sends each at once
+	COALESCE_MAX = 64 # frames written together at most
+	FLOOD_MESSAGES = 20 # chat messages a user may send per second (--flood-limit MSGS KB) -- 0 = no limit
+	FLOOD_BYTES = 32 * 1024 # bytes of chat a user may send per second -- 0 = no limit
+	FLOOD_BURST = 2 # seconds' worth of either a user may send at once before the limits kick in
+	FLOOD_ACTIONS = ['delay','drop','warn','kick'] # what happens to chat over the limits (--flood-action)
+	FLOOD_ACTION = 'delay'
+	FLOOD_WARN_INTERVAL = 5 # seconds between warnings to the same user ('warn')
+	BACKGROUND_COMMANDS = ['CLALL','QUIT','END','TELL','ADMIN','DEMOTE'] # console commands that wait on users -- they run as jobs so the console stays free
+	console_pool = None # HandlerPool that runs the jobs
+	BROADCAST_WORKERS = 8 # threads that send a command to every user at once (/clall) -- the other users wait their turn
+	command_pool = None # HandlerPool of those threads
+	console_jobs = {} # jobs in progress -- number -> (command, start time)
+	job_numbers = itertools.count(1)
+	job_lock = threading.Lock()
 	# make sure download folder is accessible
 	if not os.path.isdir(DOWNLOAD_FOLDER):
 		try:
@@ -688,12 +1586,76 @@ if __name__ == '__main__':
 			screen.close()
 			exit(3)
 
+	# Command-line arguments -- also serve clients on this machine through a socket file, pick a transport profile
+	options = sys.argv[1:]
+	while options:
+		flag = options.pop(0)
+		if flag == '--unix' and options:
+			UNIX_PATH = options.pop(0)
+		elif flag == '--profile' and options and options[0] in TRANSPORT_PROFILES:
+			PROFILE = options.pop(0)
+		elif flag == '--engine' and options and options[0] in ENGINES:
+			ENGINE = options.pop(0)
+		elif flag == '--workers' and options and options[0].isdigit() and int(options[0]) > 0:
+			WORKERS = int(options.pop(0))
+		elif flag == '--max-users' and options and options[0].isdigit() and int(options[0]) > 0:
+			MAX_USERS = int(options.pop(0))
+		elif flag == '--handshake-workers' and options and options[0].isdigit() and int(options[0]) > 0:
+			HANDSHAKE_WORKERS = int(options.pop(0))
+		elif flag == '--handshake-queue' and options and options[0].isdigit() and int(options[0]) > 0:
+			HANDSHAKE_QUEUE = int(options.pop(0))
+		elif flag == '--auth-timeout' and options and options[0].isdigit() and int(options[0]) > 0:
+			AUTH_TIMEOUT = int(options.pop(0))
+		elif flag == '--name-timeout' and options and options[0].isdigit() and int(options[0]) > 0:
+			NAME_TIMEOUT = int(options.pop(0))
+		elif flag == '--stack-size' and options and options[0].isdigit() and int(options[0]) >= 32: # (the smallest threading accepts)
+			STACK_SIZE = int(options.pop(0)) * 1024
+		elif flag == '--slow-clients' and options and options[0] in OUTBOX_POLICIES:
+			OUTBOX_POLICY = options.pop(0)
+		elif flag == '--coalesce' and options and options[0].isdigit():
+			COALESCE_WINDOW = int(options.pop(0)) / 1000
+		elif flag == '--heartbeat' and options and options[0].isdigit():
+			HEARTBEAT_INTERVAL = int(options.pop(0))
+		elif flag == '--heartbeat-misses' and options and options[0].isdigit() and int(options[0]) > 0:
+			HEARTBEAT_MISSES = int(options.pop(0))
+		elif flag == '--flood-limit' and len(options) > 1 and options[0].isdigit() and options[1].isdigit():
+			FLOOD_MESSAGES = int(options.pop(0))
+			FLOOD_BYTES = int(options.pop(0)) * 1024
+		elif flag == '--flood-action' and options and options[0] in FLOOD_ACTIONS:
+			FLOOD_ACTION = options.pop(0)
+		else:
+			screen.add(f'Usage: simple_server.py [--unix PATH] [--profile {"|".join(TRANSPORT_PROFILES)}] [--engine {"|".join(ENGINES)}] [--workers N] [--max-users N] [--handshake-workers N] [--handshake-queue N] [--auth-timeout SECONDS] [--name-timeout SECONDS] [--stack-size KB] [--slow-clients {"|".join(OUTBOX_POLICIES)}] [--coalesce MS] [--heartbeat SECONDS] [--heartbeat-misses N] [--flood-limit MSGS KB] [--flood-action {"|".join(FLOOD_ACTIONS)}]', screen.ATR_ALERT)
+			screen.display(1)
+			screen.pause()
+			screen.close()
+			exit(4)
+	if not HEARTBEAT_INTERVAL: # --heartbeat 0 -- rely on the transport profile's keepalive
+		PROTOCOL_FEATURES.remove('heartbeat')
+	# workers share the ports with SO_REUSEPORT and hand command connections to each other -- blocking sockets only
+	if WORKERS > 1 and (ENGINE != 'threads' or not hasattr(socket,'SO_REUSEPORT') or not hasattr(socket,'send_fds')):
+		screen.add('--workers needs the threads engine and a system with SO_REUSEPORT and descriptor passing (Linux, BSD, macOS).', screen.ATR_ALERT)
+		screen.display(1)
+		screen.pause()
+		screen.close()
+		exit(4)
+
 	client_list = []
 	reserved_names = [SERVER_NAME] # uppercase only, users cannot choose these names
 	hidden_names = [] # names of hidden users
 	# control access to shared resources (between threads):
 	name_lock = threading.Lock()
 	delivery_lock = threading.Lock()
+	admission_lock = threading.Lock()
+	departures = threading.Condition() # signalled when a client is removed
+	handshakes = {} # connections logging in -- socket -> ScheduledTask that cuts it off after AUTH_TIMEOUT (NAME_TIMEOUT while parked)
+	handshake_queue = queue.SimpleQueue() # logins waiting for a handshake thread (threads engine) -- admission keeps it short
+	waiting_room = None # Reactor that watches the parked logins -- their users are typing a name (threads engine)
+	parked_logins = 0
+	# command connections opened by pipelined clients before their name was approved -- token -> (socket, address)
+	pending_pairs = {}
+	pairing = threading.Condition() # signalled when a command connection is parked
+	PAIR_TIMEOUT = 10 # seconds a pipelined client has to open its command connection (and a parked one waits to be claimed)
+	PAIR_LIMIT = 32 # command connections parked at once -- more are turned away
 	# additional resources
 	the_raven = poem_extractor.Extractor('resources/the_raven.txt')
 
@@ -707,49 +1669,197 @@ if __name__ == '__main__':
 			self.cmd_address = None
 			self.hidden = False
 			self.active = False # become active once authorized
-			self.command_lock = threading.Lock() # processing a cmd
-			# use lock because multiple instances may be waiting for the command port at once (accept one at a time).YY
+			self.pair_token = None # pipelined clients claim their command connection with this
+			self.mux = None # chat and commands share the main connection ['mux']
+			self.outbox = None # frames waiting to be sent on the main connection -- every write goes through it once active
+			# flood limits on the chat this client sends (FLOOD_MESSAGES, FLOOD_BYTES)
+			self.message_bucket = TokenBucket(FLOOD_MESSAGES,FLOOD_MESSAGES * FLOOD_BURST) if FLOOD_MESSAGES else None
+			self.byte_bucket = TokenBucket(FLOOD_BYTES,FLOOD_BYTES * FLOOD_BURST) if FLOOD_BYTES else None
+			self.flooded = 0 # chat frames that arrived over the limits
+			self.warned = 0 # when the user was last told to slow down
+			# command slot -- held while a cmd is processed with this client, because multiple instances may be waiting for the command port at once (accept one at a time).
+			self.command_slot = threading.Condition() # signalled the moment the slot is released
+			self.in_command = False # slot taken
+			self.cancelled = 0 # bumped to turn away everyone waiting for the slot
+			self.slot_waiters = collections.deque() # claim_later -- [task, args, ScheduledTask] served before threads waiting in claim_slot
 
 		# create a msg revealing the endpoint of this client's main connection
 		def get_location(self):
 			return f'{self.username} is connected from - {self.address[0]}:{self.address[1]}'
 
+		# take the name if nobody has it -- returns True if it is now this client's
+		def reserve(self,name):
+			if bus: # names are kept by the hub, for every worker
+				if not bus.request('RESERVE',name):
+					return False
+			else:
+				with name_lock: # only 1 user may be checked at a time (incase they try the same name)
+					if name in reserved_names:
+						return False
+					reserved_names.append(name)
+			self.username = name # add identity to client
+			return True
+
+		def set_hidden(self,hidden):
+			self.hidden = hidden
+			if hidden:
+				hidden_names.append(self.username)
+			else:
+				hidden_names.remove(self.username)
+			if bus: # other workers hide this user too
+				bus.send('HIDE',self.username,hidden)
+
+		# queue a SharedFrame for the main connection (sent right away before the client is active)
+		def send(self,frame,chat=False): # chat -- a slow client may miss it, and it may wait to share a write (COALESCE_WINDOW)
+			if self.outbox:
+				self.outbox.put(frame,chat)
+			else:
+				send_frame(self.sock,frame)
+
+		# what other users (and other workers) can do to this client:
+		def tell(self,msg,attr):
+			self.send(SharedFrame(bytes(msg,ENCODING),attr))
+
+		def busy(self):
+			return self.in_command
+
+		# send a command once the client is free -- FAILURE if they stay busy for timeout seconds
+		def command(self,args,timeout):
+			if self.claim_slot(timeout) == FAILURE:
+				return FAILURE
+			try:
+				send_command(self.cmd_sock,args)
+			finally:
+				self.release_slot()
+			return SUCCESS
+
+		# charge a chat frame of size bytes to the flood limits -- returns the seconds until it would have been within them (0 = it is)
+		# a frame over the limits is only charged if it still goes through ('delay')
+		def meter(self,size):
+			charges = [(bucket, n) for bucket, n in [(self.message_bucket,1), (self.byte_bucket,size)] if bucket]
+			wait = max([bucket.wait(n) for bucket, n in charges], default=0)
+			if wait:
+				self.flooded += 1
+			if not wait or FLOOD_ACTION == 'delay':
+				for bucket, n in charges:
+					bucket.take(n)
+			return wait
+
+		def kick(self,msg): # once the user is free (no thread waits for it) -- cut off if they stay busy for KICK_TIMEOUT
+			self.claim_later(kick_client,(self,msg),KICK_TIMEOUT,cut_off)
+
+		# wait for the command slot and take it -- FAILURE after timeout seconds (None = no limit), if the wait is cancelled or the server is shutting down
+		def claim_slot(self,timeout=None):
+			if draining: # no new commands
+				return FAILURE
+			with self.command_slot:
+				cancelled = self.cancelled
+				self.command_slot.wait_for(lambda: not self.in_command or self.cancelled != cancelled, timeout)
+				if self.in_command or self.cancelled != cancelled:
+					return FAILURE
+				self.in_command = True
+				return SUCCESS
+
+		# take the command slot without a waiting thread -- task(*args) runs with the slot held (and must release it) as soon as it is free,
+		# on the thread that frees it -- expired(self) runs on the timer wheel instead if that takes longer than timeout seconds
+		def claim_later(self,task,args,timeout,expired):
+			with self.command_slot:
+				if self.in_command:
+					waiter = [task, args, None]
+					waiter[2] = timers.schedule(timeout,self.expire_claim,waiter,expired)
+					self.slot_waiters.append(waiter)
+					return
+				self.in_command = True
+			task(*args)
+
+		def expire_claim(self,waiter,expired):
+			with self.command_slot:
+				if not any(w is waiter for w in self.slot_waiters): # got the slot in time
+					return
+				self.slot_waiters.remove(waiter)
+			expired(self)
+
+		def release_slot(self):
+			with self.command_slot:
+				if not self.slot_waiters:
+					self.in_command = False
+					self.command_slot.notify() # hand the slot to the next waiter
+					return
+				task, args, deadline = self.slot_waiters.popleft() # handed over as it is
+				deadline.cancel()
+			task(*args)
+
+		# every pending claim fails at once (the client left)
+		def cancel_claims(self):
+			with self.command_slot:
+				self.cancelled += 1
+				self.command_slot.notify_all()
+				for task, args, deadline in self.slot_waiters:
+					deadline.cancel()
+				self.slot_waiters.clear()
+
+		# finish setting up the command connection and start listening to it
+		def attach_commands(self,cmd_socket,cmd_address):
+			# fill in command details
+			self.cmd_sock = cmd_socket
+			self.cmd_address = cmd_address
+			send_pass(cmd_socket) # success msg
+			set_protocol(cmd_socket, *get_protocol(self.sock)) # same frame format as the main connection from here on
+			listen_commands(self) # begin listening for commands...
+
+		# a generator -- it yields the socket it is about to wait on while the user is typing (see process_handshakes),
+		# and returns SUCCESS or FAILURE
 		def authorize(self):
 			# Stage 1)
 			welcome_msg = 'Welcome to the Simple Server!'
 			try:
-				send_msg(self.sock, welcome_msg, screen.ATR_SUCCESS) # welcome new user
+				offer_protocol(self.sock, welcome_msg, screen.ATR_SUCCESS) # welcome new user -- and offer the binary protocol
 				confirmation = receive_data(self.sock) # confirm the user received the welcome msg to advance
-				if check_pass(confirmation) == FAILURE:
-					raise Exception('PASS failed!')
+				confirm_protocol(self.sock, confirmation) # switches to the version picked by the user (v1 clients reply PASS)
 			except Exception as e:
 				screen.add('Authorization Error - Stage 1 <welcome msg>', screen.ATR_ALERT)
 				screen.add(str(e))
 				return FAILURE
 
+			# multiplexed clients do not open a command connection -- both streams become channels of this one
+			if 'mux' in get_protocol(self.sock)[1]:
+				self.mux = Multiplexer(self.sock)
+				self.sock = self.mux.channel(CHANNEL_CHAT)
+				set_protocol(self.sock, *get_protocol(self.mux.sock))
+
+			# pipelined clients send their name and a pairing token for the command connection along with the reply
+			pipelined = 'pipeline' in get_protocol(self.sock)[1]
+			if pipelined:
+				fields = dict(x.split('=',1) for x in str(confirmation,ENCODING).split() if '=' in x)
+				self.pair_token = fields.get('pair')
+
 			# Stage 2)
 			approved = False
 			try:
+				# try the proposed name first -- the list of names is only sent if it is taken
+				if pipelined:
+					if fields.get('user') and self.reserve(fields['user']):
+						send_pass(self.sock) # send approval
+						approved = True
+					else:
+						send_fail(self.sock) # send disapproval -- continue as usual
 				while not approved:
 					#$ hide names of hidden users
 					taken_names = [k if k not in hidden_names else HIDDEN_CHARS * len(k) for k in reserved_names]
 					data = pickle.dumps(taken_names)
 					send_data(self.sock,data) # list of unavailable usernames
 					# receive username
+					yield self.sock # the user is picking a name
 					data = receive_data(self.sock)
 					name = data.decode(ENCODING)
 					# check name
-					name_lock.acquire() # only 1 user may be checked at a time (incase they try the same name)
-					if name not in reserved_names: # valid name
-						reserved_names.append(name)
-						name_lock.release() # next user may be checked since the list was already updated
-						self.username = name # add identity to client
+					if self.reserve(name): # valid name
 						send_pass(self.sock) # send approval
 						approved = True
 					else: # invalid
-						name_lock.release() # list did not change
 						send_fail(self.sock) # send disapproval
 						# wait for user to request another attempt
+						yield self.sock
 						request = receive_data(self.sock)
 						if check_pass(request) == FAILURE:
 							raise Exception('Username was disapproved and request for a new name was not made.')
@@ -758,6 +1868,33 @@ if __name__ == '__main__':
 				screen.add(str(e))
 				return FAILURE
 
+			status = f'Server Status: [{count_active_users()+1}/{MAX_USERS}] active users' # includes this user
+			msg = status + '\nUse / to enter commands, // to create notes, /help for more info.\n'
+
+			# the command channel exists as soon as the name is approved
+			if self.mux:
+				self.attach_commands(self.mux.channel(CHANNEL_COMMAND),self.address)
+
+			# Stage 3 + 4) pipelined -- the status goes out with the approval, the command connection was opened alongside
+			if pipelined:
+				try:
+					send_msg(self.sock,msg,screen.ATR_HIGHLIGHT)
+					if self.mux: # nothing to pair
+						return SUCCESS
+					if bus: # the command connection may have reached another worker
+						bus.send('CLAIM',self.pair_token)
+					with pairing:
+						if not pairing.wait_for(lambda: self.pair_token in pending_pairs, PAIR_TIMEOUT):
+							raise Exception('Command connection did not arrive in time.')
+						cmd_socket, cmd_address = pending_pairs.pop(self.pair_token)
+					self.attach_commands(cmd_socket,cmd_address)
+				except Exception as e:
+					screen.add('Authorization Error - Stage 3 <cmd connection>', screen.ATR_ALERT)
+					screen.add(str(e))
+					return FAILURE
+				# COMPLETE
+				return SUCCESS
+
 			# Stage 3)
 			try:
 				# did the client connect to the command socket
@@ -771,8 +1908,6 @@ if __name__ == '__main__':
 				return FAILURE
 
 			# Stage 4)
-			status = f'Server Status: [{count_active_users()+1}/{MAX_USERS}] active users' # includes this user
-			msg = status + '\nUse / to enter commands, // to create notes, /help for more info.\n'
 			try:
 				send_msg(self.sock,msg,screen.ATR_HIGHLIGHT)
 				confirmation = receive_data(self.sock) # do not contact the client until they have received the last msg successfully
@@ -781,20 +1916,194 @@ if __name__ == '__main__':
 			except Exception as e:
 				screen.add('Authorization Error - Stage 4 <server status>', screen.ATR_ALERT)
 				screen.add(str(e))
-				screen.pause(1)
 				return FAILURE
 			# COMPLETE
 			return SUCCESS
 
 
+	# Frames waiting for one client -- broadcasts only queue them and a writer of the client's own sends them at its pace,
+	# so a user with a full TCP window no longer holds up the others. OUTBOX_POLICY decides what a full outbox does.
+	# (with the event loop engines the loop is the writer -- it moves frames to the connection while it keeps up)
+	# With COALESCE_WINDOW set, chat that arrives within the window goes out in one write (COALESCE_MAX frames at most).
+	class Outbox():
+		def __init__(self,sock):
+			self.sock = sock
+			self.frames = collections.deque() # (SharedFrame, chat)
+			self.pieces = collections.deque() # fragments of a large message that is being sent -- one goes out with each batch
+			self.changed = threading.Condition() # signalled when frames are queued or taken
+			self.looped = isinstance(sock,LoopSocket)
+			self.pumping = False # the loop is moving frames to the connection, or will soon (event loop engines)
+			self.urgent = 0 # frames queued that are not chat -- sent without waiting for the coalescing window
+			self.dropped = 0 # chat frames thrown away since the client last caught up
+			self.finishing = False # close the connection once the queue is empty
+			self.closed = False
+			if not self.looped: # blocking socket -- a thread of its own, waiting for frames
+				threading.Thread(target=self.write,daemon=True).start()
+
+		def put(self,frame,chat=False):
+			with self.changed:
+				if self.closed or self.finishing: # (nothing goes after the last frame)
+					return
+				if len(self.frames) >= OUTBOX_SIZE:
+					# the loop cannot wait for its own writes -- drops instead
+					if OUTBOX_POLICY == 'block' and not (self.looped and self.sock.transport.in_loop()):
+						self.changed.wait_for(lambda: len(self.frames) < OUTBOX_SIZE or self.closed)
+						if self.closed:
+							return
+					elif not self.drop(chat):
+						return
+				self.frames.append((frame,chat))
+				if not chat:
+					self.urgent += 1
+				self.changed.notify_all()
+				if self.looped and (not self.pumping or not chat): # (a waiting batch goes out with a control message at once)
+					self.pumping = True
+					if self.sock.transport.in_loop():
+						self.start_pump()
+					else:
+						self.sock.loop.call_soon_threadsafe(self.start_pump)
+
+		# make room by throwing away the oldest chat frame (the new one if none is queued) -- False if the new one went
+		def drop(self,chat): # (lock held)
+			for i, (frame, droppable) in enumerate(self.frames):
+				if droppable:
+					del self.frames[i]
+					self.count_drop()
+					return not self.closed
+			if chat:
+				self.count_drop()
+				return False
+			return True # only direct frames queued -- this one goes past the limit
+
+		def count_drop(self): # (lock held)
+			self.dropped += 1
+			if OUTBOX_POLICY == 'disconnect' and self.dropped > OUTBOX_DROP_LIMIT:
+				screen.add(f'Disconnected a slow client - {self.dropped} messages behind', screen.ATR_CAUTION)
+				self.close()
+				hang_up(self.sock) # its reader removes the client
+
+		# take the frames for the next write, in order -- one unless coalescing (lock held)
+		# a large message goes out one fragment per write, so the frames queued behind it are not held up by the whole of it
+		def next_batch(self):
+			if self.closed:
+				return []
+			batch = []
+			if self.pieces:
+				batch.append(FramePiece(self.pieces.popleft()))
+			limit = len(batch) + (COALESCE_MAX if COALESCE_WINDOW else 1) # (a fragment does not take the place of a queued frame)
+			writer = get_writer(self.sock)
+			while self.frames and len(batch) < limit:
+				frame, chat = self.frames[0]
+				large = frame.format(writer) is None
+				if large and self.pieces: # one at a time -- the peer reassembles only so many (MAX_STREAMS)
+					break
+				self.frames.popleft()
+				if not chat:
+					self.urgent -= 1
+				if large:
+					try:
+						self.pieces.extend(frame.fragments(writer))
+					except Exception as e:
+						screen.add(f'Send Error -  {e}', screen.ATR_ALERT)
+						continue
+					frame = FramePiece(self.pieces.popleft())
+				batch.append(frame)
+			if not self.frames and not self.pieces:
+				self.dropped = 0 # caught up
+			self.changed.notify_all() # room for a waiting broadcast
+			return batch
+
+		# the writer of a blocking socket -- chat waits up to COALESCE_WINDOW for more to go out in the same write
+		def write(self):
+			while True:
+				with self.changed:
+					self.changed.wait_for(lambda: self.frames or self.pieces or self.closed or self.finishing)
+					if COALESCE_WINDOW and not self.urgent and not self.pieces and not self.finishing:
+						self.changed.wait_for(lambda: self.urgent or len(self.frames) >= COALESCE_MAX or self.closed or self.finishing, COALESCE_WINDOW)
+					batch = self.next_batch()
+				if not batch and self.finishing and not self.closed: # all sent
+					hang_up(self.sock)
+				if not batch or send_frames(self.sock,batch) == FAILURE: # closed, or the connection was lost -- its reader removes the client
+					self.close()
+					return
+
+		# first frames of a batch -- chat waits up to COALESCE_WINDOW for more to go out in the same write (loop thread)
+		def start_pump(self):
+			with self.changed:
+				wait = COALESCE_WINDOW and not self.urgent and not self.pieces and not self.finishing
+			if wait:
+				self.sock.loop.call_later(COALESCE_WINDOW,self.pump)
+			else:
+				self.pump()
+
+		# move frames to the connection until it has ASYNC_HIGH_WATER bytes waiting -- the rest once it drains (loop thread)
+		def pump(self):
+			with self.changed:
+				while self.sock.transport.buffered() <= ASYNC_HIGH_WATER:
+					batch = self.next_batch()
+					if not batch:
+						self.pumping = False
+						if self.finishing and not self.closed: # all handed to the transport, which sends it before closing
+							self.close()
+							self.sock.close()
+						return
+					if send_frames(self.sock,batch) == FAILURE: # connection lost -- its reader removes the client
+						self.pumping = False
+						self.close()
+						return
+			self.sock.transport.when_drained(self.pump)
+
+		# send what is queued, then close the connection
+		def finish(self):
+			with self.changed:
+				if self.closed or self.finishing:
+					return
+				self.finishing = True
+				self.changed.notify_all()
+				if self.looped and not self.pumping:
+					self.pumping = True
+					self.sock.loop.call_soon_threadsafe(self.start_pump)
+
+		def close(self):
+			with self.changed:
+				self.closed = True
+				self.frames.clear()
+				self.pieces.clear()
+				self.urgent = 0
+				self.changed.notify_all()
+
+	# close a connection from another thread -- shutdown wakes up the thread waiting on it
+	def hang_up(sock):
+		try:
+			sock.shutdown(socket.SHUT_RDWR)
+		except (AttributeError, OSError): # (event loop connection or channel)
+			sock.close()
+
 	# private functions:
-	def broadcast(data, attr=screen.ATR_DYNAMIC):
+	def broadcast(data, attr=screen.ATR_DYNAMIC, wire=None, chat=True): # replaced by the selectors engine
 		delivery_lock.acquire() # block other calls until released
+		deliver(data,attr,wire,chat)
+		delivery_lock.release() # next call in line can proceed
+
+	# wire -- the frame as the sender wrote it (FrameReader.wire), users who read the same format get it as it is
+	# chat -- False for server messages, which are never dropped and never wait to be coalesced
+	def deliver(data, attr=screen.ATR_DYNAMIC, wire=None, chat=True):
+		frame = SharedFrame(data,attr) # copied once -- the reader reuses its buffer
+		if wire:
+			frame.forward(*wire)
 		for c in client_list:
 			if not c.active: # this user has not been authorized yet
 				continue
-			send_data(c.sock,data,attr) # prepends header
-		delivery_lock.release() # next call in line can proceed
+			c.send(frame,chat) # the same bytes for everyone with the same frame format
+
+	# send a message to every user -- with several workers it goes through the hub, which hands it to each worker in the same order
+	def publish(data, attr=screen.ATR_DYNAMIC, wire=None, chat=True):
+		if bus:
+			bus.send('PUBLISH',bytes(data),attr,None,chat)
+		elif hub:
+			hub.send_all('DELIVER',bytes(data),attr,None,chat)
+		else:
+			broadcast(data,attr,wire,chat)
 
 	def server_broadcast(msg, attr=screen.ATR_SUCCESS, echo=True): # input is msg (encodes for you)
 		# prepend server name
@@ -804,22 +2113,39 @@ if __name__ == '__main__':
 			screen.display(1)
 		# encode and announce msg to all users
 		x = bytes(msg, ENCODING)
-		broadcast(x, attr)
+		publish(x, attr, chat=False)
 
 	def deliver_news(msg):
 		if msg[:2] == '//': # note
 			screen.add(f'Note: {msg[2:]}', screen.ATR_DIM)
 		elif msg[0] == '/': # command
-			execute_command(msg[1:])
+			screen.add('> ' + msg)
+			args = parse_command(msg[1:])
+			if args and args[0].upper() in BACKGROUND_COMMANDS:
+				start_job(msg[1:])
+			else:
+				execute_command(msg[1:],False)
 		else:
 			# broadcast news
 			server_broadcast(msg)
 
+	# run a console command on a handler thread -- its output appears once it gets there, /jobs lists it until then
+	def start_job(cmd):
+		number = next(job_numbers)
+		with job_lock:
+			console_jobs[number] = (cmd, time.time())
+		def done():
+			with job_lock:
+				del console_jobs[number]
+			screen.display(1)
+		console_pool.submit(execute_command,(cmd,False),done)
+
 	# allows the server to send commands directly to clients -- some have different operations
-	def execute_command(cmd): # display is updated automatically after enter
+	def execute_command(cmd,echo=True): # display is updated automatically after enter
 		# show command
-		screen.add('> /' + cmd)
-		args = get_args(cmd)
+		if echo: # (already shown by the hub when a worker runs it)
+			screen.add('> /' + cmd)
+		args = parse_command(cmd)
 		try:
 			name = args[0].upper() # compare in caps
 		except:
@@ -835,14 +2161,22 @@ if __name__ == '__main__':
 
 		# Clall
 		elif name == 'CLALL':
-			erase_screens() # clear the screen of all users
+			erase_screens() # clear the screen of all users -- shows a report
 			server_broadcast('+++ Screen Clear +++', attr=screen.ATR_APPROVE, echo=False)
-			screen.add('Cleared all client screens!')
 			
 		# List
 		elif name == cmd_list.name:
 			screen.add(list_users(1)) # see hidden
 
+		# Jobs -- console commands still running
+		elif name == 'JOBS':
+			with job_lock:
+				running = sorted(console_jobs.items())
+			if not running:
+				screen.add('No commands in progress.')
+			for number, (job, start) in running:
+				screen.add(f'[{number}] /{job} - {time.time() - start:.1f}s')
+
 		# Reserve name
 		elif name == 'RESERVE':
 			title = args[1].upper()
@@ -850,6 +2184,8 @@ if __name__ == '__main__':
 			if title not in reserved_names:
 				reserved_names.append(title)
 			name_lock.release()
+			if hub:
+				hub.share_roster()
 			screen.add(f'{title} is now reserved.')
 
 		# Release name
@@ -859,6 +2195,8 @@ if __name__ == '__main__':
 			if title in reserved_names:
 				reserved_names.remove(title)
 			name_lock.release()
+			if hub:
+				hub.share_roster()
 			screen.add(f'{title} is now available.')
 
 		# aliases for visibility
@@ -887,6 +2225,9 @@ if __name__ == '__main__':
 			if not target_client:
 				screen.add('That user does not exist!')
 				return 1
+			if hub: # carried out by the worker serving the user
+				hub.send(target_client.worker,'CONSOLE',cmd)
+				return
 
 			# perform command ON target:
 			# Find
@@ -894,7 +2235,7 @@ if __name__ == '__main__':
 				screen.add(target_client.get_location())
 			# Check
 			elif name == cmd_check.name:
-				if target_client.command_lock.locked():
+				if target_client.busy():
 					screen.add(f'{target_client.username} is in a command.')
 				else:
 					screen.add(f'{target_client.username} is free.')
@@ -906,21 +2247,19 @@ if __name__ == '__main__':
 					# Hide
 					if state in ['0','off']:
 						if not target_client.hidden:
-							target_client.hidden = True
-							hidden_names.append(target_client.username)
+							target_client.set_hidden(True)
 							output += 'was made invisible.'
 							msg = 'Your presence has been made private! Users cannot target you.'
-							send_msg(target_client.sock,announce(SERVER_NAME,msg), screen.ATR_HIGHLIGHT)
+							target_client.tell(announce(SERVER_NAME,msg), screen.ATR_HIGHLIGHT)
 						else:
 							output += 'is already hidden.'
 					# Show
 					elif state in ['1', 'on']:
 						if target_client.hidden:
-							target_client.hidden = False
-							hidden_names.remove(target_client.username)
+							target_client.set_hidden(False)
 							output += 'was made visible.'
 							msg = 'Your presence has been made public! Users may target you.'
-							send_msg(target_client.sock,announce(SERVER_NAME,msg), screen.ATR_HIGHLIGHT)
+							target_client.tell(announce(SERVER_NAME,msg), screen.ATR_HIGHLIGHT)
 						else:
 							output += 'is already visible.'
 					# Invalid State
@@ -936,70 +2275,55 @@ if __name__ == '__main__':
 				msg = f'[{SERVER_NAME}]: You are being kicked from the server'
 				# get optional reason
 				if len(args) > 2:
-					reason = cmd[cmd.index(args[2]):] # everything after and including 2rd arg
+					reason = args[2] # everything after and including 2rd arg
 					msg += f': {reason}'
 				else:
 					msg += '.'
 				# remove target
-				kick_thread = threading.Thread(target=kick_client,args=(target_client,msg),daemon=True)
-				kick_thread.start() # waits until user is free, then removes them
+				target_client.kick(msg) # waits until user is free, then removes them
 				
 			# perform command WITH target:
 			else:
 				#$ check if free
 				wait_time = 15 
-				p = screen.typebox.prompt
-				screen.typebox.new_prompt(f'[<15s] Waiting for {target_client.username}... ')
-				screen.display(1)
-				if poll_activity(target_client,timeout=wait_time) == FAILURE:
-					screen.add('That user is busy right now...')
-					screen.typebox.new_prompt(p)
+				if target_client.busy():
+					screen.add(f'[<15s] Waiting for {target_client.username}...', screen.ATR_DIM)
+					screen.display(1)
+				if target_client.claim_slot(wait_time) == FAILURE:
+					screen.add(f'{target_client.username} is busy right now...')
 					return 1
-				screen.typebox.new_prompt(p)
 
-				# Tell
-				if name == cmd_tell.name:
-					try: # check msg exists
-						args[2]
-					except Exception as e:
-						screen.add('Message not entered!')
-						return 1
-					msg = cmd[cmd.index(args[2]):]
-					send_msg(target_client.sock,'From ' + announce(SERVER_NAME,msg), screen.ATR_DIM)
-					screen.add(f'Delivered message to {target_client.username}.')
-				# Admin
-				elif name == cmd_admin.name:
-					send_msg(target_client.cmd_sock,'become_admin')
-					screen.add(f'{target_client.username} was made admin.')
-				# Demote
-				elif name == cmd_demote.name:
-					send_msg(target_client.cmd_sock,'get_demoted')
-					screen.add(f'{target_client.username} was demoted.')
+				try:
+					# Tell
+					if name == cmd_tell.name:
+						try: # check msg exists
+							args[2]
+						except Exception as e:
+							screen.add('Message not entered!')
+							return 1
+						msg = args[2]
+						target_client.tell('From ' + announce(SERVER_NAME,msg), screen.ATR_DIM)
+						screen.add(f'Delivered message to {target_client.username}.')
+					# Admin
+					elif name == cmd_admin.name:
+						send_command(target_client.cmd_sock,[cmd_become_admin.name])
+						screen.add(f'{target_client.username} was made admin.')
+					# Demote
+					elif name == cmd_demote.name:
+						send_command(target_client.cmd_sock,[cmd_get_demoted.name])
+						screen.add(f'{target_client.username} was demoted.')
+				finally:
+					target_client.release_slot()
 
 		# Quit
 		elif name == 'QUIT' or name == 'END':
-			global client_list
-			server_broadcast('Shutting Down Server...')
-			# stop listening to incoming connections
-			SERVER_SOCKET.close()
-			COMMAND_SOCKET.close()
-			# disconnect all clients
-			current_users = client_list.copy() # do not alter list while iterating through clients
-			for c in current_users:
-				try:
-					c.sock.close()
-					c.cmd_sock.close()
-				except Exception as e:
-					screen.add('Quit Error - closing connections.', screen.ATR_ALERT)
-					screen.add(str(e))
-			# wait until all clients were successfully removed
-			x = 0
-			while client_list:
-				x += 1
-				time.sleep(0.5)
-				if x >= 30: # 15 seconds
-					screen.add('Quit Error - not all clients cleared in time.', screen.ATR_ALERT)
-					break
+			if draining: # (a /quit is running as a job already)
+				screen.add('The server is already shutting down.', screen.ATR_CAUTION)
+				return
+			screen.add(announce(SERVER_NAME,'Shutting Down Server...'), screen.ATR_SUCCESS)
+			screen.display(1)
+			if disconnect_all() == FAILURE: # (one started meanwhile)
+				return
 			screen.add('The Server has been terminated.\n', screen.ATR_HIGHLIGHT)
 			screen.locked = False # server is not active, screen still on until closed (can check reports).
 			screen.can_type = False
@@ -1010,18 +2334,42 @@ if __name__ == '__main__':
 			screen.add('Could not execute.')
 			return 1
 
-	# actively check if the client is free to receive commands
-	def poll_activity(new_client,period=0.5,timeout=15):
-		elapsed_time = 0
-		while new_client.command_lock.locked(): # sample
-			# check timeout
-			if elapsed_time >= timeout:
+	# stop listening and drain every client -- returns as soon as they are all removed (DRAIN_TIMEOUT at most):
+	# each user is told the server is closing, their command or file transfer in progress may finish,
+	# then what is queued for them is sent and the connection closed -- FAILURE if a drain was started already (there is only one)
+	def disconnect_all():
+		global draining
+		with admission_lock:
+			if draining:
 				return FAILURE
-			# wait until next sample
-			elapsed_time += period
-			time.sleep(period)
-		else:
-			return SUCCESS
+			draining = True
+		deadline = time.monotonic() + DRAIN_TIMEOUT
+		# stop listening to incoming connections
+		stop_listening()
+		with admission_lock: # logins in progress are cut off
+			logins = list(handshakes)
+		for sock in logins:
+			hang_up(sock)
+		text = announce(SERVER_NAME,'Shutting Down Server...')
+		notice = SharedFrame(bytes(text,ENCODING), screen.ATR_SUCCESS) # shown as it is
+		farewell = SharedFrame(bytes(f'{RECONNECT_HINT} ' + text,ENCODING), screen.ATR_SUCCESS, MSG_BYE) # clients that agreed to 'bye' wait before reconnecting
+		for c in client_list.copy(): # do not alter list while iterating through clients
+			if not c.active:
+				hang_up(c.sock)
+				continue
+			c.send(farewell if 'bye' in get_writer(c.sock).features else notice) # behind what they are already owed
+			c.claim_later(finish_client,(c,),DRAIN_TIMEOUT,cut_off) # once their command is done -- the slot is never given back
+		# wait until all clients were successfully removed (those cut off need a moment to go)
+		with departures:
+			if not departures.wait_for(lambda: not client_list, deadline + 1 - time.monotonic()):
+				screen.add('Quit Error - not all clients cleared in time.', screen.ATR_ALERT)
+		if hub: # the workers do the same for their clients
+			hub.stop()
+		return SUCCESS
+
+	# send the rest of the outbox, then close -- the reader of the connection removes the client (holds the command slot)
+	def finish_client(c):
+		c.outbox.finish()
 
 	# find a client from their name (case sensitive)
 	def find_user(name):
@@ -1035,29 +2383,86 @@ if __name__ == '__main__':
 			# this is the user
 			elif name == target.username:
 				return target
+		# served by another worker
+		entry = members.get(name)
+		if entry and not entry[2]:
+			return RemoteClient(name,*entry)
 		return None # user must not exist
 
+	# every authorized client -- of every worker
+	def roster():
+		if WORKERS > 1:
+			return [RemoteClient(name,*entry) for name, entry in list(members.items())]
+		return [c for c in client_list if c.active]
+
 	# get number of authorized clients
 	def count_active_users():
 		global client_list
+		if WORKERS > 1:
+			return len(members)
 		active_users = 0
 		for new_client in client_list:
 			if new_client.active: # this user
 				active_users += 1
 		return active_users
 				
-	# clear the contents of every client screen (if they are free) -- max process time = 30 x [# of clients]
+	# clear the contents of every client screen (if they are free) -- takes as long as the slowest user, 15 seconds at most
 	def erase_screens():
-		global client_list
-		for c in client_list:
-			if not c.active:
-				continue
-			if poll_activity(c) == SUCCESS:
-				c.command_lock.acquire()
-				send_msg(c.cmd_sock,'cls')
-				c.command_lock.release()
-			else:
-				continue
+		silent = 0 # workers that did not answer in time
+		if hub: # every worker clears its own clients -- their outcomes make one report
+			answers = hub.gather('ERASE',15 + 5) # (the workers' own deadline, and the way back)
+			done, busy, failed = [], [], []
+			for outcome in answers.values():
+				for names, more in zip((done, busy, failed), outcome):
+					names.extend(more)
+			silent = len(hub.links) - len(answers)
+		else:
+			done, busy, failed = command_all([cmd_cls.name],15)
+		report = f'Cleared {len(done)} client screens.'
+		if busy:
+			report += f' Busy (skipped): {", ".join(busy)}.'
+		if failed:
+			report += f' Failed: {", ".join(failed)}.'
+		if silent:
+			report += f' No answer from {silent} worker(s).'
+		screen.add(report)
+		screen.display(1)
+
+	# send a command to every active user at once -- each one waiting on their own slot for up to timeout seconds
+	# returns the names of the users who got it, stayed busy and could not be reached, once all are settled or the time is up
+	# users wait for their command slot without a thread (claim_later), then BROADCAST_WORKERS threads send to them --
+	# whoever is not done once the report is made is left out: their command is not sent anymore
+	def command_all(args,timeout):
+		done, busy, failed = [], [], []
+		pending = set() # clients not done yet
+		settled = threading.Condition() # signalled when a client is done
+		over = threading.Event() # set once the report is made
+		def finish(c,result):
+			with settled:
+				if c in pending:
+					pending.discard(c)
+					result.append(c.username)
+					settled.notify_all()
+		def send(c): # (slot held)
+			try:
+				if over.is_set(): # too late
+					return
+				send_command(c.cmd_sock,args)
+				finish(c,done)
+			except Exception as e: # connection lost
+				finish(c,failed)
+			finally:
+				c.release_slot()
+		for c in client_list.copy():
+			if c.active:
+				pending.add(c)
+				c.claim_later(lambda c: command_pool.submit(send,(c,),lambda: None),(c,),timeout,lambda c: finish(c,busy))
+		with settled:
+			settled.wait_for(lambda: not pending, timeout + 1) # (sending takes a moment too)
+			over.set()
+			failed.extend(c.username for c in pending) # still waiting for a thread, or stuck sending
+			pending.clear()
+			return done, busy, failed
 
 	# create a string of the server status and a list of active users
 	def list_users(show_hidden=False):
@@ -1067,11 +2472,18 @@ if __name__ == '__main__':
 
 		# get the name of each client
 		name_string = ''
-		for c in client_list:
-			if not c.active: # this user has not been authorized yet
-				continue
-			else:
-				active_users += 1
+		users = roster()
+		silent = 0 # workers whose flood counters did not come back in time
+		if show_hidden and hub: # the counters are kept by the workers of the users
+			answers = hub.gather('FLOODED',2)
+			counts = {}
+			for answer in answers.values():
+				counts.update(answer)
+			for c in users:
+				c.flooded = counts.get(c.username,0)
+			silent = len(hub.links) - len(answers)
+		for c in users:
+			active_users += 1
 			# hidden user
 			if c.hidden:
 				total_hidden += 1
@@ -1082,14 +2494,18 @@ if __name__ == '__main__':
 			# visible
 			else:
 				name_string += f'{c.username}'
+			if show_hidden and c.flooded: # chat that went over the flood limits
+				name_string += f' [{c.flooded} over limit]'
 			# separator
-			if not c == client_list[-1]:
+			if not c == users[-1]:
 				name_string += ', '
 
 		# Build output:
 		output = f'There are currently [{active_users}/{MAX_USERS}] users online'
 		# check if the server is empty
 		if active_users <= 0:
+			if show_hidden:
+				return output + '.\n' + flood_limits()
 			return output + '.'
 		# add names of clients
 		output += ':\n' + name_string
@@ -1102,8 +2518,31 @@ if __name__ == '__main__':
 				output += f'\n() - hidden users = {total_hidden}'
 			else:
 				output += f'\n({total_hidden}) {p} hidden.'
+		if show_hidden:
+			output += '\n' + flood_limits()
+		if silent:
+			output += f'\n(over limit counts missing from {silent} worker(s))'
 		return output
 
+	# the flood limits on every user's chat, for the server's /list
+	def flood_limits():
+		limits = []
+		if FLOOD_MESSAGES:
+			limits.append(f'{FLOOD_MESSAGES} messages')
+		if FLOOD_BYTES:
+			limits.append(f'{FLOOD_BYTES / 1024:g} KB')
+		if not limits:
+			return 'Flood limit: none'
+		return f'Flood limit: {" and ".join(limits)} per second per user, bursts of {FLOOD_BURST}s - {FLOOD_ACTION}'
+
+	# delete what arrived of a file that was cut off
+	def discard_download(path):
+		try:
+			os.remove(path)
+		except Exception as e:
+			screen.add(f'Could not remove: \'{path}\'', screen.ATR_CRITICAL)
+			screen.add(str(e))
+
 	# delete temp files from download folder
 	def clear_downloads():
 		for new_file in os.listdir(DOWNLOAD_FOLDER):
@@ -1115,57 +2554,225 @@ if __name__ == '__main__':
 				screen.add(str(e))
 				continue
 
-	def accept_connections():
+	# unix domain sockets have no peer address -- name the socket file instead, so (host, port) formatting still works
+	def peer_address(listener,address):
+		if listener.family == socket.AF_INET:
+			return address
+		return ('local', listener.getsockname())
+
+	def accept_connections(listener):
 		while True:
 			try:
-				client_socket, address = SERVER_SOCKET.accept() # blocking call
+				client_socket, address = listener.accept() # blocking call
+				address = peer_address(listener,address)
 			except: # server socket closed
 				break
+			tune_socket(client_socket,PROFILE,CHANNEL_CHAT)
 			screen.add(f'received connection from {address}', screen.ATR_HIGHLIGHT) # acknowledge connection
 			screen.display()
-			new_thread = threading.Thread(target=handle_client,args=(client_socket,address,),daemon=True)
-			new_thread.start() # take care of new connection as a separate process...
+			reason = check_admission(client_socket)
+			if reason:
+				reject_connection(client_socket,reason)
+				continue
+			handshake_queue.put(admit_client(client_socket,address))
+
+	# turn new connections away once the server is full or too many are still logging in -- returns why (None = admitted)
+	def check_admission(sock):
+		with admission_lock:
+			if count_active_users() + len(handshakes) >= MAX_USERS:
+				return f'The server is full [{MAX_USERS}/{MAX_USERS}], try again later.'
+			if len(handshakes) - parked_logins >= HANDSHAKE_WORKERS + HANDSHAKE_QUEUE: # (parked logins hold no thread)
+				return 'The server is busy, try again in a moment.'
+			handshakes[sock] = timers.schedule(AUTH_TIMEOUT,hang_up,sock)
+		return None
+
+	def end_handshake(sock):
+		with admission_lock:
+			deadline = handshakes.pop(sock,None)
+		if deadline:
+			deadline.cancel()
+
+	def reject_connection(sock,reason):
+		screen.add(f'Turned away - {reason}', screen.ATR_CAUTION)
+		try:
+			send_rejection(sock,reason)
+		finally:
+			sock.close()
+
+	# log new connections in, one at a time -- each admitted client gets a thread of its own
+	# a login whose user has to type something is parked until the answer arrives, so the thread can go on with the next one
+	def process_handshakes():
+		while True:
+			login = handshake_queue.get()
+			try:
+				waiting = next(login)
+				while not idle_socket(waiting): # (the answer is already here)
+					waiting = next(login)
+			except StopIteration as done:
+				new_client = done.value
+				if new_client:
+					new_thread = threading.Thread(target=serve_client,args=(new_client,),daemon=True)
+					new_thread.start()
+				continue
+			park_login(idle_socket(waiting),login)
+
+	# the socket to watch for the next message of a connection -- None if part of it was received already
+	def idle_socket(sock):
+		reader = get_reader(sock)
+		if reader.end > reader.start:
+			return None
+		if isinstance(sock,Channel): # the channel's inbox, then the connection it shares
+			if sock.mux.inboxes[sock.number]:
+				return None
+			return idle_socket(sock.mux.sock)
+		return sock
+
+	# hand a login to the waiting room until its connection has something to read -- its user gets NAME_TIMEOUT
+	def park_login(sock,login):
+		global parked_logins
+		with admission_lock:
+			parked_logins += 1
+			restart_deadline(sock,NAME_TIMEOUT)
+		def watch():
+			try:
+				waiting_room.selector.register(sock,selectors.EVENT_READ,lambda events: resume_login(sock,login))
+			except (ValueError, OSError): # already closed -- the login finds out
+				resume_login(sock,login)
+		waiting_room.call_soon_threadsafe(watch)
+
+	# the user answered (or the connection closed) -- back to a handshake thread (waiting room thread)
+	def resume_login(sock,login):
+		global parked_logins
+		try:
+			waiting_room.selector.unregister(sock)
+		except (KeyError, ValueError): # (never registered)
+			pass
+		with admission_lock:
+			parked_logins -= 1
+			restart_deadline(sock,AUTH_TIMEOUT)
+		handshake_queue.put(login)
+
+	# the login of this connection is cut off after timeout seconds from now (admission lock held)
+	def restart_deadline(sock,timeout):
+		deadline = handshakes.get(sock)
+		if deadline:
+			deadline.cancel()
+			handshakes[sock] = timers.schedule(timeout,hang_up,sock)
+
+	# run a login to the end on this thread -- the event loop engines give it a pool thread for as long as it takes
+	def finish_login(login):
+		try:
+			while True:
+				next(login)
+		except StopIteration as done:
+			return done.value
 
-	def configure_commands():
+	def configure_commands(listener):
 		global client_list
 		while True:
 			try:
-				cmd_socket, cmd_address = COMMAND_SOCKET.accept() # blocking call
+				cmd_socket, cmd_address = listener.accept() # blocking call
+				cmd_address = peer_address(listener,cmd_address)
 			except: # server socket closed
 				break
+			tune_socket(cmd_socket,PROFILE,CHANNEL_COMMAND)
+			attach_connection(cmd_socket,cmd_address)
+
+	# close a parked command connection nobody claimed in time
+	def unpark(token,cmd_socket):
+		with pairing:
+			parked = pending_pairs.get(token)
+			if not parked or parked[0] is not cmd_socket: # claimed
+				return
+			del pending_pairs[token]
+		cmd_socket.close()
+
+	# match a new command connection with its client (by name, or by token for pipelined clients)
+	def attach_connection(cmd_socket,cmd_address,name=None): # name -- already received by the worker that handed it over
+		handed_over = name is not None
+		if not handed_over:
 			screen.add(f'incoming CPort connection from {cmd_address}', screen.ATR_HIGHLIGHT) #!
 			screen.display(1)
 			try:
 				# receive name of client connecting
 				data = receive_data(cmd_socket)
+				if data == FAILURE: # closed before naming its client (a multiplexed client that did not need it)
+					cmd_socket.close()
+					return
 				name = data.decode(ENCODING)
-			except socket.error as e:
+			except Exception as e:
 				screen.add(f'Unexpected cmd connection - {cmd_address[0]}:{cmd_address[1]}', screen.ATR_ALERT)
 				screen.add(str(e))
 				screen.display(1)
-				continue # disregard this connection
-
-			# find client trying to connect
-			found_client = False
-			for c in client_list:
-				if c.username == name: # this is the user
-					found_client = True
-					break # done checking -- c remains the target client
-			if found_client:
-				# fill in command details
-				c.cmd_sock = cmd_socket
-				c.cmd_address = cmd_address
-				send_pass(cmd_socket) # success msg
-				new_thread = threading.Thread(target=handle_commands,args=(c,),daemon=True)
-				new_thread.start() # begin listening for commands...
-			else: # user not found
+				return # disregard this connection
+
+		# pipelined client -- opened before its name was approved, park it until authorize claims it by token
+		if name.startswith('PAIR '):
+			if bus and not handed_over: # the hub passes it to the worker that claims the token
+				bus.hand_over(cmd_socket,cmd_address,name)
+				return
+			token = name[5:]
+			with pairing:
+				parked = len(pending_pairs) < PAIR_LIMIT and token not in pending_pairs
+				if parked:
+					pending_pairs[token] = (cmd_socket, cmd_address)
+					timers.schedule(PAIR_TIMEOUT,unpark,token,cmd_socket)
+					pairing.notify_all()
+			if not parked: # too many waiting (or the token is taken)
 				send_fail(cmd_socket)
-				if DEBUG:
-					screen.add(f'Could not find a matching socket for the user - \'{name}\'', screen.ATR_CRITICAL)
-					screen.add(str(e))
-					screen.display(1)
+				cmd_socket.close()
+			return
+
+		# find client trying to connect
+		found_client = False
+		for c in client_list:
+			if c.username == name: # this is the user
+				found_client = True
+				break # done checking -- c remains the target client
+		if found_client:
+			c.attach_commands(cmd_socket,cmd_address)
+		elif bus and not handed_over: # connected to the wrong worker -- the hub knows where the user is
+			bus.hand_over(cmd_socket,cmd_address,name)
+		else: # user not found
+			send_fail(cmd_socket)
+			if DEBUG:
+				screen.add(f'Could not find a matching socket for the user - \'{name}\'', screen.ATR_CRITICAL)
+				screen.display(1)
 
-	def handle_client(sock,addr):
+	# pass on a chat message as it arrived -- the frame it came in is forwarded to users who read the same format
+	def publish_frame(sock,data,attr):
+		publish(data,attr,get_reader(sock).wire)
+
+	# a chat frame from a client -- broadcast unless it is over the flood limits (then FLOOD_ACTION decides)
+	def receive_chat(c,data,attr):
+		if get_reader(c.sock).kind != MSG_DATA: # only the server sends anything else on the chat connection (MSG_BYE)
+			return
+		wait = c.meter(len(data))
+		if not wait:
+			publish_frame(c.sock,data,attr)
+		elif FLOOD_ACTION == 'delay': # it goes out, but nothing more is read until the client is back within the limits --
+			publish_frame(c.sock,data,attr) # its bytes pile up in the socket buffers and TCP slows the client down
+			if ENGINE == 'threads':
+				time.sleep(wait)
+			else:
+				c.sock.hold(wait)
+		elif FLOOD_ACTION == 'warn': # dropped, and the user is told why
+			if time.monotonic() - c.warned >= FLOOD_WARN_INTERVAL:
+				c.warned = time.monotonic()
+				c.tell(announce(SERVER_NAME,'You are sending messages too fast, some were not delivered. Slow down!'), screen.ATR_CAUTION)
+		elif FLOOD_ACTION == 'kick' and c.flooded == 1: # the first time -- whatever else they send meanwhile is dropped
+			screen.add(f'{c.username} was kicked for flooding the chat.', screen.ATR_CAUTION)
+			c.kick(f'[{SERVER_NAME}]: You are being kicked from the server: flooding the chat')
+		# 'drop' -- nothing to do
+
+	def serve_client(new_client):
+		receive_data(new_client.sock,lambda data, attr: receive_chat(new_client,data,attr),True) # start listening to calls from this client... (a channel if multiplexed)
+		# disconnected
+		remove_client(new_client)
+
+	# authorize a new connection and announce it -- returns the client, or None if it was turned away
+	# a generator like authorize (run it with process_handshakes or finish_login)
+	def admit_client(sock,addr):
 		global client_list
 		connected_msg = ' has joined the server!'
 
@@ -1174,20 +2781,26 @@ if __name__ == '__main__':
 		client_list.append(new_client) # add to list
 
 		# authorize the client
-		if new_client.authorize() == FAILURE:
+		if (yield from new_client.authorize()) == FAILURE:
 			if DEBUG:
 				screen.add(f'Authorization Failed - {new_client.address}', screen.ATR_ALERT) #!
 			remove_client(new_client) # delete client
-			return # kill thread
+			end_handshake(sock)
+			return None
 
 		# officially recognize client
+		new_client.outbox = Outbox(new_client.sock)
 		new_client.active = True # other users can now interact with this client
+		if bus: # users of other workers too
+			bus.send('JOIN',new_client.username,new_client.address,new_client.hidden)
 		server_broadcast(new_client.username + connected_msg, screen.ATR_SUCCESS) # announce connection, new_client is ready to receive continuously
-		
-		receive_data(sock,broadcast,True) # start listening to calls from this client...
+		end_handshake(sock)
+		return new_client
 
-		# disconnected
-		remove_client(new_client)
+	# start listening for the commands of an attached client -- replaced by the asyncio engine
+	def listen_commands(new_client):
+		new_thread = threading.Thread(target=handle_commands,args=(new_client,),daemon=True)
+		new_thread.start()
 
 	def handle_commands(new_client):
 		while True:
@@ -1195,294 +2808,368 @@ if __name__ == '__main__':
 			if DEBUG:
 				screen.display(1) #$ jump to recent
 
-			if new_client.command_lock.locked(): # not in command, release lock
-				new_client.command_lock.release()
-			data = receive_data(new_client.cmd_sock) # receive a new command...
-			if data == FAILURE: # disconnected
+			args = receive_command(new_client.cmd_sock) # receive a new command (text or opcode)...
+			if args == FAILURE: # disconnected
 				return
-			new_client.command_lock.acquire() # prevent other commands from contacting this client until finished -- avoids multiple receives (from client)
-			cmd = data.decode(ENCODING)
-			args = get_args(cmd) # parse command -- assume valid syntax here, should contain all required args
-			name = args[0].upper() # every command will have at least a name parameter -- command names are stored in caps
-
-			# initiate cmd process with client -- these commands were delivered by the user
-			if name not in PASSIVE_COMMANDS:
-				send_data(new_client.cmd_sock,data) # echo command to client cmd handler
-				launch = receive_data(new_client.cmd_sock) # wait for client to set up cmd process...
-				try:
-					if check_pass(launch) == FAILURE: # cmd refused
-						continue
-				except Exception:
-					continue
-			else: # process already initiated on client-side -- these commands were sent directly to the user from an alternate process
-				pass
+			run_command(new_client,args)
 
-			# Evaluate Commands (uppercase names):
-			if DEBUG: #! show request
-				screen.add(f'Command from {new_client.username} - /{cmd}')
-				screen.display(1)
+	# carry out one command received from a client
+	def run_command(new_client,args):
+		# prevent other commands from contacting this client until finished -- avoids multiple receives (from client)
+		if new_client.claim_slot() == FAILURE: # client left while waiting
+			return
+		try:
+			process_command(new_client,args)
+		finally:
+			new_client.release_slot()
+
+	def process_command(new_client,args):
+		# assume valid syntax here, should contain all required args
+		name = args[0].upper() # every command will have at least a name parameter -- command names are stored in caps
+
+		# initiate cmd process with client -- these commands were delivered by the user
+		if name not in PASSIVE_COMMANDS:
+			send_command(new_client.cmd_sock,args) # echo command to client cmd handler
+			launch = receive_data(new_client.cmd_sock) # wait for client to set up cmd process...
+			try:
+				if check_pass(launch) == FAILURE: # cmd refused
+					return
+			except Exception:
+				return
+		else: # process already initiated on client-side -- these commands were sent directly to the user from an alternate process
+			pass
 
-			# List Users
-			if name == cmd_list.name:
-				output = list_users()
-				# send list to caller
-				send_msg(new_client.cmd_sock, output)
-				# list cmd finished
-
-			# 1 arg - username
-			# Find / Tell / Check / Admin / Demote / Kick
-			elif name in [cmd_find.name, cmd_tell.name, cmd_check.name, cmd_admin.name, cmd_demote.name, cmd_kick.name]:
-				# check username exists and is valid
-				username = args[1].upper() # check uppercases
-				target_client = find_user(username) # may retrieve self
-				# user DNE
-				if not target_client:
-					send_msg(new_client.cmd_sock,'That user does not exist!')
-					continue
+		# Evaluate Commands (uppercase names):
+		if DEBUG: #! show request
+			screen.add(f'Command from {new_client.username} - /{" ".join(args)}')
+			screen.display(1)
 
-				output = '?' # answer returned to caller -- update based on command
-
-				# Find Address
-				if name == cmd_find.name:
-					output = target_client.get_location()
-
-				# Tell
-				elif name == cmd_tell.name:
-					# case: target is the caller
-					if target_client.username == new_client.username:
-						output = 'Stop talking to yourself!'
-					else: # send message directly to target
-						msg = cmd[cmd.index(args[2]):]
-						msg = 'From ' + announce(new_client.username,msg) # format
-						send_msg(target_client.sock, msg, screen.ATR_DIM) # send to main socket
-						output = f'Delivered to {target_client.username}.'
-
-				# Check
-				elif name == cmd_check.name:
-					# case: target is the caller
-					if target_client.username == new_client.username:
-						output = 'You are currently occupied with yourself.'
-					else: # test target availability
-						if target_client.command_lock.locked():
-							output = f'{target_client.username} is currently processing a command.'
-						else:
-							output = f'{target_client.username} is available.'
-
-				# Admin
-				elif name == cmd_admin.name:
-					# case: target is the caller
-					if target_client.username == new_client.username:
-						output = 'You are already an admin!' # must be an admin to use this command
-					else: # elevate target user:
-						if poll_activity(target_client,timeout=5) == SUCCESS: #$ free
-							send_msg(target_client.cmd_sock,'become_admin') # send command to target user
-							output = f'{target_client.username} was successfully made admin.'
-						else: # client is busy
-							output = f'That user is busy right now...'
-
-				# Demote
-				elif name == cmd_demote.name:
-					# case: target is the caller
-					if target_client.username == new_client.username:
-						# must be an admin to use this command (this is how the server knows they have rights)
-						send_msg(new_client.cmd_sock,'You threw away your rights...')
-						send_msg(new_client.cmd_sock,'get_demoted') # send command to self
-						continue
-					else: # denounce target user:
-						if poll_activity(target_client,timeout=5) == SUCCESS: # free
-							send_msg(target_client.cmd_sock,'get_demoted') # send command to target user
-							output = f'{target_client.username} was successfully demoted.'
-						else: # client is busy
-							output = f'That user is busy right now...'
-
-				# Kick
-				elif name == cmd_kick.name:
-					# case: target is the caller
-					if target_client.username == new_client.username:
-						send_msg(target_client.cmd_sock,'You cannot kick yourself!')
-						continue
-					# get optional msg
-					if len(args) > 2:
-						reason = cmd[cmd.index(args[2]):] # everything after and including 2rd arg
-					else:
-						reason = ''
-					# send special kick message to the target
-					try:
-						msg = f'[{SERVER_NAME}]: You are being kicked from the server'
-						if reason:
-							msg += f': {reason}' # add reason for kick
-						else:
-							msg += '.'
-					except Exception as e: # user may have already left
-						continue
-					# remove target
-					kick_thread = threading.Thread(target=kick_client,args=(target_client,msg),daemon=True)
-					kick_thread.start() # waits until user is free, then removes them
-					output = f'You have requested to kick {target_client.username} from the server.'
+		# List Users
+		if name == cmd_list.name:
+			output = list_users()
+			# send list to caller
+			send_msg(new_client.cmd_sock, output)
+			# list cmd finished
 
-				# ALL -- executes for every cmd in this section
-				send_msg(new_client.cmd_sock,output) # send output
-				# cmd finished
+		# 1 arg - username
+		# Find / Tell / Check / Admin / Demote / Kick
+		elif name in [cmd_find.name, cmd_tell.name, cmd_check.name, cmd_admin.name, cmd_demote.name, cmd_kick.name]:
+			# check username exists and is valid
+			username = args[1].upper() # check uppercases
+			target_client = find_user(username) # may retrieve self
+			# user DNE
+			if not target_client:
+				send_msg(new_client.cmd_sock,'That user does not exist!')
+				return
 
-			# Visibility
-			elif name == cmd_visible.name:
-				output = '?' # placeholder
-				attr = None # attribute of output
-				try:
-					visibility = int(args[1]) # should be value
-				except Exception as e:
-					if DEBUG:
-						screen.add('Visibility Error - received invalid visibility state.', screen.ATR_ALERT)
-						screen.add(str(e))
-					continue
-				# hide / reveal client
-				if visibility:
-					if not new_client.hidden: # case, already visible
-						output = 'We can already see you!'
-					else: # reveal client
-						new_client.hidden = False
-						hidden_names.remove(new_client.username)
-						output = 'You revealed yourself back to the server.'
-				else:
-					if new_client.hidden: # case, already hidden
-						#output = 'You cannot descend any deeper into the shroud of darkness that plagues the world above you...' #$
-						verse = the_raven.get_verse() # random stanza from The Raven by Edgar Allen Poe
-						output = '\n'
-						for line in verse.splitlines():
-							output += '\t' + line + '\n'
-						attr = screen.ATR_DIM
-					else: # hide client
-						new_client.hidden = True
-						hidden_names.append(new_client.username)
-						output = 'You were made hidden from the server.'
-				# send output
-				if attr:
-					send_msg(new_client.cmd_sock,output,attr)
+			output = '?' # answer returned to caller -- update based on command
+
+			# Find Address
+			if name == cmd_find.name:
+				output = target_client.get_location()
+
+			# Tell
+			elif name == cmd_tell.name:
+				# case: target is the caller
+				if target_client.username == new_client.username:
+					output = 'Stop talking to yourself!'
+				else: # send message directly to target
+					msg = 'From ' + announce(new_client.username,args[2]) # format
+					target_client.tell(msg, screen.ATR_DIM) # send to main socket
+					output = f'Delivered to {target_client.username}.'
+
+			# Check
+			elif name == cmd_check.name:
+				# case: target is the caller
+				if target_client.username == new_client.username:
+					output = 'You are currently occupied with yourself.'
+				else: # test target availability
+					if target_client.busy():
+						output = f'{target_client.username} is currently processing a command.'
+					else:
+						output = f'{target_client.username} is available.'
+
+			# Admin
+			elif name == cmd_admin.name:
+				# case: target is the caller
+				if target_client.username == new_client.username:
+					output = 'You are already an admin!' # must be an admin to use this command
+				else: # elevate target user:
+					if target_client.command([cmd_become_admin.name],5) == SUCCESS: #$ free -- send command to target user
+						output = f'{target_client.username} was successfully made admin.'
+					else: # client is busy
+						output = f'That user is busy right now...'
+
+			# Demote
+			elif name == cmd_demote.name:
+				# case: target is the caller
+				if target_client.username == new_client.username:
+					# must be an admin to use this command (this is how the server knows they have rights)
+					send_msg(new_client.cmd_sock,'You threw away your rights...')
+					send_command(new_client.cmd_sock,[cmd_get_demoted.name]) # send command to self
+					return
+				else: # denounce target user:
+					if target_client.command([cmd_get_demoted.name],5) == SUCCESS: # free -- send command to target user
+						output = f'{target_client.username} was successfully demoted.'
+					else: # client is busy
+						output = f'That user is busy right now...'
+
+			# Kick
+			elif name == cmd_kick.name:
+				# case: target is the caller
+				if target_client.username == new_client.username:
+					send_msg(target_client.cmd_sock,'You cannot kick yourself!')
+					return
+				# get optional msg
+				if len(args) > 2:
+					reason = args[2] # everything after and including 2rd arg
 				else:
-					send_msg(new_client.cmd_sock,output)
-
-			# Become Admin
-			elif name == cmd_become_admin.name:
-				continue # occurs on client-side
-
-			# Get Demoted
-			elif name == cmd_get_demoted.name:
-				continue # occurs on client_side
-
-			# Get Kicked
-			elif name == cmd_get_kicked.name:
-				continue # occurs on client_side
-
-			# Send File
-			elif name == cmd_send.name:
-				# check username
-				username = args[1].upper() # check uppercases
-				valid_user = False
-				target_client = find_user(username) # get client
-				if target_client:
-					if target_client.username != new_client.username: # target cannot be the caller
-						valid_user = True
-
-				# confirm existence
-				if valid_user: # user exists
-					send_pass(new_client.cmd_sock)
-				else: # invalid user
-					send_fail(new_client.cmd_sock)
-					continue
+					reason = ''
+				# send special kick message to the target
+				try:
+					msg = f'[{SERVER_NAME}]: You are being kicked from the server'
+					if reason:
+						msg += f': {reason}' # add reason for kick
+					else:
+						msg += '.'
+				except Exception as e: # user may have already left
+					return
+				# remove target
+				target_client.kick(msg) # waits until user is free, then removes them
+				output = f'You have requested to kick {target_client.username} from the server.'
 
-				# wait for client to send desired file name (may have been updated)
-				filename = receive_data(new_client.cmd_sock).decode(ENCODING) # get file name with extension -- example.txt
-				if not filename: # blank if zip error
-					continue
+			# ALL -- executes for every cmd in this section
+			send_msg(new_client.cmd_sock,output) # send output
+			# cmd finished
+
+		# Visibility
+		elif name == cmd_visible.name:
+			output = '?' # placeholder
+			attr = None # attribute of output
+			try:
+				visibility = int(args[1]) # should be value
+			except Exception as e:
+				if DEBUG:
+					screen.add('Visibility Error - received invalid visibility state.', screen.ATR_ALERT)
+					screen.add(str(e))
+				return
+			# hide / reveal client
+			if visibility:
+				if not new_client.hidden: # case, already visible
+					output = 'We can already see you!'
+				else: # reveal client
+					new_client.set_hidden(False)
+					output = 'You revealed yourself back to the server.'
+			else:
+				if new_client.hidden: # case, already hidden
+					#output = 'You cannot descend any deeper into the shroud of darkness that plagues the world above you...' #$
+					verse = the_raven.get_verse() # random stanza from The Raven by Edgar Allen Poe
+					output = '\n'
+					for line in verse.splitlines():
+						output += '\t' + line + '\n'
+					attr = screen.ATR_DIM
+				else: # hide client
+					new_client.set_hidden(True)
+					output = 'You were made hidden from the server.'
+			# send output
+			if attr:
+				send_msg(new_client.cmd_sock,output,attr)
+			else:
+				send_msg(new_client.cmd_sock,output)
+
+		# Become Admin
+		elif name == cmd_become_admin.name:
+			return # occurs on client-side
+
+		# Get Demoted
+		elif name == cmd_get_demoted.name:
+			return # occurs on client_side
+
+		# Get Kicked
+		elif name == cmd_get_kicked.name:
+			return # occurs on client_side
+
+		# Send File
+		elif name == cmd_send.name:
+			# check username
+			username = args[1].upper() # check uppercases
+			valid_user = False
+			target_client = find_user(username) # get client
+			if target_client:
+				if target_client.username != new_client.username: # target cannot be the caller
+					valid_user = True
+
+			# confirm existence
+			if valid_user: # user exists
+				send_pass(new_client.cmd_sock)
+			else: # invalid user
+				send_fail(new_client.cmd_sock)
+				return
+
+			# wait for client to send desired file name (may have been updated)
+			filename = receive_data(new_client.cmd_sock).decode(ENCODING) # get file name with extension -- example.txt
+			if not filename: # blank if zip error
+				return
+
+			# prepare download path
+			server_filename = create_file(filename, DOWNLOAD_FOLDER) # create new file, name may be updated
+			
+			# confirm file path was accessed
+			if server_filename:
+				send_pass(new_client.cmd_sock)
+			else: # failed to create temp file
+				send_fail(new_client.cmd_sock)
+				return
+			download_path = os.path.join(DOWNLOAD_FOLDER, server_filename) # location of server-side download
+			# (name may differ from filename if that filename already exists within the download folder)
+
+			# receive full file -- static download folder
+			result = download_file(new_client.cmd_sock,download_path,False) # wait...
+			# tell sender if the download succeeded
+			if result == SUCCESS:
+				send_pass(new_client.cmd_sock)
+			else: # failed to download properly
+				if DEBUG:
+					screen.add(f'Could not download: \'{filename}\'', screen.ATR_CRITICAL) #!
+				discard_download(download_path)
+				send_fail(new_client.cmd_sock)
+				return
 
-				# prepare download path
+			# wait until the client received confirmation -- file downloaded
+			receive_data(new_client.cmd_sock)
+
+			# offer file to target user
+			offer_file(new_client, target_client, filename, download_path)
+			# send cmd is finished.
+
+		# Upload File -- single-request send: the file follows the command, one status goes back
+		elif name == cmd_upload.name:
+			filename = args[2]
+			error = '' # reason the upload cannot be kept
+			# check username
+			target_client = find_user(args[1].upper())
+			if not target_client or target_client.username == new_client.username: # target cannot be the caller
+				error = f'Could not find target user: \'{args[1]}\''
+			# check space for the file
+			elif not args[3].isdigit() or shutil.disk_usage(DOWNLOAD_FOLDER).free < int(args[3]):
+				error = 'Server does not have enough space for that file.'
+			# prepare download path
+			else:
 				server_filename = create_file(filename, DOWNLOAD_FOLDER) # create new file, name may be updated
-				
-				# confirm file path was accessed
-				if server_filename:
-					send_pass(new_client.cmd_sock)
-				else: # failed to create temp file
-					send_fail(new_client.cmd_sock)
-					continue
-				download_path = os.path.join(DOWNLOAD_FOLDER, server_filename) # location of server-side download
-				# (name may differ from filename if that filename already exists within the download folder)
-
-				# receive full file -- static download folder
-				result = download_file(new_client.cmd_sock,download_path,False) # wait...
-				# tell sender if the download succeeded
-				if result == SUCCESS:
-					send_pass(new_client.cmd_sock)
-				else: # failed to download properly
-					if DEBUG:
-						screen.add(f'Could not download: \'{filename}\'', screen.ATR_CRITICAL) #!
-					send_fail(new_client.cmd_sock)
-					continue
+				if not server_filename: # failed to create temp file
+					error = 'Server not able to access download path.'
+			# the file is already on its way -- it has to be read even when it cannot be kept
+			if error:
+				download_file(new_client.cmd_sock,os.devnull,False)
+				send_command(new_client.cmd_sock, [cmd_upload.name, args[1], filename, 'FAIL', error])
+				return
+			download_path = os.path.join(DOWNLOAD_FOLDER, server_filename) # location of server-side download
 
-				# wait until the client received confirmation -- file downloaded
-				receive_data(new_client.cmd_sock)
-
-				# offer file to target user:
-				waiting = True
-				wait_time = 15 #$
-				while waiting:
-					# check if target is available for a command
-					if poll_activity(target_client, timeout=wait_time) == FAILURE: # client is busy
-						if DEBUG:
-							screen.add(f'{target_client.username} is busy and cannot receive file.', screen.ATR_CRITICAL) #!
-						# tell sender the target was busy
-						send_fail(new_client.cmd_sock)
-						# ask sender to continue waiting or stop
-						reply = receive_data(new_client.cmd_sock)
-						try:
-							if check_pass(reply) == SUCCESS:
-								waiting = True # keep waiting
-								wait_time = 30 # increase wait time
-							else: # terminate command
-								break
-						except Exception as e: # reply error
-							if DEBUG:
-								screen.add(str(e),screen.ATR_ALERT)
-							break # terminate command
-					else:
-						waiting = False
-						try: # send command to target user (use quotes in case of spaces)
-							send_msg(target_client.cmd_sock, f'receive {new_client.username} "{filename}" "{download_path}"')
-						except Exception as e:
-							if DEBUG:
-								screen.add('Send File Error - target user has left!', screen.ATR_CRITICAL)
-								screen.add(str(e))
-						# tell sender the request was sent (with or without error)
-						send_pass(new_client.cmd_sock)
-				# send cmd is finished.
-
-			# Receive File
-			elif name == cmd_receive.name:
-				filename = args[2].strip('"') # name of sent file (may have quotes to preserve spaces)
-				path = args[3].strip('"') # path to target download
-				# check if user accepts and is able to receive file...
-				data = receive_data(new_client.cmd_sock)
+			# receive full file -- static download folder
+			if download_file(new_client.cmd_sock,download_path,False) == FAILURE:
+				if DEBUG:
+					screen.add(f'Could not download: \'{filename}\'', screen.ATR_CRITICAL) #!
+				discard_download(download_path)
+				send_command(new_client.cmd_sock, [cmd_upload.name, args[1], filename, 'FAIL', 'Upload failed!'])
+				return
+			send_command(new_client.cmd_sock, [cmd_upload.name, args[1], filename, 'PASS'])
+
+			# offer file to target user
+			offer_file(new_client, target_client, filename, download_path)
+			# upload cmd is finished.
+
+		# Receive File
+		elif name == cmd_receive.name:
+			filename = args[2].strip('"') # name of sent file (may have quotes to preserve spaces)
+			path = args[3].strip('"') # path to target download
+			# check if user accepts and is able to receive file...
+			data = receive_data(new_client.cmd_sock)
+			try:
+				if check_pass(data) == SUCCESS: # ready to download
+					# send full file to client
+					upload_file(new_client.cmd_sock,path,False)
+			except Exception: # do not upload file
+				pass
+			try: # delete server-side download file
+				os.remove(path)
+			except Exception as e: # could not be deleted
+				if DEBUG:
+					screen.add(f'Could not remove: \'{path}\'', screen.ATR_CRITICAL)
+					screen.add(str(e))
+				return
+			# receive cmd is finished.
+
+		# --- Evaluate Commands --- 
+
+	# offer a file uploaded by new_client to the target -- new_client is told if the target stays busy and decides whether to keep waiting
+	def offer_file(new_client,target_client,filename,download_path):
+		waiting = True
+		wait_time = 15 #$
+		while waiting:
+			# send command to target user once they are available (use quotes in case of spaces)
+			try:
+				delivered = target_client.command([cmd_receive.name, new_client.username, f'"{filename}"', f'"{download_path}"'], wait_time)
+			except Exception as e:
+				delivered = SUCCESS # sent, with an error
+				if DEBUG:
+					screen.add('Send File Error - target user has left!', screen.ATR_CRITICAL)
+					screen.add(str(e))
+			if delivered == FAILURE: # client is busy
+				if draining: # (the sender is leaving too)
+					break
+				if DEBUG:
+					screen.add(f'{target_client.username} is busy and cannot receive file.', screen.ATR_CRITICAL) #!
+				# tell sender the target was busy
+				send_fail(new_client.cmd_sock)
+				# ask sender to continue waiting or stop
+				reply = receive_data(new_client.cmd_sock)
 				try:
-					if check_pass(data) == SUCCESS: # ready to download
-						# send full file to client
-						upload_file(new_client.cmd_sock,path,False)
-				except Exception: # do not upload file
-					pass
-				try: # delete server-side download file
-					os.remove(path)
-				except Exception as e: # could not be deleted
+					if check_pass(reply) == SUCCESS:
+						waiting = True # keep waiting
+						wait_time = 30 # increase wait time
+					else: # terminate command
+						break
+				except Exception as e: # reply error
 					if DEBUG:
-						screen.add(f'Could not remove: \'{path}\'', screen.ATR_CRITICAL)
-						screen.add(str(e))
-					continue
-				# receive cmd is finished.
-
-			# --- Evaluate Commands --- 
+						screen.add(str(e),screen.ATR_ALERT)
+					break # terminate command
+			else:
+				waiting = False
+				# tell sender the request was sent (with or without error)
+				send_pass(new_client.cmd_sock)
 
-	def kick_client(c,msg):
-		cmd = f'get_kicked {msg}'
-		c.command_lock.acquire() # wait until the instant the target is available...
-		send_msg(c.cmd_sock,cmd) # initiate the client-side kick procedure
-		c.command_lock.release()
+	def kick_client(c,msg): # (holds the command slot)
+		try:
+			send_command(c.cmd_sock,[cmd_get_kicked.name,msg]) # initiate the client-side kick procedure
+		except Exception as e: # already gone
+			pass
+		finally:
+			c.release_slot()
+
+	# the user never became free for a kick (or the shutdown) -- drop the connections instead
+	def cut_off(c):
+		screen.add(f'{c.username} stayed busy and was cut off.', screen.ATR_CAUTION)
+		hang_up_client(c)
+
+	def hang_up_client(c): # both connections -- their threads wake up and remove the client
+		hang_up(c.sock)
+		if c.cmd_sock:
+			hang_up(c.cmd_sock)
+
+	# ping every user who agreed to heartbeats and drop the ones that went quiet -- every HEARTBEAT_INTERVAL on the timer wheel
+	# (a client that vanished without closing its connections would keep its name and place forever)
+	def check_heartbeats():
+		ping = SharedFrame(bytes(str(HEARTBEAT_INTERVAL),ENCODING), screen.ATR_DYNAMIC, MSG_PING)
+		for c in client_list.copy():
+			if not c.active or 'heartbeat' not in get_writer(c.sock).features:
+				continue
+			if peer_silent(c.sock,HEARTBEAT_MISSES):
+				screen.add(f'{c.username} stopped responding and was dropped.', screen.ATR_CAUTION)
+				hang_up_client(c)
+			elif not c.outbox.frames: # (anything queued shows them the server is there)
+				c.send(ping)
+		if not draining:
+			timers.schedule(HEARTBEAT_INTERVAL,check_heartbeats)
 
 	def remove_client(c): # automatically called when sock connection fails
 		global client_list
@@ -1490,12 +3177,27 @@ if __name__ == '__main__':
 		if c not in client_list: # in case client was already removed
 			return
 		try:
+			if c.outbox: # the writer stops
+				c.outbox.close()
+			c.cancel_claims() # nobody waits to send this client a command
 			# close all connections
 			c.sock.close()
-			c.cmd_sock.close()
+			if c.cmd_sock: # may have failed authorization before connecting it
+				c.cmd_sock.close()
+			with pairing: # command connection parked for a pipelined client that never claimed it
+				parked = pending_pairs.pop(c.pair_token, None)
+			if parked:
+				parked[0].close()
 			# delete client records from database
-			client_list.remove(c)
-			reserved_names.remove(name)
+			with departures:
+				client_list.remove(c)
+				departures.notify_all()
+			if bus and name: # the hub frees the name for every worker
+				bus.send('RELEASE',name)
+			elif name in reserved_names:
+				reserved_names.remove(name)
+			if not c.active: # was never announced
+				return
 			if DEBUG:
 				time.sleep(1) #! ensure announcement is after connection errors
 			# announce disconnection
@@ -1506,14 +3208,947 @@ if __name__ == '__main__':
 			screen.add(str(e))
 
 
+	# --- asyncio engine ---
+	# One event loop waits on every connection. The protocol code above (authorize, broadcast, commands, file transfers)
+	# is unchanged: it runs in a thread pool, one handler at a time per connection and only while there is work to do,
+	# so idle users cost a coroutine instead of two blocked threads.
+
+	# Threads that run handlers for the event loop -- started when every thread is busy, they exit after ASYNC_IDLE_TIME without work
+	# (a login waiting on its user holds one, so the count follows the work in progress, not the number of users)
+	class HandlerPool():
+		def __init__(self,limit=None):
+			self.tasks = queue.SimpleQueue()
+			self.lock = threading.Lock()
+			self.idle = 0 # threads waiting for a task
+			self.limit = limit # most threads at once (None = a new one whenever none is idle)
+			self.threads = 0
+			self.backlog = 0 # tasks queued while every thread was busy -- the next thread to finish takes one
+
+		def submit(self,task,args,done):
+			with self.lock:
+				self.tasks.put((task,args,done)) # inside the lock -- a thread that timed out sees it before leaving
+				if self.idle:
+					self.idle -= 1
+					return
+				if self.limit and self.threads >= self.limit:
+					self.backlog += 1
+					return
+				self.threads += 1
+			worker = threading.Thread(target=self.work,daemon=True) # daemon -- quitting never waits for a stuck handler
+			worker.start()
+
+		def work(self):
+			while True:
+				try:
+					task, args, done = self.tasks.get(timeout=ASYNC_IDLE_TIME)
+				except queue.Empty:
+					with self.lock:
+						if self.tasks.empty():
+							self.idle -= 1
+							self.threads -= 1
+							return
+					continue
+				try:
+					task(*args)
+				except Exception as e:
+					screen.add('Handler Error', screen.ATR_ALERT)
+					screen.add(str(e))
+				finally:
+					done()
+				with self.lock:
+					if self.backlog:
+						self.backlog -= 1
+					else:
+						self.idle += 1
+
+	# Connection owned by the event loop -- handlers use it like a socket
+	class LoopSocket():
+		def __init__(self,loop,executor,transport,family):
+			self.loop = loop # anything with call_soon_threadsafe (asyncio loop or Reactor)
+			self.executor = executor # HandlerPool
+			self.transport = transport # writes for the loop -- StreamTransport or ReactorTransport
+			self.family = family
+			self.inbox = bytearray() # bytes that arrived while a handler was running -- it reads them with recv_into
+			self.ready = threading.Condition() # signalled when the inbox grows or the connection closes
+			self.closed = False
+			self.busy = False # a handler is running (loop thread only)
+			self.handler = None # called with each full frame that arrives while idle -- (payload, attr, type, flags)
+			self.inline = False # the handler never blocks -- run it on the loop thread instead of handing off
+			self.on_close = None # called once when the connection is gone and no handler is running
+			self.finished = False
+			self.held = False # paused for a while (flood limits) -- frames wait until it is over
+			self.paused = False # not reading from the connection -- held, or more than ASYNC_HIGH_WATER bytes arrived that were not parsed yet
+
+		# -- socket interface (handler threads) --
+		def recv_into(self,view):
+			with self.ready:
+				while not self.inbox and not self.closed:
+					self.ready.wait()
+				x = min(len(view),len(self.inbox))
+				view[:x] = self.inbox[:x]
+				del self.inbox[:x]
+				if self.paused and not self.held: # may be room to read again
+					self.loop.call_soon_threadsafe(self.throttle)
+				return x
+
+		def recv(self,x):
+			data = bytearray(x)
+			received = self.recv_into(memoryview(data))
+			return bytes(data[:received])
+
+		# the buffers are queued as they are (not joined) -- only those that may still change are copied, so a shared frame
+		# is never copied for each recipient
+		def sendmsg(self,buffers):
+			if self.closed:
+				raise ConnectionError('Connection closed.')
+			buffers = [b if memoryview(b).readonly else bytes(b) for b in buffers]
+			size = sum(len(b) for b in buffers)
+			if self.transport.in_loop(): # inline handler -- queue it directly, the loop never waits
+				self.transport.writelines(buffers)
+				return size
+			self.loop.call_soon_threadsafe(self.transport.writelines, buffers) # queued in order -- the loop writes without blocking
+			if self.transport.buffered() > ASYNC_HIGH_WATER: # slow client -- wait until it catches up
+				self.transport.drain()
+			return size
+
+		def sendall(self,data):
+			self.sendmsg([data])
+
+		def close(self):
+			with self.ready:
+				self.closed = True
+				self.ready.notify_all()
+			self.loop.call_soon_threadsafe(self.transport.close)
+
+		# -- event loop side --
+		# new bytes from the client -- parsed here while idle, passed on to the running handler otherwise
+		def received(self,data):
+			if self.busy:
+				get_reader(self).heard = time.monotonic() # (the handler parses it later)
+				with self.ready:
+					self.inbox += data
+					self.ready.notify_all()
+			else:
+				get_reader(self).feed(data)
+				self.dispatch()
+			self.throttle()
+
+		# start the handler for the next complete frame, if any
+		def dispatch(self):
+			while self.handler and not self.closed and not self.held:
+				try:
+					frame = get_reader(self).poll()
+				except Exception: # corrupt frame
+					self.close()
+					break
+				if not frame:
+					break
+				if not self.inline:
+					self.run(self.handler,frame)
+					return
+				self.handler(frame) # done before the next frame is parsed
+			if self.closed and not self.finished:
+				self.finished = True
+				if self.on_close:
+					self.run(self.on_close)
+
+		# run a blocking task in the pool -- the connection is handed to it until it returns
+		def run(self,task,*args):
+			self.busy = True
+			self.executor.submit(task,args,lambda: self.loop.call_soon_threadsafe(self.resume))
+
+		def resume(self):
+			with self.ready:
+				pending = bytes(self.inbox)
+				self.inbox.clear()
+			self.busy = False
+			get_reader(self).feed(pending)
+			self.dispatch()
+			self.throttle()
+
+		# set the frame handler from any thread
+		def listen(self,handler,on_close=None,inline=False):
+			def start():
+				self.handler = handler
+				self.on_close = on_close
+				self.inline = inline
+				if not self.busy:
+					self.dispatch()
+			self.loop.call_soon_threadsafe(start)
+
+		# stop reading for delay seconds (any thread) -- frames already here wait too, and new bytes stay in the socket buffers
+		def hold(self,delay):
+			def start():
+				if self.held or self.closed:
+					return
+				self.held = True
+				self.throttle()
+				self.loop.call_later(delay,self.unhold)
+			if self.transport.in_loop(): # before the next frame is parsed
+				start()
+			else:
+				self.loop.call_soon_threadsafe(start)
+
+		def unhold(self):
+			self.held = False
+			if not self.busy:
+				self.dispatch()
+			self.throttle()
+
+		# read only while the connection is not held and the bytes waiting to be parsed stay under ASYNC_HIGH_WATER -- the rest waits in the socket buffers (loop thread)
+		def throttle(self):
+			if self.closed:
+				return
+			reader = get_reader(self)
+			paused = self.held or len(self.inbox) + reader.end - reader.start > ASYNC_HIGH_WATER
+			if paused != self.paused:
+				self.paused = paused
+				if paused:
+					self.transport.pause_reading()
+				else:
+					self.transport.resume_reading()
+
+		def lost(self): # end of stream (loop thread)
+			with self.ready:
+				self.closed = True
+				self.ready.notify_all()
+			if not self.busy:
+				self.dispatch()
+
+	# asyncio writes -- StreamWriter calls made on the loop thread
+	class StreamTransport():
+		def __init__(self,loop,writer):
+			self.loop = loop
+			self.writer = writer
+			self.reading = asyncio.Event() # cleared while reading is paused -- the connection's coroutine waits for it
+			self.reading.set()
+
+		def in_loop(self):
+			try:
+				return asyncio.get_running_loop() is self.loop
+			except RuntimeError: # a handler thread
+				return False
+
+		def writelines(self,buffers):
+			self.writer.writelines(buffers)
+
+		def buffered(self):
+			return self.writer.transport.get_write_buffer_size()
+
+		def drain(self):
+			asyncio.run_coroutine_threadsafe(self.writer.drain(),self.loop).result()
+
+		# call back once the client has caught up (loop thread)
+		def when_drained(self,callback):
+			async def drained():
+				try:
+					await self.writer.drain()
+				except (ConnectionError, RuntimeError): # gone -- the outbox is closed with the client
+					return
+				callback()
+			self.loop.create_task(drained())
+
+		# (not the transport's own pause_reading -- the stream reader resumes that whenever its buffer empties)
+		def pause_reading(self):
+			self.reading.clear()
+
+		def resume_reading(self):
+			self.reading.set()
+
+		def close(self):
+			self.writer.close()
+
+	# chat connection: authorize, then broadcast every message it sends
+	def admit_async_client(sock,addr):
+		new_client = finish_login(admit_client(sock,addr))
+		if new_client:
+			inline = ENGINE == 'selectors' # the reactor delivers broadcasts itself -- nothing to wait for
+			sock.listen(lambda frame: receive_chat(new_client,frame[0],frame[1]), lambda: remove_client(new_client), inline)
+
+	def listen_async_commands(new_client):
+		new_client.cmd_sock.listen(lambda frame: run_command(new_client,frame_command(*frame)))
+
+	def run_asyncio_engine(listeners):
+		global listen_commands, async_loop
+		listen_commands = listen_async_commands # attach_commands hands the command connection to the loop
+		if 'mux' in PROTOCOL_FEATURES: # channels are read by blocking threads -- not offered here
+			PROTOCOL_FEATURES.remove('mux')
+		loop = asyncio.new_event_loop()
+		executor = HandlerPool()
+
+		def serve(listener,channel):
+			async def connection(reader,writer):
+				tune_socket(writer.get_extra_info('socket'),PROFILE,channel)
+				address = peer_address(listener,writer.get_extra_info('peername'))
+				sock = LoopSocket(loop,executor,StreamTransport(loop,writer),listener.family)
+				if channel == CHANNEL_CHAT:
+					screen.add(f'received connection from {address}', screen.ATR_HIGHLIGHT) # acknowledge connection
+					screen.display()
+					reason = check_admission(sock)
+					if reason:
+						sock.run(reject_connection,sock,reason)
+					else:
+						sock.run(admit_async_client,sock,address)
+				else:
+					sock.run(attach_connection,sock,address)
+				while True:
+					await sock.transport.reading.wait() # paused -- the stream reader fills up and stops the transport
+					try:
+						data = await reader.read(1 << 16) # whatever has arrived, up to 64 KiB
+					except OSError:
+						data = b''
+					if not data: # disconnected
+						break
+					sock.received(data)
+				sock.lost()
+				writer.close()
+			return connection
+
+		async def main():
+			for listener, channel in listeners:
+				server = await asyncio.start_server(serve(listener,channel),sock=listener,backlog=TRANSPORT_PROFILES[PROFILE]['backlog'])
+				async_servers.append(server)
+			await loop.create_future() # serve forever
+
+		async_loop = loop
+		loop.run_until_complete(main())
+
+	# --- selectors engine ---
+	# A single reactor thread waits on every socket with selectors (epoll, kqueue...) and does all of the reading and writing.
+	# Frames are parsed as bytes arrive (FrameReader.feed/poll); chat messages are broadcast right there, in the order they
+	# arrived, so broadcasts need no lock. Logins and commands talk back and forth with the user -- those still go to the pool.
+
+	class Reactor():
+		def __init__(self):
+			self.selector = selectors.DefaultSelector()
+			self.calls = queue.SimpleQueue() # (task, args) to run on the reactor thread
+			self.timers = [] # heap of (time.monotonic() when due, sequence, task, args) -- reactor thread only
+			self.sequence = itertools.count() # keeps timers due at the same moment in order
+			self.waker, self.alarm = socket.socketpair() # a byte on alarm wakes up select()
+			for sock in [self.waker, self.alarm]:
+				sock.setblocking(False)
+			self.selector.register(self.waker,selectors.EVENT_READ,self.woken)
+			self.listeners = []
+			self.thread = None
+
+		def in_loop(self):
+			return threading.get_ident() == self.thread
+
+		def call_soon_threadsafe(self,task,*args):
+			self.calls.put((task,args))
+			if not self.in_loop(): # the reactor runs the queue after each select anyway
+				try:
+					self.alarm.send(b'\0')
+				except OSError: # already awake (alarm full)
+					pass
+
+		def call_later(self,delay,task,*args): # (reactor thread)
+			heapq.heappush(self.timers,(time.monotonic()+delay, next(self.sequence), task, args))
+
+		def woken(self,events):
+			try:
+				self.waker.recv(4096)
+			except OSError:
+				pass
+
+		# accept connections from this listener -- opened(sock, address) is called for each (reactor thread)
+		def listen(self,listener,opened):
+			def accept(events):
+				while True:
+					try:
+						sock, address = listener.accept()
+					except OSError: # none left (or the listener was closed)
+						return
+					sock.setblocking(False)
+					opened(sock,address)
+			listener.setblocking(False)
+			self.selector.register(listener,selectors.EVENT_READ,accept)
+			self.listeners.append(listener)
+
+		def close_listeners(self):
+			for listener in self.listeners:
+				self.selector.unregister(listener)
+			self.listeners.clear()
+
+		def run(self):
+			self.thread = threading.get_ident()
+			while True:
+				timeout = max(0, self.timers[0][0] - time.monotonic()) if self.timers else None # until the next timer
+				for key, events in self.selector.select(timeout):
+					self.attempt(key.data,events)
+				while not self.calls.empty():
+					task, args = self.calls.get()
+					self.attempt(task,*args)
+				while self.timers and self.timers[0][0] <= time.monotonic():
+					when, n, task, args = heapq.heappop(self.timers)
+					self.attempt(task,*args)
+
+		def attempt(self,task,*args):
+			try:
+				task(*args)
+			except Exception as e: # keep serving everyone else
+				screen.add('Reactor Error', screen.ATR_ALERT)
+				screen.add(str(e))
+
+	# Non-blocking socket of the reactor -- writes the reactor cannot finish now wait in outbox until the socket is writable
+	class ReactorTransport():
+		def __init__(self,reactor,sock,channel):
+			self.reactor = reactor
+			self.sock = sock
+			self.channel = channel
+			self.outbox = collections.deque() # views of the buffers still to be sent, in order
+			self.queued = 0 # bytes in the outbox
+			self.drained = threading.Condition() # signalled when the outbox gets below ASYNC_HIGH_WATER
+			self.events = selectors.EVENT_READ
+			self.owner = None # LoopSocket
+			self.on_drained = None # called once the outbox gets below ASYNC_HIGH_WATER
+			self.closing = False # flush what is left, then close
+			self.closed = False
+			self.paused = False # not reading for now
+
+		def start(self,owner):
+			self.owner = owner
+			self.reactor.selector.register(self.sock,self.events,self.ready)
+
+		def in_loop(self):
+			return self.reactor.in_loop()
+
+		def ready(self,events):
+			if events & selectors.EVENT_WRITE:
+				self.flush()
+			if events & selectors.EVENT_READ and not self.closing and not self.paused:
+				try:
+					data = self.sock.recv(1 << 16) # whatever has arrived, up to 64 KiB
+				except BlockingIOError:
+					return
+				except OSError:
+					data = b''
+				if data:
+					self.owner.received(data)
+				else: # disconnected
+					self.close(False)
+
+		def writelines(self,buffers):
+			if self.closed:
+				return
+			for b in buffers:
+				self.outbox.append(memoryview(b))
+				self.queued += len(b)
+			if len(self.outbox) == len(buffers): # nothing was waiting -- try right away
+				self.flush()
+
+		# send as much of the outbox as the connection takes -- in one scatter/gather call where the platform has it
+		def flush(self):
+			try:
+				if hasattr(self.sock,'sendmsg'):
+					sent = self.sock.sendmsg(list(itertools.islice(self.outbox,REACTOR_BATCH)))
+				else:
+					sent = self.sock.send(self.outbox[0])
+			except BlockingIOError:
+				sent = 0
+			except OSError:
+				self.close(False)
+				return
+			with self.drained:
+				self.queued -= sent
+				# drop every buffer that was fully sent, trim the one that was cut off
+				while self.outbox and sent >= len(self.outbox[0]):
+					sent -= len(self.outbox.popleft())
+				if sent:
+					self.outbox[0] = self.outbox[0][sent:]
+				if self.queued <= ASYNC_HIGH_WATER:
+					self.drained.notify_all()
+			if self.on_drained and self.queued <= ASYNC_HIGH_WATER:
+				callback, self.on_drained = self.on_drained, None
+				callback()
+			if self.closing and not self.outbox:
+				self.close(False)
+				return
+			self.watch()
+
+		# wait for what the connection needs now -- writable while the outbox holds data, readable unless closing or paused (reactor thread)
+		def watch(self):
+			if self.closed:
+				return
+			events = (selectors.EVENT_WRITE if self.outbox else 0) | (0 if self.closing or self.paused else selectors.EVENT_READ)
+			if events == self.events:
+				return
+			if not events: # nothing to wait for
+				self.reactor.selector.unregister(self.sock)
+			elif not self.events:
+				self.reactor.selector.register(self.sock,events,self.ready)
+			else:
+				self.reactor.selector.modify(self.sock,events,self.ready)
+			self.events = events
+
+		def pause_reading(self):
+			self.paused = True
+			self.watch()
+
+		def resume_reading(self):
+			self.paused = False
+			self.watch()
+
+		def buffered(self):
+			return self.queued
+
+		def when_drained(self,callback): # (reactor thread)
+			self.on_drained = callback
+
+		def drain(self):
+			if self.channel == CHANNEL_CHAT: # the reactor writes chat itself -- waiting with the writer lock held would stall it
+				return
+			with self.drained:
+				self.drained.wait_for(lambda: self.queued <= ASYNC_HIGH_WATER or self.closed)
+
+		def close(self,flush=True):
+			if self.closed:
+				return
+			if flush and self.outbox: # finish sending first
+				self.closing = True
+				self.flush()
+				self.owner.lost()
+				return
+			self.closed = True
+			if self.events:
+				self.reactor.selector.unregister(self.sock)
+			self.sock.close()
+			with self.drained:
+				self.drained.notify_all()
+			self.owner.lost()
+
+	# every broadcast is delivered by the reactor thread, one after the other
+	def reactor_broadcast(data, attr=screen.ATR_DYNAMIC, wire=None, chat=True):
+		if reactor.in_loop():
+			deliver(data,attr,wire,chat)
+		else:
+			reactor.call_soon_threadsafe(deliver,bytes(data),attr,None,chat)
+
+	def run_reactor_engine(listeners):
+		global listen_commands, broadcast
+		listen_commands = listen_async_commands # attach_commands hands the command connection to the reactor
+		broadcast = reactor_broadcast
+		if 'mux' in PROTOCOL_FEATURES: # channels are read by blocking threads -- not offered here
+			PROTOCOL_FEATURES.remove('mux')
+		executor = HandlerPool()
+
+		def serve(listener,channel):
+			def opened(conn,address):
+				tune_socket(conn,PROFILE,channel)
+				address = peer_address(listener,address)
+				transport = ReactorTransport(reactor,conn,channel)
+				sock = LoopSocket(reactor,executor,transport,listener.family)
+				transport.start(sock)
+				if channel == CHANNEL_CHAT:
+					screen.add(f'received connection from {address}', screen.ATR_HIGHLIGHT) # acknowledge connection
+					screen.display()
+					reason = check_admission(sock)
+					if reason:
+						sock.run(reject_connection,sock,reason)
+					else:
+						sock.run(admit_async_client,sock,address)
+				else:
+					sock.run(attach_connection,sock,address)
+			return opened
+
+		for listener, channel in listeners:
+			reactor.listen(listener,serve(listener,channel))
+		reactor.run()
+
+	# --- worker processes ---
+	# With --workers N the server forks N processes. Each one listens on its own SO_REUSEPORT sockets (the kernel spreads new
+	# connections between them) and serves its clients with the threads engine. This process stays behind as the hub: it keeps
+	# the screen, the names and the members of every worker, and relays what users of different workers share -- broadcasts
+	# (in one order for everyone), presence, and commands aimed at a user of another worker. A command connection that reaches
+	# the wrong worker is handed over to the right one as a file descriptor.
+
+	# stand-in for the screen in a worker -- lines are shown by the hub, everything else is the hub's business
+	class WorkerScreen():
+		def __init__(self,bus):
+			self.bus = bus
+			self.sending = threading.local() # a failed send adds an error line of its own -- not passed on
+
+		def add(self,text='',attr=None,record=True):
+			if getattr(self.sending,'line',False): # the bus is gone
+				return
+			self.sending.line = True
+			try:
+				self.bus.send('LOG',str(text),attr)
+			finally:
+				self.sending.line = False
+
+		def __getattr__(self,name):
+			if name.startswith('ATR_'):
+				return getattr(mycurses.Screen,name)
+			return self # display(), pause(), typebox.new_prompt()... do nothing
+
+		def __call__(self,*args,**kwargs):
+			return None
+
+	# one end of the bus between the hub and a worker -- pickled messages, and a second socket that carries descriptors
+	class BusLink():
+		def __init__(self,sock,handoff,number,pid=None):
+			self.sock = sock # stream of framed messages
+			self.handoff = handoff # SOCK_SEQPACKET -- one message and one descriptor per packet
+			self.number = number # worker number
+			self.pid = pid # worker process (hub side)
+			set_protocol(sock,PROTOCOL_VERSION,['fragments'])
+
+		def send(self,*message):
+			send_data(self.sock,pickle.dumps(message))
+
+		def receive(self): # None once the other end is gone
+			data = receive_data(self.sock)
+			if data == FAILURE:
+				return None
+			return pickle.loads(data)
+
+		# give a socket to the other end -- this copy is closed
+		def pass_socket(self,sock,*message):
+			socket.send_fds(self.handoff,[pickle.dumps(message)],[sock.fileno()])
+			sock.close()
+
+		def receive_socket(self): # (message, socket), None once the other end is gone
+			try:
+				data, fds, flags, address = socket.recv_fds(self.handoff,1 << 16,1)
+			except OSError:
+				return None
+			if not data or not fds:
+				return None
+			return pickle.loads(data), socket.socket(fileno=fds[0])
+
+	# the worker's end of the bus
+	class WorkerBus(BusLink):
+		def __init__(self,*args):
+			BusLink.__init__(self,*args)
+			self.replies = {} # request number -> [Event, answer]
+			self.requests = 0
+			self.lock = threading.Lock()
+
+		# ask the hub and wait for the answer (None if it does not come)
+		def request(self,kind,*args):
+			with self.lock:
+				self.requests += 1
+				number = self.requests
+				reply = self.replies[number] = [threading.Event(), None]
+			self.send(kind,number,*args)
+			reply[0].wait(BUS_TIMEOUT)
+			with self.lock:
+				del self.replies[number]
+			return reply[1]
+
+		def hand_over(self,sock,address,name):
+			self.pass_socket(sock,'COMMAND',name,address)
+
+		# messages from the hub -- returns when told to quit, or when the hub is gone
+		def run(self):
+			handoffs = threading.Thread(target=self.run_handoffs,daemon=True)
+			handoffs.start()
+			while True:
+				message = self.receive()
+				if not message or message[0] == 'QUIT':
+					return
+				kind, args = message[0], message[1:]
+				if kind == 'DELIVER':
+					broadcast(*args)
+				elif kind == 'ROSTER': # names and members of every worker
+					names, hidden, everyone = args
+					with name_lock:
+						reserved_names[:] = names
+						hidden_names[:] = hidden
+						members.clear()
+						members.update(everyone)
+				elif kind == 'REPLY':
+					with self.lock:
+						reply = self.replies.get(args[0])
+					if reply:
+						reply[1] = args[1]
+						reply[0].set()
+				elif kind == 'CALL':
+					threading.Thread(target=run_call,args=args,daemon=True).start()
+				elif kind == 'CONSOLE':
+					threading.Thread(target=execute_command,args=(args[0],False),daemon=True).start()
+				elif kind == 'ERASE': # the hub reports for every worker
+					threading.Thread(target=self.erase,args=(args[0],),daemon=True).start()
+				elif kind == 'FLOODED': # chat over the flood limits, for the hub's /list
+					self.send('ANSWER',args[0],{c.username: c.flooded for c in client_list.copy() if c.active})
+
+		# clear the screens of this worker's clients and tell the hub how it went
+		def erase(self,number):
+			self.send('ANSWER',number,command_all([cmd_cls.name],15))
+
+		# command connections passed on by the hub
+		def run_handoffs(self):
+			while True:
+				received = self.receive_socket()
+				if not received:
+					return
+				(kind, name, address), sock = received
+				attach_connection(sock,address,name)
+
+	# user served by another worker -- what other users do to them is carried out by that worker
+	class RemoteClient(Client):
+		def __init__(self,name,worker,address,hidden):
+			Client.__init__(self,None,address)
+			self.username = name
+			self.worker = worker
+			self.hidden = hidden
+			self.active = True
+
+		def call(self,operation,*args):
+			return bus.request('CALL',self.username,operation,args)
+
+		def tell(self,msg,attr):
+			self.call('tell',msg,attr)
+
+		def busy(self):
+			return self.call('busy')
+
+		def command(self,args,timeout):
+			return self.call('command',args,timeout)
+
+		def kick(self,msg):
+			self.call('kick',msg)
+
+	# carry out an operation on one of this worker's clients for another worker
+	def run_call(number,origin,name,operation,args):
+		answer = None
+		target = find_user(name)
+		if target in client_list and operation in REMOTE_OPERATIONS:
+			try:
+				answer = getattr(target,operation)(*args)
+			except Exception as e:
+				screen.add(f'Worker Error - {operation} {name}', screen.ATR_ALERT)
+				screen.add(str(e))
+		bus.send('RESULT',number,origin,answer)
+
+	class Hub():
+		def __init__(self,links):
+			self.links = {link.number: link for link in links}
+			self.owners = {} # reserved name -> worker of that client
+			self.claims = {} # pairing token -> worker waiting for that command connection
+			self.parked = {} # pairing token -> (socket, address) that arrived before its claim
+			self.answers = {} # gather number -> worker -> answer
+			self.gathers = 0
+			self.answered = threading.Condition() # signalled when a worker answers
+			self.stopped = False
+
+		def start(self):
+			for link in self.links.values():
+				threading.Thread(target=self.serve,args=(link,),daemon=True).start()
+				threading.Thread(target=self.serve_handoffs,args=(link,),daemon=True).start()
+
+		def send(self,number,*message):
+			self.links[number].send(*message)
+
+		def send_all(self,*message):
+			with delivery_lock: # every worker gets messages in the same order
+				for link in self.links.values():
+					link.send(*message)
+
+		# send a message to every worker and wait up to timeout seconds for all of them to answer -- returns worker -> answer
+		def gather(self,kind,timeout):
+			with self.answered:
+				self.gathers += 1
+				number = self.gathers
+				answers = self.answers[number] = {}
+			self.send_all(kind,number)
+			deadline = time.monotonic() + timeout
+			with self.answered:
+				self.answered.wait_for(lambda: len(answers) == len(self.links), max(0, deadline - time.monotonic()))
+				del self.answers[number]
+				return dict(answers)
+
+		def share_roster(self):
+			with name_lock:
+				self.send_all('ROSTER',reserved_names,hidden_names,members)
+
+		def serve(self,link):
+			while True:
+				message = link.receive()
+				if not message: # worker is gone
+					return
+				kind, args = message[0], message[1:]
+				if kind == 'LOG':
+					screen.add(*args)
+					screen.display()
+				elif kind == 'PUBLISH':
+					self.send_all('DELIVER',*args)
+				elif kind == 'RESERVE':
+					number, name = args
+					with name_lock:
+						free = name not in reserved_names
+						if free:
+							reserved_names.append(name)
+							self.owners[name] = link.number
+					link.send('REPLY',number,free)
+					if free:
+						self.share_roster()
+				elif kind == 'RELEASE':
+					name, = args
+					with name_lock:
+						for names in [reserved_names, hidden_names]:
+							if name in names:
+								names.remove(name)
+						members.pop(name,None)
+						self.owners.pop(name,None)
+					self.share_roster()
+				elif kind == 'JOIN':
+					name, address, hidden = args
+					with name_lock:
+						members[name] = (link.number,address,hidden)
+					self.share_roster()
+				elif kind == 'HIDE':
+					name, hidden = args
+					with name_lock:
+						if name in members:
+							members[name] = members[name][:2] + (hidden,)
+						if hidden and name not in hidden_names:
+							hidden_names.append(name)
+						elif not hidden and name in hidden_names:
+							hidden_names.remove(name)
+					self.share_roster()
+				elif kind == 'CLAIM': # a pipelined client is waiting for its command connection on this worker
+					token, = args
+					with pairing:
+						parked = self.parked.pop(token,None)
+						if not parked:
+							self.claims[token] = link.number
+							timers.schedule(PAIR_TIMEOUT,self.expire,token)
+					if parked:
+						link.pass_socket(parked[0],'COMMAND','PAIR ' + token,parked[1])
+				elif kind == 'CALL': # pass it on to the worker serving the target
+					number, name, operation, call_args = args
+					entry = members.get(name)
+					if entry:
+						self.send(entry[0],'CALL',number,link.number,name,operation,call_args)
+					else:
+						link.send('REPLY',number,None)
+				elif kind == 'RESULT':
+					number, origin, answer = args
+					self.send(origin,'REPLY',number,answer)
+				elif kind == 'ANSWER': # to a gather
+					number, answer = args
+					with self.answered:
+						if number in self.answers: # (late answers are left out)
+							self.answers[number][link.number] = answer
+							self.answered.notify_all()
+
+		# command connections that reached the wrong worker
+		def serve_handoffs(self,link):
+			while True:
+				received = link.receive_socket()
+				if not received:
+					return
+				(kind, name, address), sock = received
+				if name.startswith('PAIR '): # goes to whoever claims the token
+					token = name[5:]
+					with pairing:
+						number = self.claims.pop(token,None)
+						if number is None and len(self.parked) < PAIR_LIMIT and token not in self.parked:
+							self.parked[token] = (sock, address)
+							timers.schedule(PAIR_TIMEOUT,self.expire,token)
+						elif number is None: # too many waiting (or the token is taken)
+							sock.close()
+				else: # goes to the worker that reserved the name
+					number = self.owners.get(name)
+					if number is None:
+						send_fail(sock)
+						sock.close()
+				if number is not None:
+					self.links[number].pass_socket(sock,'COMMAND',name,address)
+
+		# give up on a pairing token
+		def expire(self,token):
+			with pairing:
+				self.claims.pop(token,None)
+				parked = self.parked.pop(token,None)
+			if parked:
+				parked[0].close()
+
+		# tell every worker to disconnect its clients and wait for them to finish
+		def stop(self):
+			if self.stopped:
+				return
+			self.stopped = True
+			self.send_all('QUIT')
+			deadline = time.monotonic() + DRAIN_TIMEOUT + 5 # (they drain their clients first)
+			exits = {}
+			for link in self.links.values(): # each worker is reaped the moment it exits
+				exits[link] = threading.Thread(target=self.reap,args=(link.pid,),daemon=True)
+				exits[link].start()
+			for link, exit in exits.items():
+				exit.join(max(0, deadline - time.monotonic()))
+				if exit.is_alive():
+					screen.add(f'Quit Error - worker {link.number} did not stop in time.', screen.ATR_ALERT)
+					os.kill(link.pid,signal.SIGKILL)
+
+		def reap(self,pid):
+			try:
+				os.waitpid(pid,0)
+			except ChildProcessError: # already gone
+				pass
+
+	# start the workers -- returns (worker number, bus) in a worker, (0, None) in the hub
+	def fork_workers():
+		global hub
+		links = []
+		for number in range(1,WORKERS+1):
+			stream = socket.socketpair()
+			handoff = socket.socketpair(socket.AF_UNIX,socket.SOCK_SEQPACKET)
+			pid = os.fork()
+			if pid == 0: # the new worker -- only talks to the hub
+				for link in links:
+					link.sock.close()
+					link.handoff.close()
+				stream[0].close()
+				handoff[0].close()
+				return number, WorkerBus(stream[1],handoff[1],number)
+			stream[1].close()
+			handoff[1].close()
+			links.append(BusLink(stream[0],handoff[0],number,pid))
+		hub = Hub(links)
+		return 0, None
+
+	# a listening socket of this worker on a port every worker shares
+	def shared_port(port):
+		sock = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+		sock.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEPORT,1)
+		sock.bind((IP,port))
+		return sock
+
+	# close the listening sockets -- the event loop closes its own
+	def stop_listening():
+		if reactor and reactor.thread:
+			closed = threading.Event()
+			reactor.call_soon_threadsafe(lambda: (reactor.close_listeners(), closed.set()))
+			closed.wait(5)
+		if async_loop:
+			async def close_servers():
+				for server in async_servers:
+					server.close()
+			try:
+				asyncio.run_coroutine_threadsafe(close_servers(),async_loop).result(5)
+			except Exception as e:
+				screen.add(str(e))
+		SERVER_SOCKET.close()
+		COMMAND_SOCKET.close()
+		for listener in UNIX_SOCKETS:
+			listener.close()
+
 	# Initial screen settings for server
 	screen.locked = True
 	screen.typebox.new_prompt(announce(SERVER_NAME))
 	if screen.show_box:
 		screen.toggle_typing() # hide input box while connections are established
 	screen.output_function = deliver_news # messages entered by the server are broadcasted to all users
+	console_pool = HandlerPool()
+	command_pool = HandlerPool(BROADCAST_WORKERS)
 
 	# attempt to bind the sockets to the specified addresses so they can accept incoming connections on those addresses
+	if WORKERS > 1: # every worker binds the same ports
+		for sock in [SERVER_SOCKET, COMMAND_SOCKET]:
+			sock.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEPORT,1)
 	try:
 		SERVER_SOCKET.bind((IP, PORT))
 		screen.add(f'Server socket sucessfully bound to {IP}:{PORT}', screen.ATR_SUCCESS)
@@ -1535,23 +4170,86 @@ if __name__ == '__main__':
 		screen.pause(1)
 		exit(2)
 
-	# prepare to listen for connections (max. queue of 5)
-	SERVER_SOCKET.listen(5)
-	COMMAND_SOCKET.listen(5)
-	screen.add('Listening for connections...')
-	screen.display()
+	# local clients -- same protocol over unix domain sockets
+	if UNIX_PATH:
+		for path in [UNIX_PATH, UNIX_PATH + COMMAND_SUFFIX]:
+			try:
+				if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode): # left behind by a previous run
+					os.remove(path)
+				listener = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+				listener.bind(path)
+				UNIX_SOCKETS.append(listener)
+				screen.add(f'Local socket sucessfully bound to {path}', screen.ATR_SUCCESS)
+			except (OSError, AttributeError) as e: # AttributeError -- no AF_UNIX on this platform
+				screen.add(f'Err.2 - Local socket could not bind to {path}', screen.ATR_ALERT)
+				screen.add(str(e))
+				screen.pause(1)
+				exit(2)
+		screen.add()
 
-	welcome_users = threading.Thread(target=accept_connections,daemon=True)
-	welcome_users.start() # begin accepting connections...
+	threading.stack_size(STACK_SIZE) # for every thread started from here on
+
+	# worker processes -- from here on this process is either the hub or one of the workers
+	if WORKERS > 1:
+		WORKER, bus = fork_workers()
+		if WORKER:
+			screen = WorkerScreen(bus) # the hub shows what happens here
+			timers = TimerWheel() # (the wheel thread stayed behind in the hub)
+			SERVER_SOCKET.close()
+			COMMAND_SOCKET.close()
+			SERVER_SOCKET, COMMAND_SOCKET = shared_port(PORT), shared_port(CPORT)
+		else:
+			hub.start()
+			screen.add(f'Listening for connections... [{PROFILE} profile, {WORKERS} workers]')
+			screen.display()
+
+	# prepare to listen for connections -- buffer sizes are set before listen() so accepted connections can use large windows
+	if not hub: # (the workers listen)
+		backlog = TRANSPORT_PROFILES[PROFILE]['backlog'] # max. queue of unaccepted connects
+		for listener, channel in zip([SERVER_SOCKET, COMMAND_SOCKET] + UNIX_SOCKETS, [CHANNEL_CHAT, CHANNEL_COMMAND]*2):
+			tune_socket(listener,PROFILE,channel)
+			listener.listen(backlog)
+		if not WORKER:
+			screen.add(f'Listening for connections... [{PROFILE} profile, {ENGINE} engine]')
+			screen.display()
+
+		listeners = list(zip([SERVER_SOCKET, COMMAND_SOCKET] + UNIX_SOCKETS, [CHANNEL_CHAT, CHANNEL_COMMAND]*2))
+		if ENGINE == 'asyncio': # every connection on one event loop
+			event_loop = threading.Thread(target=run_asyncio_engine,args=(listeners,),daemon=True)
+			event_loop.start()
+		elif ENGINE == 'selectors': # every socket on one reactor thread
+			reactor = Reactor()
+			event_loop = threading.Thread(target=run_reactor_engine,args=(listeners,),daemon=True)
+			event_loop.start()
+		else: # threads -- one per connection
+			waiting_room = Reactor()
+			threading.Thread(target=waiting_room.run,daemon=True).start()
+			for i in range(HANDSHAKE_WORKERS):
+				login = threading.Thread(target=process_handshakes,daemon=True)
+				login.start() # new connections are logged in by these...
+			for listener in [SERVER_SOCKET] + UNIX_SOCKETS[:1]:
+				welcome_users = threading.Thread(target=accept_connections,args=(listener,),daemon=True)
+				welcome_users.start() # begin accepting connections...
+
+			for listener in [COMMAND_SOCKET] + UNIX_SOCKETS[1:]:
+				initiate_commands = threading.Thread(target=configure_commands,args=(listener,),daemon=True)
+				initiate_commands.start() # establish users command connection...
+		if 'heartbeat' in PROTOCOL_FEATURES:
+			timers.schedule(HEARTBEAT_INTERVAL,check_heartbeats)
+
+	if bus: # worker -- serve until the hub says quit (or is gone)
+		bus.run()
+		disconnect_all()
+		os._exit(0) # the hub cleans up the rest
 
-	initiate_commands = threading.Thread(target=configure_commands,daemon=True)
-	initiate_commands.start() # establish users command connection...
-	
 	screen.run() # gain control over the interface -- only process in main
 
 	# Server Quit;
 	# close open connections
-	SERVER_SOCKET.close()
-	COMMAND_SOCKET.close()
+	stop_listening()
+	if hub: # quit without /quit -- the workers still have to go
+		hub.stop()
+	for path in [UNIX_PATH, UNIX_PATH + COMMAND_SUFFIX] if UNIX_SOCKETS else []:
+		os.remove(path)
 	screen.close()
 	clear_downloads()
\ No newline at end of file